@@ -0,0 +1,274 @@
+"""Reader analytics: page views and time spent reading.
+
+Browsers report through the ``/beacon`` endpoint. Increments are coalesced
+per post in an in-process buffer and written with one batched UPDATE every
+few seconds, or sooner once enough events pile up, so readers never queue
+on SQLite's write lock one page view at a time. The same transaction adds
+the counts to the hourly buckets ``rankings`` builds its lists from.
+
+Live reader presence (heartbeats and the reader-count event stream) is kept
+by ``presence``; this module only exposes it.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy import bindparam, func, select, update
+
+from app import db
+from models import Post
+from presence import get_presence
+from rankings import maybe_refresh, record_activity
+
+analytics = Blueprint('analytics', __name__)
+
+log = logging.getLogger(__name__)
+
+# One beacon can never claim more reading time than this
+MAX_SECONDS_PER_BEACON = 600
+
+# An id above the newest post re-reads the newest id at most this often
+KNOWN_POSTS_CHECK_SECONDS = 1.0
+
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+class AnalyticsBuffer:
+    def __init__(self, app, flush_interval=5.0, max_events=500, max_posts=5000):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self.max_posts = max_posts
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._counts = {}
+        self._events = 0
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self._max_post_id = 0
+        self._max_post_id_at = None
+        atexit.register(self.close)
+
+    def known(self, post_id):
+        """Whether ``post_id`` can be a post, so made-up ids never take a buffer slot.
+
+        Ids of deleted posts still pass; the flush skips them.
+        """
+        if 0 < post_id <= self._max_post_id:
+            return True
+        now = time.monotonic()
+        if self._max_post_id_at is not None and now - self._max_post_id_at < KNOWN_POSTS_CHECK_SECONDS:
+            return False
+        self._max_post_id = db.session.query(func.max(Post.id)).scalar() or 0
+        self._max_post_id_at = now
+        return 0 < post_id <= self._max_post_id
+
+    def record(self, post_id, views=0, seconds=0):
+        if not views and not seconds:
+            return
+        with self._lock:
+            counts = self._counts.get(post_id)
+            if counts is None:
+                # Bound memory: past max_posts distinct posts new ones are dropped until a flush
+                if len(self._counts) >= self.max_posts:
+                    self.dropped += 1
+                    self._wake.set()
+                    return
+                counts = self._counts[post_id] = [0, 0]
+            counts[0] += views
+            counts[1] += seconds
+            self._events += 1
+            if self._events >= self.max_events:
+                self._wake.set()
+        self._ensure_worker()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+                self._events = 0
+            if not counts:
+                return 0
+
+            post = Post.__table__
+            stmt = (
+                update(post)
+                .where(post.c.id == bindparam('post_id'))
+                .values(
+                    views=func.coalesce(post.c.views, 0) + bindparam('add_views'),
+                    total_seconds_read=func.coalesce(post.c.total_seconds_read, 0) + bindparam('add_seconds'),
+                )
+            )
+            rows = [
+                {'post_id': post_id, 'add_views': v, 'add_seconds': s}
+                for post_id, (v, s) in counts.items()
+            ]
+            with self.app.app_context():
+                try:
+                    db.session.execute(stmt, rows)
+                    # Only posts that still exist get activity buckets
+                    existing = set(db.session.scalars(select(post.c.id).where(post.c.id.in_(list(counts)))))
+                    record_activity({post_id: c for post_id, c in counts.items() if post_id in existing})
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    log.exception('Analytics flush failed; retrying %d posts on the next cycle', len(rows))
+                    self._requeue(counts)
+                    return 0
+            return len(rows)
+
+    def _requeue(self, counts):
+        with self._lock:
+            for post_id, (v, s) in counts.items():
+                current = self._counts.get(post_id)
+                if current is None:
+                    if len(self._counts) >= self.max_posts:
+                        self.dropped += 1
+                        continue
+                    current = self._counts[post_id] = [0, 0]
+                current[0] += v
+                current[1] += s
+
+    def _ensure_worker(self):
+        # Started lazily and per process, so forked gunicorn workers each get their own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='analytics-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if not self.app.config['JOB_QUEUE_ENABLED']:
+                # Without a queue worker, the flush threads take turns refreshing rankings
+                maybe_refresh(self.app)
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+
+def get_buffer():
+    return current_app.extensions['analytics_buffer']
+
+
+def _beacon_data():
+    data = request.get_json(silent=True, force=True)
+    return data if isinstance(data, dict) else request.form
+
+
+@analytics.route('/beacon', methods=['POST'])
+def beacon():
+    data = _beacon_data()
+    try:
+        post_id = int(data.get('post_id'))
+        seconds = int(float(data.get('seconds') or 0))
+    except (TypeError, ValueError, OverflowError):
+        return '', 400
+    if not get_buffer().known(post_id):
+        return '', 404
+
+    event = data.get('event', 'view')
+    if event == 'view':
+        get_buffer().record(post_id, views=1)
+    elif event == 'read':
+        get_buffer().record(post_id, seconds=max(0, min(seconds, MAX_SECONDS_PER_BEACON)))
+    else:
+        return '', 400
+    return '', 204
+
+
+def _viewer_args():
+    data = _beacon_data()
+    try:
+        post_id = int(data.get('post_id'))
+    except (TypeError, ValueError):
+        return None, None
+    viewer_id = str(data.get('viewer_id') or '')[:100]
+    return post_id, viewer_id or None
+
+
+@analytics.route('/beacon/heartbeat', methods=['POST'])
+def heartbeat():
+    post_id, viewer_id = _viewer_args()
+    if post_id is None or viewer_id is None:
+        return '', 400
+    presence = get_presence()
+    presence.tracker.heartbeat(post_id, viewer_id)
+    return jsonify(readers=presence.count(post_id))
+
+
+@analytics.route('/beacon/leave', methods=['POST'])
+def leave():
+    post_id, viewer_id = _viewer_args()
+    if post_id is None or viewer_id is None:
+        return '', 400
+    get_presence().tracker.leave(post_id, viewer_id)
+    return '', 204
+
+
+@analytics.route('/post/<int:post_id>/readers')
+def readers(post_id):
+    return jsonify(readers=get_presence().count(post_id))
+
+
+@analytics.route('/post/<int:post_id>/readers/stream')
+def readers_stream(post_id):
+    # The stream ends after this long and the browser reconnects, so it never
+    # pins a worker thread indefinitely; 0 turns streams off (see ``presence``)
+    max_seconds = current_app.config['PRESENCE_STREAM_SECONDS']
+    if not max_seconds:
+        return '', 204
+    presence = get_presence()
+    tracker = presence.tracker
+    # Other processes' readers arrive with their snapshots, which no local change signals
+    wait = min(STREAM_KEEPALIVE_SECONDS, presence.snapshot_interval or STREAM_KEEPALIVE_SECONDS)
+
+    def events():
+        deadline = time.monotonic() + max_seconds
+        version = tracker.version(post_id)
+        count = presence.count(post_id)
+        yield f'retry: 5000\ndata: {json.dumps({"readers": count})}\n\n'
+        sent = time.monotonic()
+        while time.monotonic() < deadline:
+            version, _ = tracker.wait_for_change(post_id, version, wait)
+            new_count = presence.count(post_id)
+            if new_count != count:
+                count = new_count
+                yield f'data: {json.dumps({"readers": count})}\n\n'
+                sent = time.monotonic()
+            elif time.monotonic() - sent >= STREAM_KEEPALIVE_SECONDS:
+                yield ': keepalive\n\n'
+                sent = time.monotonic()
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def init_app(app):
+    app.config.setdefault('ANALYTICS_FLUSH_SECONDS', 5.0)
+    app.config.setdefault('ANALYTICS_FLUSH_EVENTS', 500)
+    app.config.setdefault('ANALYTICS_MAX_POSTS', 5000)
+    app.extensions['analytics_buffer'] = AnalyticsBuffer(
+        app,
+        flush_interval=app.config['ANALYTICS_FLUSH_SECONDS'],
+        max_events=app.config['ANALYTICS_FLUSH_EVENTS'],
+        max_posts=app.config['ANALYTICS_MAX_POSTS'],
+    )
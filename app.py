@@ -1,25 +1,38 @@
 import os
-from flask import Flask
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
+from db_profile import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 
-def create_app():
-    app = Flask(__name__)
+def create_app(config=None, instance_path=None):
+    """Build the app; ``config`` overrides settings before any extension reads them (tests use this)."""
+    app = Flask(__name__, instance_path=instance_path)
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-this-in-prod')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///blog.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Proxies in front of the app that append to X-Forwarded-For; rate limits key on the client address
+    app.config['PROXY_FIX_X_FOR'] = int(os.getenv('PROXY_FIX_X_FOR', '0'))
+    app.config.update(config or {})
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 
+    import db_profile
+    db_profile.configure(app)
     db.init_app(app)
+    db_profile.init_app(app, db)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
 
-    # Store the app context for database creation command usage if needed
-    
-    from models import User, Post, SiteSettings, Category
-    
+    from models import User
+    import cache
+    cache.init_app(app)
+
     @login_manager.user_loader
     def load_user(user_id):
         return User.query.get(int(user_id))
@@ -30,22 +43,113 @@ def create_app():
     from main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
+    import storage
+    storage.init_app(app)
+
+    import images
+    app.register_blueprint(images.images)
+    images.init_app(app)
+
+    import analytics
+    import presence
+    app.register_blueprint(analytics.analytics)
+    analytics.init_app(app)
+    presence.init_app(app)
+
+    import instrumentation
+    app.register_blueprint(instrumentation.instrumentation)
+    instrumentation.init_app(app, db)
+
+    import search_index
+    search_index.init_app(app)
+
+    import slugs
+    slugs.init_app(app)
+
+    import jobs
+    jobs.init_app(app)
+
+    import newsletter
+    newsletter.init_app(app)
+
+    import response_cache
+    response_cache.init_app(app)
+
+    import bulk_io
+    bulk_io.init_app(app)
+
+    import migrations
+    migrations.init_app(app)
+
+    import static_export
+    static_export.init_app(app)
+
+    import related
+    related.init_app(app)
+
+    import rendering
+    rendering.init_app(app)
+
+    import rankings
+    rankings.init_app(app)
+
+    import syndication
+    app.register_blueprint(syndication.syndication)
+    syndication.init_app(app)
+
+    import ratelimit
+    import coalesce
+    ratelimit.init_app(app)
+    coalesce.init_app(app)
+
+    @app.context_processor
+    def inject_global_data():
+        return cache.global_data_cache().get()
+
+    app.cli.add_command(bootstrap_command)
+
+    return app
+
+def bootstrap(app):
+    """Create missing tables, apply migrations, build the search index, render posts and seed default categories."""
+    import cache
+    import migrations
+    import rendering
+    import search_index
+    from models import Category
+
     with app.app_context():
-        db.create_all()
-        
+        # Only the primary holds tables; the read bind is the same database or a replica
+        db.create_all(bind_key=None)
+        migrations.upgrade()
+        search_index.ensure_index()
+        rendering.render_stale()
+
         # Initialize default categories if they don't exist
         default_categories = ['World', 'Business', 'Tech']
-        for cat_name in default_categories:
-            if not Category.query.filter_by(name=cat_name).first():
-                db.session.add(Category(name=cat_name))
+        existing = {name for (name,) in db.session.query(Category.name).filter(Category.name.in_(default_categories))}
+        missing = [name for name in default_categories if name not in existing]
+        for cat_name in missing:
+            db.session.add(Category(name=cat_name))
+        if missing:
+            cache.bump_version(cache.GLOBAL_DATA)
         db.session.commit()
-    
-    @app.context_processor
-    def inject_global_data():
-        settings = SiteSettings.query.first()
-        categories = Category.query.order_by(Category.name).all()
-        return dict(social_links=settings, nav_categories=categories)
 
-    return app
-
-app = create_app()
+@click.command('bootstrap')
+@with_appcontext
+def bootstrap_command():
+    """Create the schema and seed default data. Run once per deploy, before starting workers."""
+    bootstrap(current_app._get_current_object())
+    click.echo('Database ready.')
+
+_app = None
+
+def __getattr__(name):
+    # `from app import app`, `gunicorn app:app` and `flask --app app` still work,
+    # but importing this module no longer builds an application
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
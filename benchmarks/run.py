@@ -0,0 +1,403 @@
+"""Route latency benchmarks.
+
+Seeds a database once (see ``seed.py``) and then requests every ``main`` and
+``auth`` route, either in-process through Flask's test client, which also
+counts SQL queries per request, or over HTTP with concurrent workers
+against a local threaded server or any ``--url``. It reports p50/p95/p99
+latency and throughput per route and can save the results as JSON.
+``--baseline`` compares against an earlier result file and exits non-zero
+on regressions.
+
+    python benchmarks/run.py --scale 0.1 --output before.json
+    python benchmarks/run.py --scale 0.1 --baseline before.json --tolerance 0.2
+    python benchmarks/run.py --mode http --concurrency 8 --iterations 500
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+Scenario = namedtuple('Scenario', 'name method path admin form')
+
+SCENARIOS = [
+    Scenario('index', 'GET', '/', False, None),
+    Scenario('index_category', 'GET', '/?category={category}', False, None),
+    Scenario('index_page', 'GET', '/?page={page}', False, None),
+    Scenario('post_detail', 'GET', '/post/{slug}', False, None),
+    Scenario('more_comments', 'GET', '/post/{post_id}/comments', False, None),
+    Scenario('search', 'GET', '/search?q={term}', False, None),
+    Scenario('about', 'GET', '/about', False, None),
+    Scenario('services', 'GET', '/services', False, None),
+    Scenario('submit_form', 'GET', '/submit', False, None),
+    Scenario('login_form', 'GET', '/admin-panel', False, None),
+    Scenario('login', 'POST', '/admin-panel', False, lambda p: {'username': 'bench', 'password': 'bench'}),
+    Scenario('subscribe', 'POST', '/subscribe', False, lambda p: {'email': f'bench-{p["run"]}-{p["i"]}@example.com'}),
+    Scenario('comment', 'POST', '/post/{post_id}/comment', False,
+             lambda p: {'name': 'Bench', 'email': 'bench@example.com', 'content': f'Benchmark comment {p["i"]}'}),
+    Scenario('service_order', 'POST', '/service-order', False,
+             lambda p: {'service_name': 'Consulting', 'customer_name': 'Bench', 'contact_number': '+15550000000'}),
+    Scenario('dashboard', 'GET', '/dashboard', True, None),
+    Scenario('dashboard_posts', 'GET', '/dashboard/posts?page={page}', True, None),
+    Scenario('dashboard_subscribers', 'GET', '/dashboard/subscribers?page={page}', True, None),
+    Scenario('dashboard_submissions', 'GET', '/dashboard/submissions?status=pending', True, None),
+    Scenario('dashboard_orders', 'GET', '/dashboard/orders?status=pending', True, None),
+    Scenario('create_form', 'GET', '/create', True, None),
+    Scenario('edit_form', 'GET', '/edit/{post_id}', True, None),
+]
+
+
+def params(i, scale, run_id):
+    """Values for the i-th request: spread over the seeded rows, the same on every run."""
+    from benchmarks.seed import CATEGORIES, SEARCH_TERMS
+
+    post_id = 1 + (i * 7919) % scale['posts']
+    return {
+        'i': i,
+        'run': run_id,
+        'post_id': post_id,
+        'slug': f'post-{post_id}',
+        'category': CATEGORIES[i % len(CATEGORIES)],
+        'page': 1 + i % 20,
+        'term': SEARCH_TERMS[i % len(SEARCH_TERMS)],
+    }
+
+
+def percentile(samples, pct):
+    # Nearest rank; round() would take the lower of two middle ranks half the time
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+def summarize(latencies, errors, wall, queries=None):
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'rps': round(len(latencies) / wall, 1) if wall else None,
+    }
+    if queries is not None:
+        result['queries'] = round(statistics.fmean(queries), 2)
+    return result
+
+
+def prepare_database(path, scale, reseed):
+    """Point the app at the benchmark database, seeding it on first use; returns the app and row counts."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    if reseed:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    fresh = not os.path.exists(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    from app import bootstrap, create_app, db
+    from benchmarks.seed import seed
+    from models import Comment, Post, ServiceOrder, Submission, Subscriber
+
+    app = create_app()
+    bootstrap(app)
+    with app.app_context():
+        if fresh:
+            started = time.perf_counter()
+            seed(scale)
+            print(f'Seeded {path} in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+        counts = {
+            'posts': db.session.query(Post).count(),
+            'comments': db.session.query(Comment).count(),
+            'subscribers': db.session.query(Subscriber).count(),
+            'orders': db.session.query(ServiceOrder).count(),
+            'submissions': db.session.query(Submission).count(),
+        }
+    if not counts['posts']:
+        raise SystemExit(f'{path} has no posts; run again with --reseed')
+    return app, counts
+
+
+def run_test_client(app, scenarios, iterations, warmup, scale):
+    from sqlalchemy import event
+
+    from app import db
+
+    queries = [0]
+
+    def count(*args):
+        queries[0] += 1
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count)
+
+    anonymous = app.test_client()
+    admin = app.test_client()
+    admin.post('/admin-panel', data={'username': 'bench', 'password': 'bench'})
+    run_id = uuid.uuid4().hex[:8]
+
+    results = {}
+    try:
+        for scenario in scenarios:
+            client = admin if scenario.admin else anonymous
+            latencies, per_request, errors = [], [], 0
+            for i in range(warmup + iterations):
+                p = params(i, scale, run_id)
+                queries[0] = 0
+                started = time.perf_counter()
+                response = client.open(scenario.path.format(**p), method=scenario.method,
+                                       data=scenario.form(p) if scenario.form else None)
+                response.get_data()
+                elapsed = time.perf_counter() - started
+                response.close()
+                if i < warmup:
+                    continue
+                latencies.append(elapsed)
+                per_request.append(queries[0])
+                errors += response.status_code >= 500
+            results[scenario.name] = summarize(latencies, errors, sum(latencies), per_request)
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', count)
+    return results
+
+
+SERVER = """
+import sys
+from werkzeug.serving import run_simple
+from app import create_app
+run_simple(sys.argv[1], int(sys.argv[2]), create_app(), threaded=True)
+"""
+
+
+def start_server():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([sys.executable, '-c', SERVER, '127.0.0.1', str(port)], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit('Benchmark server did not start')
+
+
+class HTTPClient:
+    def __init__(self, base_url, cookie=None):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.cookie = cookie
+        self._local = threading.local()
+
+    def _conn(self):
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return self._local.conn
+
+    def request(self, method, path, form=None):
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn = self._conn()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+        if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+            conn.close()
+        return response
+
+
+def login_cookie(base_url):
+    response = HTTPClient(base_url).request('POST', '/admin-panel', {'username': 'bench', 'password': 'bench'})
+    cookie = response.getheader('Set-Cookie')
+    return cookie.split(';', 1)[0] if cookie else None
+
+
+def run_http(base_url, scenarios, iterations, warmup, scale, concurrency):
+    anonymous = HTTPClient(base_url)
+    admin = HTTPClient(base_url, cookie=login_cookie(base_url))
+    run_id = uuid.uuid4().hex[:8]
+
+    results = {}
+    for scenario in scenarios:
+        client = admin if scenario.admin else anonymous
+        counter = itertools.count()
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                i = next(counter)
+                if i >= warmup + iterations:
+                    return
+                p = params(i, scale, run_id)
+                started = time.perf_counter()
+                try:
+                    status = client.request(scenario.method, scenario.path.format(**p),
+                                            scenario.form(p) if scenario.form else None).status
+                except (http.client.HTTPException, OSError):
+                    status = 599
+                elapsed = time.perf_counter() - started
+                if i < warmup:
+                    continue
+                with lock:
+                    latencies.append(elapsed)
+                    errors[0] += status >= 500
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+        results[scenario.name] = summarize(latencies, errors[0], time.perf_counter() - started)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Regressions against a baseline result: slower p95 beyond tolerance, or more queries."""
+    problems = []
+    for name, current in results['routes'].items():
+        before = baseline['routes'].get(name)
+        if not before:
+            continue
+        limit = before['p95_ms'] * (1 + tolerance)
+        if current['p95_ms'] > limit and current['p95_ms'] - before['p95_ms'] > min_delta_ms:
+            problems.append(f"{name}: p95 {current['p95_ms']:.1f} ms vs {before['p95_ms']:.1f} ms")
+        if 'queries' in current and 'queries' in before and current['queries'] > before['queries'] + 0.5:
+            problems.append(f"{name}: {current['queries']} queries per request vs {before['queries']}")
+        if current['errors'] > before['errors']:
+            problems.append(f"{name}: {current['errors']} errors vs {before['errors']}")
+    return problems
+
+
+def print_table(routes):
+    has_queries = any('queries' in r for r in routes.values())
+    header = f"{'route':<24}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'errors':>8}"
+    print(header + (f"{'queries':>9}" if has_queries else ''))
+    for name, r in routes.items():
+        line = f"{name:<24}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['rps'] or 0:>9.1f}{r['errors']:>8}"
+        print(line + (f"{r.get('queries', 0):>9.1f}" if has_queries else ''))
+
+
+def main(argv=None):
+    from benchmarks.seed import DEFAULT_SCALE
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--mode', choices=['client', 'http'], default='client')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'instance', 'benchmark.db'))
+    parser.add_argument('--reseed', action='store_true', help='Recreate the benchmark database.')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier on the default row counts.')
+    for table, rows in DEFAULT_SCALE.items():
+        parser.add_argument(f'--{table}', type=int, help=f'Rows to seed (default {rows} x scale).')
+    parser.add_argument('--routes', help='Comma-separated scenario names (default: all).')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8, help='HTTP workers.')
+    parser.add_argument('--url', help='Benchmark a running server instead of starting one (http mode).')
+    parser.add_argument('--no-cache', action='store_true', help='Turn the response cache off.')
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    parser.add_argument('--baseline', help='Fail on regressions against this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p95 slowdown.')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help='Ignore p95 slowdowns smaller than this.')
+    args = parser.parse_args(argv)
+
+    scale = {table: getattr(args, table) or max(1, int(rows * args.scale)) for table, rows in DEFAULT_SCALE.items()}
+    scenarios = SCENARIOS
+    if args.routes:
+        wanted = set(args.routes.split(','))
+        scenarios = [s for s in SCENARIOS if s.name in wanted]
+
+    # Memory cache keeps runs independent of whatever is in the on-disk cache
+    os.environ['RESPONSE_CACHE_BACKEND'] = '' if args.no_cache else 'memory'
+    os.environ.setdefault('JOB_QUEUE_ENABLED', '0')
+    # Every request comes from one address; measure the routes, not the limiter
+    os.environ.setdefault('RATE_LIMIT_BACKEND', '')
+    app, counts = prepare_database(os.path.abspath(args.db), scale, args.reseed)
+    scale.update(counts)
+
+    if args.mode == 'client':
+        routes = run_test_client(app, scenarios, args.iterations, args.warmup, scale)
+    else:
+        server = None
+        url = args.url
+        if not url:
+            server, url = start_server()
+        try:
+            routes = run_http(url, scenarios, args.iterations, args.warmup, scale, args.concurrency)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'mode': args.mode,
+            'concurrency': args.concurrency if args.mode == 'http' else 1,
+            'iterations': args.iterations,
+            'response_cache': not args.no_cache,
+            'rows': scale,
+        },
+        'routes': routes,
+    }
+    print_table(routes)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ('mode', 'concurrency', 'response_cache'):
+            if baseline['meta'].get(key) != results['meta'][key]:
+                print(f'warning: baseline was run with a different {key}', file=sys.stderr)
+        # Write scenarios add rows on every run, so only the seeded post count must match
+        if baseline['meta'].get('rows', {}).get('posts') != scale['posts']:
+            print('warning: baseline was run against a different number of posts', file=sys.stderr)
+        problems = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for problem in problems:
+            print(f'REGRESSION {problem}', file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
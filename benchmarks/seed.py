@@ -0,0 +1,134 @@
+"""Deterministic benchmark data.
+
+Fills an empty database through the models in ``models.py`` with batched
+inserts: posts spread over a few categories and years, threaded comments,
+subscribers, submissions and service orders. The same ``seed`` always
+produces the same rows, so runs on different commits are comparable.
+"""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+from app import db
+from models import Category, Comment, Post, ServiceOrder, Submission, Subscriber, User
+from rendering import render_stale
+from search_index import rebuild_index
+
+DEFAULT_SCALE = {
+    'posts': 10000,
+    'comments': 200000,
+    'subscribers': 100000,
+    'orders': 50000,
+    'submissions': 5000,
+}
+
+ADMIN_USERNAME = 'bench'
+ADMIN_PASSWORD = 'bench'
+
+CATEGORIES = ['World', 'Business', 'Tech', 'Markets', 'Policy', 'Science']
+SEARCH_TERMS = ['inflation', 'markets', 'growth', 'policy', 'trade', 'energy']
+WORDS = (
+    'economy inflation markets growth policy trade energy labour wages housing rates bank central '
+    'supply demand prices fiscal budget deficit exports imports currency bonds equities investors '
+    'households productivity technology climate regulation competition startups capital credit'
+).split()
+
+BATCH_SIZE = 5000
+START = datetime(2020, 1, 1)
+
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+def _html(rng, paragraphs):
+    return ''.join(f'<p>{" ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(4))}</p>' for _ in range(paragraphs))
+
+
+def _insert(model, rows):
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[i:i + BATCH_SIZE])
+    db.session.commit()
+
+
+def seed(scale=None, seed=42):
+    """Populate an empty database; returns the row counts written."""
+    scale = dict(DEFAULT_SCALE, **(scale or {}))
+    rng = random.Random(seed)
+
+    admin = User(username=ADMIN_USERNAME, password_hash=generate_password_hash(ADMIN_PASSWORD))
+    db.session.add(admin)
+    existing = {name for (name,) in db.session.query(Category.name)}
+    db.session.add_all(Category(name=name) for name in CATEGORIES if name not in existing)
+    db.session.commit()
+
+    # Posts get explicit ids so comments can point at them without a round trip
+    span = 5 * 365 * 24 * 3600
+    _insert(Post, [
+        {
+            'id': i,
+            'title': f'{_sentence(rng, rng.randint(4, 9))[:-1]} {i}',
+            'slug': f'post-{i}',
+            'content': _html(rng, rng.randint(3, 8)),
+            'category': rng.choice(CATEGORIES),
+            'featured': rng.random() < 0.02,
+            'created_at': START + timedelta(seconds=span * i // scale['posts']),
+            'author_id': admin.id,
+            'views': rng.randint(0, 5000),
+            'total_seconds_read': 0,
+        }
+        for i in range(1, scale['posts'] + 1)
+    ])
+
+    # A third of comments are replies to an earlier comment on the same post
+    comments = []
+    by_post = {}
+    for i in range(1, scale['comments'] + 1):
+        post_id = min(int(rng.paretovariate(1.2)), scale['posts']) if rng.random() < 0.5 else rng.randint(1, scale['posts'])
+        siblings = by_post.setdefault(post_id, [])
+        parent_id = rng.choice(siblings) if siblings and rng.random() < 0.33 else None
+        siblings.append(i)
+        comments.append({
+            'id': i,
+            'name': f'Reader {i % 997}',
+            'email': f'reader{i % 997}@example.com',
+            'content': _sentence(rng, rng.randint(6, 30)),
+            'created_at': START + timedelta(seconds=span * i // scale['comments']),
+            'post_id': post_id,
+            'parent_id': parent_id,
+            'is_admin_reply': False,
+        })
+    _insert(Comment, comments)
+
+    _insert(Subscriber, [
+        {'email': f'subscriber{i}@example.com', 'subscribed_at': START + timedelta(minutes=i)}
+        for i in range(scale['subscribers'])
+    ])
+    _insert(ServiceOrder, [
+        {
+            'service_name': rng.choice(['Consulting', 'Research', 'Training']),
+            'customer_name': f'Customer {i}',
+            'contact_number': f'+1555{i:07d}',
+            'status': rng.choice(['pending', 'contacted', 'completed']),
+            'created_at': START + timedelta(minutes=3 * i),
+        }
+        for i in range(scale['orders'])
+    ])
+    _insert(Submission, [
+        {
+            'author_name': f'Writer {i}',
+            'author_email': f'writer{i}@example.com',
+            'title': _sentence(rng, 6)[:-1],
+            'content': _html(rng, 3),
+            'category': rng.choice(CATEGORIES),
+            'status': rng.choice(['pending', 'approved', 'rejected']),
+            'submitted_at': START + timedelta(hours=i),
+        }
+        for i in range(scale['submissions'])
+    ])
+
+    render_stale()
+    rebuild_index()
+    return scale
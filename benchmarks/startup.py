@@ -0,0 +1,80 @@
+"""Startup time budget.
+
+Times ``import app`` and ``create_app()`` in fresh interpreters and fails
+when the median goes over budget. Flask and SQLAlchemy are imported first
+and reported separately, so the budgets cover this app's own code rather
+than the machine's speed at loading the framework. Building the app must not
+touch the database: the run also fails if the SQLite file exists afterwards.
+
+    python benchmarks/startup.py [--runs 7] [--import-budget-ms 50] [--create-budget-ms 300]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, os, time
+t0 = time.perf_counter()
+import flask, flask_login, flask_sqlalchemy, sqlalchemy.orm
+t1 = time.perf_counter()
+import app
+t2 = time.perf_counter()
+app.create_app()
+t3 = time.perf_counter()
+print(json.dumps({'framework_ms': (t1 - t0) * 1000, 'import_ms': (t2 - t1) * 1000, 'create_ms': (t3 - t2) * 1000}))
+"""
+
+
+def measure(db_path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', RESPONSE_CACHE_BACKEND='memory')
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--import-budget-ms', type=float, default=50)
+    parser.add_argument('--create-budget-ms', type=float, default=300)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'startup.db')
+        samples = [measure(db_path) for _ in range(args.runs)]
+        touched_db = os.path.exists(db_path)
+
+    result = {
+        'runs': args.runs,
+        'framework_ms': statistics.median(s['framework_ms'] for s in samples),
+        'import_ms': statistics.median(s['import_ms'] for s in samples),
+        'create_ms': statistics.median(s['create_ms'] for s in samples),
+        'touched_db': touched_db,
+    }
+    failures = []
+    if result['import_ms'] > args.import_budget_ms:
+        failures.append(f"import app took {result['import_ms']:.0f} ms (budget {args.import_budget_ms:.0f} ms)")
+    if result['create_ms'] > args.create_budget_ms:
+        failures.append(f"create_app() took {result['create_ms']:.0f} ms (budget {args.create_budget_ms:.0f} ms)")
+    if touched_db:
+        failures.append('create_app() created the database; schema work belongs in `flask bootstrap`')
+
+    if args.json:
+        print(json.dumps(dict(result, failures=failures), indent=2))
+    else:
+        print(f"framework:    {result['framework_ms']:.1f} ms (median of {args.runs}, not budgeted)")
+        print(f"import app:   {result['import_ms']:.1f} ms")
+        print(f"create_app(): {result['create_ms']:.1f} ms")
+        for failure in failures:
+            print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""Bulk import and export from the command line.
+
+``flask import-posts`` and ``flask import-submissions`` read JSONL or CSV and
+insert rows in batches with one executemany per batch. Slugs come from an
+in-memory set of taken slugs and missing categories are created once per
+batch, so an import costs a few statements per thousand rows. The search
+index is rebuilt once at the end instead of row by row, and so are related
+posts. Imported views of posts from the last week count as reading
+activity in the hour the post was created, so they show up in the
+rankings like views recorded live.
+
+``flask export <table>`` streams a table through a server-side cursor and
+writes each row as it arrives, so memory use does not grow with the table.
+"""
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+
+from app import db
+from cache import invalidate_global_data
+from models import Category, Post, ServiceOrder, Submission, Subscriber, User
+from rankings import RETAIN_HOURS, current_hour, record_activity, refresh_now
+from related import schedule_rebuild
+from response_cache import invalidate
+from rendering import render
+from search_index import rebuild_index
+from slugs import SlugAllocator
+from syndication import invalidate_documents
+
+BATCH_SIZE = 2000
+
+EXPORT_TABLES = {
+    'posts': Post,
+    'subscribers': Subscriber,
+    'submissions': Submission,
+    'orders': ServiceOrder,
+}
+
+
+def detect_format(filename, fmt):
+    if fmt:
+        return fmt
+    return 'csv' if filename.lower().endswith('.csv') else 'jsonl'
+
+
+def read_rows(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise click.ClickException(f'Line {line_no}: {e}')
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_datetime(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    # Stored datetimes are naive UTC
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+class CategoryResolver:
+    """Creates categories named by imported rows that do not exist yet, one INSERT per batch."""
+
+    def __init__(self):
+        self.known = {name for (name,) in db.session.query(Category.name)}
+        self.created = 0
+
+    def resolve(self, rows):
+        missing = {row['category'] for row in rows if row['category'] not in self.known}
+        if missing:
+            db.session.execute(insert(Category), [{'name': name, 'created_at': datetime.utcnow()} for name in sorted(missing)])
+            self.known |= missing
+            self.created += len(missing)
+
+
+def resolve_author(username):
+    query = db.session.query(User.id)
+    query = query.filter(User.username == username) if username else query.order_by(User.id)
+    row = query.first()
+    if row is None:
+        raise click.ClickException(f'No user {username!r}' if username else 'Create an admin user first')
+    return row.id
+
+
+def post_row(record, author_id, slugs):
+    title = (record.get('title') or '').strip()
+    if not title or not record.get('content'):
+        raise click.ClickException(f'Post is missing a title or content: {record!r:.200}')
+    return {
+        **render(record['content']),
+        'title': title,
+        'slug': slugs.allocate(record.get('slug') or title),
+        'content': record['content'],
+        'category': record.get('category') or 'World',
+        'image_url': record.get('image_url') or None,
+        'featured': parse_bool(record.get('featured')),
+        'created_at': parse_datetime(record.get('created_at')) or datetime.utcnow(),
+        'author_id': author_id,
+        'contributor_name': record.get('contributor_name') or None,
+        'views': int(record.get('views') or 0),
+        'total_seconds_read': 0,
+    }
+
+
+def submission_row(record):
+    if not record.get('title') or not record.get('content') or not record.get('author_email'):
+        raise click.ClickException(f'Submission is missing a title, content or author_email: {record!r:.200}')
+    return {
+        'author_name': record.get('author_name') or record['author_email'],
+        'author_email': record['author_email'],
+        'title': record['title'].strip(),
+        'content': record['content'],
+        'category': record.get('category') or 'World',
+        'image_url': record.get('image_url') or None,
+        'status': record.get('status') or 'pending',
+        'submitted_at': parse_datetime(record.get('submitted_at')) or datetime.utcnow(),
+        'admin_notes': record.get('admin_notes') or None,
+    }
+
+
+def map_row(to_row, record, number):
+    try:
+        return to_row(record)
+    except (TypeError, ValueError) as e:
+        raise click.ClickException(f'Row {number}: {e}: {record!r:.200}')
+
+
+def import_rows(model, records, to_row, finish, batch_size=BATCH_SIZE, on_batch=None):
+    """Insert mapped records in batches, one transaction per batch; returns the number of rows.
+
+    ``on_batch(rows, ids)`` runs in each batch's transaction with the new primary keys.
+    ``finish(rows, categories created)`` runs once at the end, also when a later row
+    fails, so batches that were already committed still get their follow-up work.
+    """
+    categories = CategoryResolver()
+    total = created = 0
+    try:
+        for batch in batches(records, batch_size):
+            rows = [map_row(to_row, record, total + n) for n, record in enumerate(batch, 1)]
+            categories.resolve(rows)
+            if on_batch is None:
+                db.session.execute(insert(model), rows)
+            else:
+                ids = db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+                on_batch(rows, ids)
+            db.session.commit()
+            total += len(rows)
+            created = categories.created
+            click.echo(f'  {total} rows', err=True)
+    finally:
+        db.session.rollback()
+        finish(total, created)
+    return total
+
+
+def record_imported_views(rows, ids):
+    """Add imported views of recent posts to the activity bucket of their creation hour; returns whether any were."""
+    now = current_hour()
+    by_hour = defaultdict(dict)
+    for row, post_id in zip(rows, ids):
+        hour = min(now, current_hour(row['created_at'].replace(tzinfo=timezone.utc).timestamp()))
+        if row['views'] > 0 and hour > now - RETAIN_HOURS:
+            by_hour[hour][post_id] = (row['views'], 0)
+    for hour, counts in by_hour.items():
+        record_activity(counts, hour=hour)
+    return bool(by_hour)
+
+
+def import_posts(records, author_id, batch_size=BATCH_SIZE):
+    slugs = SlugAllocator()
+    ranked = []
+
+    def on_batch(rows, ids):
+        if record_imported_views(rows, ids):
+            ranked.append(True)
+
+    def finish(total, created):
+        if total:
+            rebuild_index()
+            schedule_rebuild()
+            db.session.commit()
+            invalidate('feed')
+            invalidate_documents(everything=True)
+        if ranked:
+            refresh_now()
+        finish_categories(created)
+
+    return import_rows(Post, records, lambda record: post_row(record, author_id, slugs), finish, batch_size, on_batch)
+
+
+def import_submissions(records, batch_size=BATCH_SIZE):
+    return import_rows(Submission, records, submission_row, lambda total, created: finish_categories(created), batch_size)
+
+
+def finish_categories(created):
+    if created:
+        invalidate_global_data()
+        db.session.commit()
+        invalidate('global')
+
+
+def export_rows(model, batch_size=BATCH_SIZE):
+    """Yield a table's rows as dicts, streamed from a server-side cursor."""
+    table = model.__table__
+    statement = select(table).order_by(table.c.id).execution_options(stream_results=True, yield_per=batch_size)
+    for row in db.session.execute(statement):
+        yield dict(row._mapping)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def write_rows(rows, columns, out, fmt):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()})
+            count += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(row, default=_json_default, ensure_ascii=False))
+            out.write('\n')
+            count += 1
+    return count
+
+
+format_option = click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), help='Defaults to the file extension.')
+batch_option = click.option('--batch-size', default=BATCH_SIZE, show_default=True, help='Rows per transaction.')
+
+
+@click.command('import-posts')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@format_option
+@batch_option
+@click.option('--author', help='Username the posts are attributed to (default: the first user).')
+@with_appcontext
+def import_posts_command(source, fmt, batch_size, author):
+    """Import posts from a JSONL or CSV file ('-' for stdin)."""
+    author_id = resolve_author(author)
+    total = import_posts(read_rows(source, detect_format(source.name, fmt)), author_id, batch_size)
+    click.echo(f'Imported {total} posts.')
+
+
+@click.command('import-submissions')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@format_option
+@batch_option
+@with_appcontext
+def import_submissions_command(source, fmt, batch_size):
+    """Import contributor submissions from a JSONL or CSV file ('-' for stdin)."""
+    total = import_submissions(read_rows(source, detect_format(source.name, fmt)), batch_size)
+    click.echo(f'Imported {total} submissions.')
+
+
+@click.command('export')
+@click.argument('table', type=click.Choice(sorted(EXPORT_TABLES)))
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout.')
+@format_option
+@batch_option
+@with_appcontext
+def export_command(table, output, fmt, batch_size):
+    """Stream a table to JSONL or CSV."""
+    model = EXPORT_TABLES[table]
+    columns = [column.name for column in model.__table__.columns]
+    count = write_rows(export_rows(model, batch_size), columns, output, detect_format(output.name, fmt))
+    output.flush()
+    click.echo(f'Exported {count} {table}.', err=True)
+
+
+def init_app(app):
+    app.cli.add_command(import_posts_command)
+    app.cli.add_command(import_submissions_command)
+    app.cli.add_command(export_command)
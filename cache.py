@@ -0,0 +1,113 @@
+"""Process-local caches invalidated through a version stamp in the database.
+
+Each cached value is tagged with the version it was loaded at. Writers bump
+the stamp in the same transaction as their change, and the writing worker
+drops its own copy once that commits. Every worker re-reads the stamp at
+most once per ``check_interval`` seconds and reloads when it moved, so all
+gunicorn workers converge without a query per request.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+from flask import current_app
+from sqlalchemy import update
+
+from app import db
+from jobs import after_commit
+from models import CacheVersion, SiteSettings, Category
+
+GLOBAL_DATA = 'global_data'
+
+
+def read_version(name):
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar()
+    return version or 0
+
+
+def bump_version(name):
+    """Advance a version stamp inside the caller's transaction."""
+    result = db.session.execute(
+        update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+    )
+    if not result.rowcount:
+        db.session.add(CacheVersion(name=name, version=1))
+
+
+class VersionedCache:
+    def __init__(self, name, loader, check_interval=5.0):
+        self.name = name
+        self.loader = loader
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._value is not None and now - self._checked_at < self.check_interval:
+                return self._value
+
+        version = read_version(self.name)
+        with self._lock:
+            if self._value is not None and version == self._version:
+                self._checked_at = now
+                return self._value
+
+        value = self.loader()
+        with self._lock:
+            self._value = value
+            self._version = version
+            self._checked_at = now
+        return value
+
+    def current_version(self):
+        """The version of the value ``get`` returns now."""
+        self.get()
+        with self._lock:
+            return self._version
+
+    def clear(self):
+        with self._lock:
+            self._value = None
+            self._version = None
+            self._checked_at = 0.0
+
+    def invalidate(self):
+        """Bump the stamp in the caller's transaction; this worker drops its copy once that commits."""
+        bump_version(self.name)
+        # Clearing now would let a concurrent request reload the old rows and
+        # keep them until the next version check
+        after_commit(self.clear)
+
+
+def _snapshot(obj, columns):
+    # Plain copies, so cached values never hold on to a closed session
+    return SimpleNamespace(**{c: getattr(obj, c) for c in columns})
+
+
+def load_global_data():
+    settings = SiteSettings.query.first()
+    categories = Category.query.order_by(Category.name).all()
+    settings_columns = [c.key for c in SiteSettings.__table__.columns]
+    return dict(
+        social_links=_snapshot(settings, settings_columns) if settings else None,
+        nav_categories=[_snapshot(c, ('id', 'name', 'created_at')) for c in categories],
+    )
+
+
+def global_data_cache():
+    return current_app.extensions['global_data_cache']
+
+
+def invalidate_global_data():
+    global_data_cache().invalidate()
+
+
+def init_app(app):
+    app.config.setdefault('GLOBAL_DATA_CHECK_SECONDS', 5.0)
+    app.extensions['global_data_cache'] = VersionedCache(
+        GLOBAL_DATA, load_global_data, check_interval=app.config['GLOBAL_DATA_CHECK_SECONDS']
+    )
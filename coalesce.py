@@ -0,0 +1,128 @@
+"""Group small public writes into shared transactions.
+
+Comments, subscriptions and service orders each used to commit on their
+own, and under a burst SQLite serializes every one of those commits.
+``write(fn)`` hands ``fn(session)`` to one writer thread per process. The
+thread collects whatever arrives within ``WRITE_COALESCE_MS`` (up to
+``WRITE_COALESCE_MAX_BATCH`` writes) and commits it all at once. The
+caller blocks until its write has committed and gets back ``fn``'s return
+value or exception. If one write in a batch fails, the batch is rolled
+back and each write is retried on its own, so only that write fails. A
+write still queued after ``WRITE_COALESCE_TIMEOUT`` seconds is withdrawn
+and the caller gets ``WriteTimeout``; routes answer that, and a
+``database is locked`` OperationalError, with a 503.
+
+``fn`` may run more than once. It should build its objects inside the call
+and return plain values, not ORM instances. The caller's own transaction is
+rolled back first, so any changes must be made in ``fn``.
+``WRITE_COALESCE_MS = 0`` commits inline instead.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from flask import current_app
+
+from app import db
+
+
+class WriteTimeout(Exception):
+    """The writer thread did not get to a write in time; it was not saved."""
+
+
+class Coalescer:
+    def __init__(self, app, window, max_batch, timeout=30):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_queue(self):
+        with self._lock:
+            # A forked worker inherits the queue but not the thread draining it
+            if self._queue is None or self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._queue,), name='write-coalescer', daemon=True).start()
+            return self._queue
+
+    def submit(self, fn):
+        future = Future()
+        self._get_queue().put((fn, future))
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise WriteTimeout() from None
+            # The writer picked it up just now; it commits or fails shortly
+            return future.result()
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Skip writes whose caller gave up; the rest can no longer be withdrawn
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self.app.app_context():
+                self._commit(batch)
+
+    def _commit(self, batch):
+        session = db.session
+        try:
+            results = []
+            for fn, _ in batch:
+                results.append(fn(session))
+                session.flush()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                for item in batch:
+                    self._commit([item])
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+def write(fn):
+    """Run ``fn(db.session)`` and commit it, sharing the commit with concurrent writes."""
+    coalescer = current_app.extensions.get('write_coalescer')
+    if coalescer is None:
+        try:
+            result = fn(db.session)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return result
+    # The request's read transaction would hold SQLite's shared lock while the
+    # writer thread waits to commit; under the rollback journal that never succeeds
+    db.session.rollback()
+    return coalescer.submit(fn)
+
+
+def init_app(app):
+    app.config.setdefault('WRITE_COALESCE_MS', int(os.getenv('WRITE_COALESCE_MS', '5')))
+    app.config.setdefault('WRITE_COALESCE_MAX_BATCH', 100)
+    app.config.setdefault('WRITE_COALESCE_TIMEOUT', 30)
+    window = app.config['WRITE_COALESCE_MS']
+    app.extensions['write_coalescer'] = Coalescer(
+        app, window / 1000, app.config['WRITE_COALESCE_MAX_BATCH'], timeout=app.config['WRITE_COALESCE_TIMEOUT']
+    ) if window else None
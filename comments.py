@@ -0,0 +1,62 @@
+"""Threaded comment loading.
+
+A page of top-level comments and every reply beneath them come back from a
+single recursive CTE and are assembled in memory. ``Comment.replies`` is
+pre-populated on each node, so templates can walk the tree without firing a
+lazy load per comment.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from models import Comment
+from pagination import KeysetPage, after, decode_cursor, encode_cursor, newest_first
+
+COMMENTS_PER_PAGE = 20
+
+
+def load_comment_threads(post_id, cursor=None, per_page=COMMENTS_PER_PAGE):
+    """Return a KeysetPage of top-level comments, newest first, with replies attached."""
+    roots = (
+        db.select(Comment.id)
+        .where(Comment.post_id == post_id, Comment.parent_id.is_(None))
+    )
+    position = decode_cursor(cursor)
+    if position:
+        roots = roots.where(after(position, Comment.created_at, Comment.id))
+    roots = roots.order_by(*newest_first(Comment.created_at, Comment.id)).limit(per_page + 1)
+
+    thread = (
+        db.select(Comment.id)
+        .where(Comment.id.in_(roots.scalar_subquery()))
+        .cte('thread', recursive=True)
+    )
+    thread = thread.union_all(db.select(Comment.id).where(Comment.parent_id == thread.c.id))
+
+    rows = (
+        Comment.query
+        .filter(Comment.id.in_(db.select(thread.c.id)))
+        .order_by(Comment.created_at, Comment.id)
+        .all()
+    )
+
+    children = defaultdict(list)
+    top_level = []
+    for comment in rows:
+        if comment.parent_id is None:
+            top_level.append(comment)
+        else:
+            children[comment.parent_id].append(comment)
+    for comment in rows:
+        set_committed_value(comment, 'replies', children.get(comment.id, []))
+
+    top_level.sort(key=lambda c: (c.created_at is not None, c.created_at or datetime.min, c.id), reverse=True)
+    page = position.page if position else 1
+    next_cursor = None
+    if len(top_level) > per_page:
+        top_level = top_level[:per_page]
+        last = top_level[-1]
+        next_cursor = encode_cursor(last.created_at, last.id, page + 1)
+    return KeysetPage(top_level, per_page, next_cursor, page)
@@ -0,0 +1,129 @@
+"""Database engine profiles and read routing.
+
+``DB_PROFILE`` picks the engine tuning. ``production`` (the default) opens
+SQLite in WAL mode, so readers never wait on the writer. It sets a busy
+timeout, so concurrent writers queue instead of failing with "database is
+locked". It also gives each connection a memory map and a larger page
+cache, and sizes the connection pool for several threads per worker.
+``default`` leaves SQLAlchemy's settings alone.
+
+Views decorated with ``@read_only`` send their SELECTs to the ``read``
+engine. That engine is ``DATABASE_READ_URL`` (a replica) when it is set.
+Otherwise, under the production profile, it is a second, query-only pool
+on the same SQLite file. Signed-in users stay on the primary, so they see
+their own writes straight away.
+"""
+import os
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_login import current_user
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+READ_BIND = 'read'
+
+PROFILES = {
+    'default': {
+        'pragmas': {},
+        'engine_options': {},
+        'read_split': False,
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64000,  # KiB, i.e. 64 MB per connection
+            'temp_store': 'MEMORY',
+        },
+        'engine_options': {
+            'pool_size': 10,
+            'max_overflow': 10,
+            'pool_timeout': 10,
+            'pool_recycle': 3600,
+        },
+        'read_split': True,
+    },
+}
+
+
+class RoutingSession(Session):
+    """Sends reads from ``@read_only`` views to the read engine; everything else uses the binds as usual."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _reading() and not self._flushing and not (self.new or self.dirty or self.deleted):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _reading():
+    return has_app_context() and g.get('db_read_only', False)
+
+
+def read_only(view):
+    """Run a view's queries against the read engine, for anonymous visitors."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = not current_user.is_authenticated
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.db_read_only = False
+    return wrapper
+
+
+def _is_sqlite_file(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def configure(app):
+    """Fill in engine options and the read bind; call before ``db.init_app``."""
+    app.config.setdefault('DB_PROFILE', os.getenv('DB_PROFILE', 'production'))
+    app.config.setdefault('DATABASE_READ_URL', os.getenv('DATABASE_READ_URL'))
+    name = app.config['DB_PROFILE']
+    if name not in PROFILES:
+        raise ValueError(f'Unknown DB_PROFILE: {name!r}')
+    profile = PROFILES[name]
+
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if make_url(uri).get_backend_name() != 'sqlite' or _is_sqlite_file(uri):
+        # In-memory SQLite runs on a single shared connection; pool sizing does not apply
+        for key, value in profile['engine_options'].items():
+            options.setdefault(key, value)
+    app.config.setdefault('DB_PRAGMAS', dict(profile['pragmas']))
+
+    read_url = app.config['DATABASE_READ_URL']
+    if not read_url and profile['read_split'] and _is_sqlite_file(uri):
+        read_url = uri
+    if read_url:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(READ_BIND, dict(options, url=read_url))
+
+
+def _on_connect(pragmas, query_only=False):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        if query_only:
+            cursor.execute('PRAGMA query_only=1')
+        cursor.close()
+    return set_pragmas
+
+
+def init_app(app, db):
+    """Apply the profile's SQLite pragmas to every new connection; call after ``db.init_app``."""
+    pragmas = app.config['DB_PRAGMAS']
+    with app.app_context():
+        engines = db.engines
+    for key, engine in engines.items():
+        if engine.dialect.name != 'sqlite':
+            continue
+        event.listen(engine, 'connect', _on_connect(pragmas, query_only=key == READ_BIND))
@@ -0,0 +1,177 @@
+"""Resized and WebP derivatives of uploaded post images.
+
+Derivatives live next to the content-addressed originals, under
+``static/uploads/derived/<hh>/<sha256>/<width>.<format>``. They are built by
+the job queue (or a local thread pool when it is off) right after an
+upload, and the ``/media`` route
+builds any that are still missing on first request, so a page never waits
+on a resize it does not use.
+
+Pillow is optional: without it, ``/media`` serves the original image. It is
+imported on the first resize, not at startup.
+"""
+import glob
+import importlib.util
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, abort, current_app, redirect, send_file, url_for
+from markupsafe import Markup
+
+from jobs import job, enqueue, queue_enabled
+from storage import upload_root
+
+images = Blueprint('images', __name__)
+
+log = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (320, 640, 960, 1280)
+DERIVATIVE_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+QUALITY = 80
+
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+
+def find_original(root, content_hash):
+    matches = glob.glob(os.path.join(root, content_hash[:2], f'{content_hash}.*'))
+    return matches[0] if matches else None
+
+
+def derivative_path(root, content_hash, width, fmt):
+    return os.path.join(root, 'derived', content_hash[:2], content_hash, f'{width}.{fmt}')
+
+
+def build_derivative(root, content_hash, width, fmt):
+    """Write one derivative if it does not exist yet; returns its path or None."""
+    target = derivative_path(root, content_hash, width, fmt)
+    if os.path.exists(target):
+        return target
+    source = find_original(root, content_hash)
+    if source is None or not PILLOW_AVAILABLE:
+        return None
+
+    from PIL import Image, ImageOps
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        if DERIVATIVE_FORMATS[fmt] == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        # Write then rename, so concurrent requests never read a half-written file
+        tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            img.save(tmp, DERIVATIVE_FORMATS[fmt], quality=QUALITY)
+            os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+    return target
+
+
+def build_all(root, content_hash):
+    for width in DERIVATIVE_WIDTHS:
+        for fmt in DERIVATIVE_FORMATS:
+            try:
+                build_derivative(root, content_hash, width, fmt)
+            except Exception:
+                log.exception('Could not build %s derivative %s.%s', content_hash, width, fmt)
+
+
+class DerivativePool:
+    def __init__(self, root, max_workers=2):
+        self.root = root
+        self.max_workers = max_workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def _get_executor(self):
+        # One pool per process; forked workers must not inherit the parent's threads
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='image-derivatives')
+                self._pid = os.getpid()
+                self._pending = set()
+            return self._executor
+
+    def submit(self, content_hash):
+        if not PILLOW_AVAILABLE or not content_hash:
+            return
+        executor = self._get_executor()
+        with self._lock:
+            if content_hash in self._pending:
+                return
+            self._pending.add(content_hash)
+        future = executor.submit(build_all, self.root, content_hash)
+        future.add_done_callback(lambda _: self._done(content_hash))
+
+    def _done(self, content_hash):
+        with self._lock:
+            self._pending.discard(content_hash)
+
+
+@job('images.build_derivatives', timeout=600)
+def build_derivatives_job(content_hash):
+    build_all(upload_root(), content_hash)
+
+
+def schedule_derivatives(stored):
+    """Queue derivatives for a freshly stored image; returns immediately.
+
+    With the job queue enabled the job commits with the caller's transaction,
+    otherwise the image goes to this process's thread pool.
+    """
+    if not stored or not stored.mime_type.startswith('image/'):
+        return
+    if queue_enabled():
+        enqueue(build_derivatives_job.job_name, {'content_hash': stored.content_hash})
+    else:
+        current_app.extensions['image_derivatives'].submit(stored.content_hash)
+
+
+def image_src(target, width, fmt='webp'):
+    content_hash = getattr(target, 'image_hash', None)
+    if not content_hash:
+        return url_for('static', filename=target.image_url) if getattr(target, 'image_url', None) else ''
+    return url_for('images.derivative', content_hash=content_hash, width=width, fmt=fmt)
+
+
+def image_srcset(target, fmt='webp'):
+    """``srcset`` value for a Post or Submission image; empty for legacy uploads without a hash."""
+    if not getattr(target, 'image_hash', None):
+        return ''
+    return Markup(', '.join(f'{image_src(target, w, fmt)} {w}w' for w in DERIVATIVE_WIDTHS))
+
+
+@images.route('/media/<content_hash>/<int:width>.<fmt>')
+def derivative(content_hash, width, fmt):
+    if width not in DERIVATIVE_WIDTHS or fmt not in DERIVATIVE_FORMATS or not content_hash.isalnum():
+        abort(404)
+    root = upload_root()
+    path = derivative_path(root, content_hash, width, fmt)
+    if not os.path.exists(path):
+        try:
+            path = build_derivative(root, content_hash, width, fmt)
+        except Exception:
+            # Pillow cannot read it (corrupt, or not really an image); the original still works
+            log.exception('Could not build %s derivative %s.%s', content_hash, width, fmt)
+            path = None
+    if path is None:
+        original = find_original(root, content_hash)
+        if original is None:
+            abort(404)
+        return redirect(url_for('static', filename=os.path.relpath(original, os.path.dirname(root)).replace(os.sep, '/')))
+    return send_file(path, max_age=365 * 24 * 3600, conditional=True)
+
+
+def init_app(app):
+    app.config.setdefault('IMAGE_DERIVATIVE_WORKERS', 2)
+    app.extensions['image_derivatives'] = DerivativePool(upload_root(app), app.config['IMAGE_DERIVATIVE_WORKERS'])
+    app.add_template_global(image_src)
+    app.add_template_global(image_srcset)
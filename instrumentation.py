@@ -0,0 +1,386 @@
+"""Request instrumentation and Prometheus metrics.
+
+Every request counts its SQL statements and their time, and times template
+rendering, including the queries fired while rendering (usually lazy
+loads). The totals go out in a ``Server-Timing`` header. Statements slower
+than ``SLOW_QUERY_MS`` are logged in normalized form with the line of app
+code that ran them, and so is any statement repeated ``N_PLUS_ONE_THRESHOLD``
+times in one request.
+
+Each worker keeps its own counters and writes them to
+``METRICS_DIR/<pid>-<token>.json`` every few seconds. ``/metrics`` adds up
+the files of every worker, so a scrape sees the whole gunicorn pool whichever
+worker answers. Files of workers that have exited are folded into
+``archive.json``, so counters never go backwards.
+"""
+import atexit
+import functools
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+from flask import (
+    Blueprint, Response, abort, before_render_template, current_app, g, has_request_context, request,
+    request_started, template_rendered,
+)
+from sqlalchemy import event
+
+from locks import file_lock
+
+log = logging.getLogger(__name__)
+
+instrumentation = Blueprint('instrumentation', __name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+_HERE = os.path.abspath(__file__)
+
+
+@functools.lru_cache(maxsize=2048)
+def normalize(statement):
+    """Collapse literals and IN lists so repeats of one query look the same."""
+    statement = _STRING_RE.sub('?', statement)
+    statement = _NUMBER_RE.sub('?', statement)
+    statement = _IN_LIST_RE.sub('(...)', statement)
+    return _SPACE_RE.sub(' ', statement).strip()
+
+
+def call_site(root):
+    """The innermost frame of application code outside this module, as ``file:line in func``."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(root) and filename != _HERE and 'site-packages' not in filename:
+            return f'{os.path.relpath(filename, root)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class Metrics:
+    """This process's counters; safe to update from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = {}  # "endpoint|method|status" -> bucket counts + [sum, count]
+        self.endpoints = {}  # endpoint -> {'db_queries', 'db_seconds', 'template_seconds'}
+        self.db = {'queries': 0, 'seconds': 0.0, 'slow': 0}
+        self.pid = os.getpid()
+        self.token = uuid.uuid4().hex[:8]
+
+    def _check_fork(self):
+        # A forked worker must not keep reporting its parent's numbers as its own
+        if self.pid != os.getpid():
+            self.reset()
+
+    def observe_query(self, seconds, slow):
+        with self._lock:
+            self._check_fork()
+            self.db['queries'] += 1
+            self.db['seconds'] += seconds
+            self.db['slow'] += slow
+
+    def observe_request(self, endpoint, method, status, seconds, queries, db_seconds, template_seconds):
+        with self._lock:
+            self._check_fork()
+            key = f'{endpoint}|{method}|{status}'
+            row = self.requests.get(key)
+            if row is None:
+                row = self.requests[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    row[i] += 1
+            row[-2] += seconds
+            row[-1] += 1
+            stats = self.endpoints.setdefault(endpoint, {'db_queries': 0, 'db_seconds': 0.0, 'template_seconds': 0.0})
+            stats['db_queries'] += queries
+            stats['db_seconds'] += db_seconds
+            stats['template_seconds'] += template_seconds
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'requests': {k: list(v) for k, v in self.requests.items()},
+                'endpoints': {k: dict(v) for k, v in self.endpoints.items()},
+                'db': dict(self.db),
+            }
+
+
+def merge(total, part):
+    for key, row in part.get('requests', {}).items():
+        into = total['requests'].setdefault(key, [0] * len(row))
+        for i, value in enumerate(row):
+            into[i] += value
+    for endpoint, stats in part.get('endpoints', {}).items():
+        into = total['endpoints'].setdefault(endpoint, {})
+        for name, value in stats.items():
+            into[name] = into.get(name, 0) + value
+    for name, value in part.get('db', {}).items():
+        total['db'][name] = total['db'].get(name, 0) + value
+    return total
+
+
+def _empty():
+    return {'requests': {}, 'endpoints': {}, 'db': {}}
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsStore:
+    """Per-worker metric files in a shared directory."""
+
+    def __init__(self, directory, metrics, flush_interval=5.0):
+        self.directory = directory
+        self.metrics = metrics
+        self.flush_interval = flush_interval
+        self._last_write = 0.0
+
+    def _path(self):
+        return os.path.join(self.directory, f'{self.metrics.pid}-{self.metrics.token}.json')
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = self.metrics.snapshot()
+        path = self._path()
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+        self._last_write = time.monotonic()
+
+    def flush(self):
+        if not self.metrics.requests:
+            return  # CLI commands and idle workers have nothing to report
+        try:
+            self.write()
+        except OSError:
+            log.exception('Could not write metrics to %s', self.directory)
+
+    def maybe_write(self):
+        if time.monotonic() - self._last_write >= self.flush_interval:
+            self.flush()
+
+    def collect(self):
+        """Every worker's counters added together, folding exited workers into the archive."""
+        self.write()
+        os.makedirs(self.directory, exist_ok=True)
+        archive_path = os.path.join(self.directory, 'archive.json')
+        with file_lock(os.path.join(self.directory, '.lock')):
+            try:
+                with open(archive_path) as f:
+                    archive = json.load(f)
+            except (OSError, ValueError):
+                archive = _empty()
+            total = merge(_empty(), archive)
+            dead = []
+            for path in glob.glob(os.path.join(self.directory, '*-*.json')):
+                try:
+                    with open(path) as f:
+                        part = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                merge(total, part)
+                pid = int(os.path.basename(path).split('-', 1)[0])
+                if not _pid_alive(pid):
+                    merge(archive, part)
+                    dead.append(path)
+            if dead:
+                tmp = f'{archive_path}.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(archive, f)
+                os.replace(tmp, archive_path)
+                for path in dead:
+                    os.unlink(path)
+        return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(data, pool_stats=()):
+    lines = [
+        '# HELP http_request_duration_seconds Request latency by endpoint.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for key, row in sorted(data['requests'].items()):
+        endpoint, method, status = key.split('|')
+        labels = f'endpoint="{_escape(endpoint)}",method="{method}",status="{status}"'
+        for bound, count in zip(BUCKETS, row):
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {row[-1]}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} {row[-2]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} {row[-1]}')
+
+    per_endpoint = [
+        ('http_request_db_queries_total', 'db_queries', 'SQL statements run by requests to each endpoint.'),
+        ('http_request_db_seconds_total', 'db_seconds', 'Time spent in SQL by requests to each endpoint.'),
+        ('http_request_template_seconds_total', 'template_seconds', 'Time spent rendering templates per endpoint.'),
+    ]
+    for name, field, help_text in per_endpoint:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for endpoint, stats in sorted(data['endpoints'].items()):
+            lines.append(f'{name}{{endpoint="{_escape(endpoint)}"}} {stats.get(field, 0)}')
+
+    db = data['db']
+    for name, field, help_text in [
+        ('db_queries_total', 'queries', 'SQL statements run, including background threads.'),
+        ('db_query_seconds_total', 'seconds', 'Time spent in SQL statements.'),
+        ('db_slow_queries_total', 'slow', 'Statements slower than SLOW_QUERY_MS.'),
+    ]:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter', f'{name} {db.get(field, 0)}']
+
+    if pool_stats:
+        lines += ['# HELP db_pool_checked_out Connections in use in the answering worker.', '# TYPE db_pool_checked_out gauge']
+        for bind, checked_out in pool_stats:
+            lines.append(f'db_pool_checked_out{{bind="{bind}"}} {checked_out}')
+    return '\n'.join(lines) + '\n'
+
+
+def _request_stats():
+    stats = g.get('_instrumentation')
+    if stats is None:
+        stats = g._instrumentation = {
+            'start': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0,
+            'template_seconds': 0.0, 'template_queries': 0, 'rendering': [], 'statements': {},
+        }
+    return stats
+
+
+def _attach_engine(app, engine, metrics):
+    slow_seconds = app.config['SLOW_QUERY_MS'] / 1000
+    threshold = app.config['N_PLUS_ONE_THRESHOLD']
+    root = os.path.abspath(app.root_path)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_query_start'].pop()
+        slow = elapsed >= slow_seconds
+        metrics.observe_query(elapsed, slow)
+        if slow:
+            log.warning('Slow query (%.0f ms) at %s: %s', elapsed * 1000, call_site(root), normalize(statement))
+        if not has_request_context():
+            return
+        stats = _request_stats()
+        stats['queries'] += 1
+        stats['db_seconds'] += elapsed
+        if stats['rendering']:
+            stats['template_queries'] += 1
+        shape = normalize(statement)
+        seen = stats['statements'][shape] = stats['statements'].get(shape, 0) + 1
+        if seen == threshold:
+            log.warning('Possible N+1 on %s: ran %d times, latest at %s: %s',
+                        request.endpoint, seen, call_site(root), shape)
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        _request_stats()['rendering'].append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    if has_request_context():
+        stats = _request_stats()
+        if stats['rendering']:
+            started = stats['rendering'].pop()
+            if not stats['rendering']:
+                stats['template_seconds'] += time.perf_counter() - started
+
+
+def _start_request(sender, **extra):
+    _request_stats()
+
+
+def _finish_request(response):
+    stats = _request_stats()
+    elapsed = time.perf_counter() - stats['start']
+    endpoint = request.endpoint or 'unmatched'
+    if endpoint != 'instrumentation.metrics':
+        store = current_app.extensions['metrics']
+        store.metrics.observe_request(endpoint, request.method, response.status_code, elapsed,
+                                      stats['queries'], stats['db_seconds'], stats['template_seconds'])
+        store.maybe_write()
+    if current_app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={stats["db_seconds"] * 1000:.1f};desc="{stats["queries"]} queries"',
+            f'tpl;dur={stats["template_seconds"] * 1000:.1f};desc="{stats["template_queries"]} queries while rendering"',
+            f'app;dur={elapsed * 1000:.1f}',
+        ])
+    return response
+
+
+@instrumentation.route('/metrics')
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    from app import db
+
+    pool_stats = []
+    for bind, engine in db.engines.items():
+        checkedout = getattr(engine.pool, 'checkedout', None)
+        if checkedout is not None:
+            pool_stats.append((bind or 'default', checkedout()))
+    data = current_app.extensions['metrics'].collect()
+    return Response(render_prometheus(data, pool_stats), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app, db):
+    """Hook up query, template and request timing; call after ``db.init_app``."""
+    app.config.setdefault('SLOW_QUERY_MS', float(os.getenv('SLOW_QUERY_MS', '100')))
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+    app.config.setdefault('SERVER_TIMING', True)
+    app.config.setdefault('METRICS_DIR', os.getenv('METRICS_DIR', os.path.join(app.instance_path, 'metrics')))
+    app.config.setdefault('METRICS_FLUSH_SECONDS', 5.0)
+    app.config.setdefault('METRICS_TOKEN', os.getenv('METRICS_TOKEN'))
+
+    store = MetricsStore(app.config['METRICS_DIR'], Metrics(), app.config['METRICS_FLUSH_SECONDS'])
+    app.extensions['metrics'] = store
+    atexit.register(store.flush)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        _attach_engine(app, engine, store.metrics)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    request_started.connect(_start_request, app)
+    app.after_request(_finish_request)
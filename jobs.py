@@ -0,0 +1,250 @@
+"""Durable background jobs stored in the application database.
+
+Handlers are registered with ``@job``. ``enqueue`` only adds a row to the
+session, so a job is committed (or rolled back) together with the write that
+produced it. Workers claim due jobs with a conditional UPDATE and hold them
+for a visibility timeout; a worker that dies mid-job simply lets the lock
+expire and another one picks the job up again. Failures are retried with
+exponential backoff until ``max_attempts``.
+
+Finished jobs are kept for ``JOB_RETENTION_DAYS`` and failed ones for
+``JOB_FAILED_RETENTION_DAYS``; the hourly ``jobs.purge`` job deletes older
+rows, so periodic jobs don't grow the table forever.
+
+Run workers next to the web app with ``python worker.py`` or
+``flask jobs-worker``.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_, and_, delete, event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Job
+
+log = logging.getLogger(__name__)
+
+Handler = namedtuple('Handler', 'func max_attempts backoff timeout')
+Periodic = namedtuple('Periodic', 'name every')
+
+_handlers = {}
+_periodic = []
+
+_AFTER_COMMIT = 'jobs_after_commit'
+
+
+def job(name=None, max_attempts=5, backoff=30, timeout=300, every=None):
+    """Register a job handler; ``every`` (seconds) also schedules it periodically."""
+    def decorator(func):
+        job_name = name or f'{func.__module__}.{func.__name__}'
+        _handlers[job_name] = Handler(func, max_attempts, backoff, timeout)
+        if every:
+            _periodic.append(Periodic(job_name, every))
+        func.job_name = job_name
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, delay=0, run_at=None, key=None):
+    """Add a job to the current session; it becomes visible to workers on commit."""
+    handler = _handlers.get(name)
+    entry = Job(
+        name=name,
+        payload=json.dumps(payload or {}),
+        run_at=run_at or datetime.utcnow() + timedelta(seconds=delay),
+        max_attempts=handler.max_attempts if handler else 5,
+        key=key,
+    )
+    db.session.add(entry)
+    return entry
+
+
+def queue_enabled():
+    return current_app.config['JOB_QUEUE_ENABLED']
+
+
+def after_commit(fn):
+    """Call ``fn()`` once the current transaction commits; it is dropped if the transaction rolls back.
+
+    For handing work to in-process threads, which must not see the change before it commits.
+    """
+    session = db.session()
+    if not session.in_transaction():
+        session.begin()  # So a rollback before any query still drops it
+    session.info.setdefault(_AFTER_COMMIT, []).append(fn)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit(session):
+    if session.in_nested_transaction():
+        return  # Releasing a savepoint; the outer transaction can still roll back
+    for fn in session.info.pop(_AFTER_COMMIT, ()):
+        try:
+            fn()
+        except Exception:
+            log.exception('After-commit callback %r failed', fn)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _drop_after_commit(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_AFTER_COMMIT, None)
+
+
+def _due(now):
+    return or_(
+        and_(Job.status == 'queued', Job.run_at <= now),
+        # Visibility timeout: a running job whose lock expired is up for grabs again
+        and_(Job.status == 'running', Job.locked_until < now),
+    )
+
+
+def claim():
+    """Atomically take the next due job, or return None."""
+    now = datetime.utcnow()
+    candidates = (
+        db.session.query(Job.id, Job.name)
+        .filter(_due(now))
+        .order_by(Job.run_at, Job.id)
+        .limit(5)
+        .all()
+    )
+    for job_id, name in candidates:
+        handler = _handlers.get(name)
+        timeout = handler.timeout if handler else 300
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, _due(now))
+            .values(status='running', attempts=Job.attempts + 1, locked_until=now + timedelta(seconds=timeout))
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def run(entry):
+    handler = _handlers.get(entry.name)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job {entry.name!r}')
+        handler.func(**json.loads(entry.payload or '{}'))
+    except Exception:
+        db.session.rollback()
+        entry.last_error = traceback.format_exc(limit=20)
+        if handler is None or entry.attempts >= entry.max_attempts:
+            entry.status = 'failed'
+            entry.finished_at = datetime.utcnow()
+            log.error('Job %s (%s) failed permanently', entry.id, entry.name)
+        else:
+            entry.status = 'queued'
+            entry.run_at = datetime.utcnow() + timedelta(seconds=handler.backoff * 2 ** (entry.attempts - 1))
+            log.warning('Job %s (%s) failed; retry %d at %s', entry.id, entry.name, entry.attempts, entry.run_at)
+    else:
+        entry.status = 'done'
+        entry.finished_at = datetime.utcnow()
+    entry.locked_until = None
+    db.session.commit()
+
+
+def schedule_periodic(now=None):
+    """Enqueue periodic jobs that are due. Safe to call from many workers: slots are unique keys."""
+    now = now or time.time()
+    for periodic in _periodic:
+        slot = int(now // periodic.every)
+        try:
+            with db.session.begin_nested():
+                enqueue(periodic.name, key=f'{periodic.name}@{slot}')
+        except IntegrityError:
+            pass
+    db.session.commit()
+
+
+@job('jobs.purge', max_attempts=1, every=3600)
+def purge(now=None):
+    """Delete finished and failed jobs past their retention."""
+    now = now or datetime.utcnow()
+    config = current_app.config
+    result = db.session.execute(delete(Job).where(or_(
+        and_(Job.status == 'done', Job.finished_at < now - timedelta(days=config['JOB_RETENTION_DAYS'])),
+        and_(Job.status == 'failed', Job.finished_at < now - timedelta(days=config['JOB_FAILED_RETENTION_DAYS'])),
+    )))
+    db.session.commit()
+    return result.rowcount
+
+
+class Worker:
+    def __init__(self, app, threads=2, poll_interval=1.0):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    entry = claim()
+                    if entry is not None:
+                        run(entry)
+                        continue
+                except Exception:
+                    log.exception('Job worker %s hit an error', self.name)
+                    db.session.rollback()
+            self._stop.wait(self.poll_interval)
+
+    def _scheduler(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    schedule_periodic()
+                except Exception:
+                    log.exception('Could not schedule periodic jobs')
+                    db.session.rollback()
+            self._stop.wait(self.poll_interval * 5)
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        workers = [threading.Thread(target=self._loop, name=f'job-worker-{i}') for i in range(self.threads)]
+        if _periodic:
+            workers.append(threading.Thread(target=self._scheduler, name='job-scheduler'))
+        for thread in workers:
+            thread.start()
+        log.info('Job worker %s running %d threads', self.name, self.threads)
+        while not self._stop.is_set():
+            self._stop.wait(1)
+        for thread in workers:
+            thread.join()
+
+
+@click.command('jobs-worker')
+@click.option('--threads', default=2, show_default=True, help='Jobs run concurrently by this process.')
+@with_appcontext
+def worker_command(threads):
+    """Run background jobs until interrupted."""
+    Worker(current_app._get_current_object(), threads=threads).run()
+
+
+def init_app(app):
+    app.config.setdefault('JOB_QUEUE_ENABLED', os.getenv('JOB_QUEUE_ENABLED', '0') == '1')
+    app.config.setdefault('JOB_RETENTION_DAYS', 7)
+    app.config.setdefault('JOB_FAILED_RETENTION_DAYS', 30)
+    app.cli.add_command(worker_command)
@@ -0,0 +1,60 @@
+"""Cross-process file locks.
+
+``file_lock(path)`` holds an exclusive lock on ``path`` (created if missing)
+for the length of a ``with`` block, so workers on one host take turns. It
+uses ``fcntl.flock`` on POSIX and ``msvcrt.locking`` on Windows. With
+``blocking=False`` it raises ``LockHeld`` instead of waiting.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+RETRY_SECONDS = 0.05
+
+
+class LockHeld(Exception):
+    """Another process holds the lock."""
+
+
+def _acquire(f, blocking):
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            raise LockHeld() from None
+        return
+    # msvcrt locks a byte range from the current position; LK_LOCK gives up after ten seconds
+    while True:
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            if not blocking:
+                raise LockHeld() from None
+            time.sleep(RETRY_SECONDS)
+
+
+def _release(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        _acquire(f, blocking)
+        try:
+            yield
+        finally:
+            _release(f)
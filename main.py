@@ -1,64 +1,134 @@
-import os
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 from models import Post, Subscriber, Comment, SiteSettings, Submission, Category, ServiceOrder, Attachment
 from app import db
+from search_index import index_post, remove_post, search_posts
+from pagination import keyset_paginate
+from cache import invalidate_global_data
+from response_cache import cached_page, cache_tag, invalidate
+from comments import load_comment_threads
+from storage import save_upload, save_uploads, discard, set_image, enforce_request_limit, UploadTooLarge
+from images import schedule_derivatives
+from jobs import enqueue, after_commit, queue_enabled
+from slugs import flush_with_slug
+from db_profile import read_only
+from static_export import FEED_PER_PAGE, all_paths, post_paths, remove_feed, schedule_pages
+from ratelimit import rate_limit
+from coalesce import write, WriteTimeout
+from related import related_posts, schedule_update, remove_post as remove_related
+from rendering import render_post, card_options
+from rankings import top_posts, remove_post as remove_rankings
+from syndication import invalidate_documents
+from sqlalchemy.exc import IntegrityError, OperationalError
+from datetime import datetime
 
 main = Blueprint('main', __name__)
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'zip', 'rar', 'exe', 'msi', 'txt'}
+def attachment_for(stored):
+    return Attachment(filename=stored.filename, file_path=stored.url, content_hash=stored.content_hash, size=stored.size, mime_type=stored.mime_type)
+
+def post_changed(post_id, slug=None, categories=(), old_slug=None):
+    """Commit the caller's change to a post together with the work it sets off."""
+    # Drop cached pages that show this post (its own page and every feed page) before anything re-renders them
+    after_commit(lambda: invalidate('feed', f'post:{post_id}'))
+    after_commit(lambda: invalidate_documents([post_id], categories))
+    if queue_enabled():
+        paths = [url_for('main.index')]
+        if slug:
+            paths.append(url_for('main.post_detail', slug=slug))
+        enqueue('response_cache.warm', {'paths': paths})
+    # Re-export the static copies, including pages the post just left
+    if current_app.config['STATIC_EXPORT_ENABLED']:
+        schedule_pages(post_paths(slug, categories, old_slug if old_slug != slug else None))
+    schedule_update(post_id)
+    db.session.commit()
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def global_data_changed(categories=()):
+    """Commit the caller's change to the social links or categories; they show on every page."""
+    invalidate_global_data()
+    after_commit(lambda: invalidate('global'))
+    if categories:
+        after_commit(lambda: invalidate_documents(categories=categories))
+    if current_app.config['STATIC_EXPORT_ENABLED']:
+        schedule_pages(all_paths())
+    db.session.commit()
 
-import re
-def slugify(s):
-    s = str(s).lower().strip()
-    s = re.sub(r'[^\w\s-]', '', s)
-    s = re.sub(r'[\s_-]+', '-', s)
-    s = re.sub(r'^-+|-+$', '', s)
-    return s
+def busy():
+    # The shared writer is backed up or the database stayed locked; nothing was saved, so retrying is safe
+    return 'The site is busy. Please try again shortly.', 503, {'Retry-After': '5'}
+
+def comment_changed(post):
+    """Commit the caller's transaction with the re-export of the post's page."""
+    after_commit(lambda: invalidate(f'post:{post.id}'))
+    if current_app.config['STATIC_EXPORT_ENABLED']:
+        schedule_pages([url_for('main.post_detail', slug=post.slug)])
+    db.session.commit()
 
 @main.route('/')
+@cached_page
+@read_only
 def index():
     category = request.args.get('category')
-    page = request.args.get('page', 1, type=int)
-    per_page = 6
+    page = request.args.get('page', type=int)
+    cursor = request.args.get('cursor')
+    load_more = request.args.get('load_more')
+    per_page = FEED_PER_PAGE
     
     if category:
-        query = Post.query.filter_by(category=category).order_by(Post.created_at.desc())
+        query = Post.query.options(*card_options()).filter_by(category=category)
         featured_posts = []
     else:
-        query = Post.query.order_by(Post.created_at.desc())
-        featured_posts = Post.query.filter_by(featured=True).order_by(Post.created_at.desc()).limit(5).all()
+        query = Post.query.options(*card_options())
+        featured_posts = query.filter_by(featured=True).order_by(Post.created_at.desc()).limit(5).all()
 
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    if page and not cursor:
+        # Legacy numbered pages; only count rows when page numbers are rendered
+        pagination = query.order_by(Post.created_at.desc(), Post.id.desc()).paginate(
+            page=page, per_page=per_page, error_out=False, count=not load_more)
+    else:
+        pagination = keyset_paginate(query, Post.created_at, Post.id, cursor=cursor, per_page=per_page)
     posts = pagination.items
 
-    if request.args.get('load_more'):
-        return render_template('partials/post_grid_items.html', posts=posts)
+    cache_tag('feed')
+    if load_more:
+        return render_template('partials/post_grid_items.html', posts=posts, pagination=pagination)
 
-    return render_template('index.html', posts=posts, featured_posts=featured_posts, current_category=category, pagination=pagination)
+    cache_tag('rankings')
+    return render_template('index.html', posts=posts, featured_posts=featured_posts, current_category=category, pagination=pagination,
+                           trending_posts=top_posts('trending', category), most_read_posts=top_posts('most_read', category))
 
 @main.route('/post/<slug>')
+@cached_page
+@read_only
 def post_detail(slug):
     post = Post.query.filter_by(slug=slug).first_or_404()
-    comments = Comment.query.filter_by(post_id=post.id, parent_id=None).order_by(Comment.created_at.desc()).all()
-    return render_template('post.html', post=post, comments=comments)
+    cache_tag(f'post:{post.id}')
+    comment_page = load_comment_threads(post.id)
+    return render_template('post.html', post=post, comments=comment_page.items, comment_page=comment_page, related_posts=related_posts(post.id))
+
+@main.route('/post/<int:post_id>/comments')
+@cached_page
+@read_only
+def more_comments(post_id):
+    cache_tag(f'post:{post_id}')
+    comment_page = load_comment_threads(post_id, cursor=request.args.get('cursor'))
+    return render_template('partials/comment_threads.html', comments=comment_page.items, comment_page=comment_page, post_id=post_id)
 
 @main.route('/about')
+@cached_page
 def about_us():
     return render_template('about_us.html')
 
 @main.route('/services')
+@cached_page
 def services():
     return render_template('services.html')
 
 @main.route('/service-order', methods=['POST'])
+@rate_limit(ip=(3, 300))
 def submit_service_order():
     try:
-        order = ServiceOrder(
+        fields = dict(
             service_name=request.form.get('service_name'),
             customer_name=request.form.get('customer_name'),
             contact_number=request.form.get('contact_number'),
@@ -67,34 +137,34 @@ def submit_service_order():
             location=request.form.get('location'),
             message=request.form.get('message')
         )
-        db.session.add(order)
-        db.session.commit()
+        write(lambda session: session.add(ServiceOrder(**fields)))
         flash('Thank you! We will contact you shortly.')
         return redirect(url_for('main.services'))
+    except (WriteTimeout, OperationalError):
+        return busy()
     except Exception as e:
         flash('Something went wrong. Please try again.')
         return redirect(url_for('main.services'))
 
 @main.route('/search')
+@read_only
 def search():
     query = request.args.get('q', '')
-    if query:
-        posts = Post.query.filter(
-            (Post.title.ilike(f'%{query}%')) | 
-            (Post.content.ilike(f'%{query}%'))
-        ).order_by(Post.created_at.desc()).all()
-    else:
-        posts = []
-    return render_template('search.html', posts=posts, query=query)
+    page = request.args.get('page', 1, type=int)
+    results = search_posts(query, page=page, per_page=10)
+    return render_template('search.html', posts=results.posts, results=results, query=query)
 import random
 
 @main.route('/submit', methods=['GET', 'POST'])
+@rate_limit(ip=(3, 600))
 def submit_article():
     # Generate captcha for GET requests
     num1 = random.randint(1, 10)
     num2 = random.randint(1, 10)
     
     if request.method == 'POST':
+        # Public form: one image plus text fields at most
+        enforce_request_limit(current_app.config['UPLOAD_SIZE_LIMITS']['image'] + 1024 * 1024)
         author_name = request.form.get('author_name')
         author_email = request.form.get('author_email')
         title = request.form.get('title')
@@ -110,18 +180,11 @@ def submit_article():
             return render_template('submit.html', num1=num1, num2=num2, form_data=request.form)
         
         # Image upload
-        image_url = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Add timestamp to avoid conflicts
-                import time
-                filename = f"{int(time.time())}_{filename}"
-                upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)
-                file.save(os.path.join(upload_folder, filename))
-                image_url = f"uploads/{filename}"
+        try:
+            image = save_upload(request.files.get('image'))
+        except UploadTooLarge as e:
+            flash(f'{e}. Please upload a smaller image.')
+            return render_template('submit.html', num1=num1, num2=num2, form_data=request.form)
         
         if author_name and author_email and title and content:
             submission = Submission(
@@ -129,17 +192,21 @@ def submit_article():
                 author_email=author_email,
                 title=title,
                 content=content,
-                category=category,
-                image_url=image_url
+                category=category
             )
+            if image:
+                set_image(submission, image)
             db.session.add(submission)
+            schedule_derivatives(image)
             db.session.commit()
             flash('Thank you! Your article has been submitted for review.')
             return redirect(url_for('main.submit_article'))
+        discard([image])
     
     return render_template('submit.html', num1=num1, num2=num2)
 
 @main.route('/post/<int:post_id>/comment', methods=['POST'])
+@rate_limit(ip=(5, 60))
 def add_comment(post_id):
     post = Post.query.get_or_404(post_id)
     name = request.form.get('name')
@@ -147,9 +214,11 @@ def add_comment(post_id):
     content = request.form.get('content')
     
     if name and email and content:
-        comment = Comment(name=name, email=email, content=content, post_id=post_id)
-        db.session.add(comment)
-        db.session.commit()
+        try:
+            write(lambda session: session.add(Comment(name=name, email=email, content=content, post_id=post_id)))
+        except (WriteTimeout, OperationalError):
+            return busy()
+        comment_changed(post)
         flash('Your comment has been posted!')
     return redirect(url_for('main.post_detail', slug=post.slug) + '#comments')
 
@@ -169,11 +238,12 @@ def admin_reply(comment_id):
             is_admin_reply=True
         )
         db.session.add(reply)
-        db.session.commit()
+        comment_changed(parent_comment.post)
         flash('Reply posted!')
     return redirect(url_for('main.post_detail', slug=parent_comment.post.slug) + '#comment-' + str(comment_id))
 
 @main.route('/subscribe', methods=['POST'])
+@rate_limit(ip=(3, 60))
 def subscribe():
     email = request.form.get('email')
     if email:
@@ -181,28 +251,82 @@ def subscribe():
         if existing:
             flash('You are already subscribed!')
         else:
-            new_subscriber = Subscriber(email=email)
-            db.session.add(new_subscriber)
-            db.session.commit()
-            flash('Thank you for subscribing!')
+            try:
+                write(lambda session: session.add(Subscriber(email=email)))
+                flash('Thank you for subscribing!')
+            except IntegrityError:
+                # Subscribed by a concurrent request since the check above
+                flash('You are already subscribed!')
+            except (WriteTimeout, OperationalError):
+                return busy()
     return redirect(request.referrer or url_for('main.index'))
 
 # Admin Routes
 
+DASHBOARD_PER_PAGE = 25
+
 @main.route('/dashboard')
 @login_required
 def dashboard():
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    subscribers = Subscriber.query.order_by(Subscriber.subscribed_at.desc()).all()
-    submissions = Submission.query.order_by(Submission.submitted_at.desc()).all()
+    # Tab contents are fetched on demand from the dashboard_* endpoints below
     categories = Category.query.order_by(Category.name).all()
     settings = SiteSettings.query.first()
     if not settings:
         settings = SiteSettings()
         db.session.add(settings)
-        db.session.commit()
-    service_orders = ServiceOrder.query.order_by(ServiceOrder.created_at.desc()).all()
-    return render_template('dashboard.html', posts=posts, subscribers=subscribers, submissions=submissions, categories=categories, settings=settings, service_orders=service_orders)
+        global_data_changed()
+    pending_submissions = Submission.query.filter_by(status='pending').count()
+    pending_orders = ServiceOrder.query.filter_by(status='pending').count()
+    return render_template('dashboard.html', categories=categories, settings=settings, pending_submissions=pending_submissions, pending_orders=pending_orders)
+
+def dashboard_page(query):
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', DASHBOARD_PER_PAGE, type=int), 100)
+    return query.paginate(page=page, per_page=per_page, error_out=False)
+
+@main.route('/dashboard/posts')
+@login_required
+def dashboard_posts():
+    category = request.args.get('category')
+    q = request.args.get('q', '').strip()
+    # The list only shows titles and metadata; leave article bodies in the database
+    query = Post.query.options(*card_options())
+    if category:
+        query = query.filter_by(category=category)
+    if q:
+        query = query.filter(Post.title.ilike(f'%{q}%'))
+    pagination = dashboard_page(query.order_by(Post.created_at.desc()))
+    return render_template('partials/dashboard_posts.html', posts=pagination.items, pagination=pagination, category=category, q=q)
+
+@main.route('/dashboard/subscribers')
+@login_required
+def dashboard_subscribers():
+    q = request.args.get('q', '').strip()
+    query = Subscriber.query
+    if q:
+        query = query.filter(Subscriber.email.ilike(f'%{q}%'))
+    pagination = dashboard_page(query.order_by(Subscriber.subscribed_at.desc()))
+    return render_template('partials/dashboard_subscribers.html', subscribers=pagination.items, pagination=pagination, q=q)
+
+@main.route('/dashboard/submissions')
+@login_required
+def dashboard_submissions():
+    status = request.args.get('status')
+    query = Submission.query.options(db.defer(Submission.content))
+    if status:
+        query = query.filter_by(status=status)
+    pagination = dashboard_page(query.order_by(Submission.submitted_at.desc()))
+    return render_template('partials/dashboard_submissions.html', submissions=pagination.items, pagination=pagination, status=status)
+
+@main.route('/dashboard/orders')
+@login_required
+def dashboard_orders():
+    status = request.args.get('status')
+    query = ServiceOrder.query
+    if status:
+        query = query.filter_by(status=status)
+    pagination = dashboard_page(query.order_by(ServiceOrder.created_at.desc()))
+    return render_template('partials/dashboard_orders.html', service_orders=pagination.items, pagination=pagination, status=status)
 
 @main.route('/submission/<int:submission_id>/approve', methods=['POST'])
 @login_required
@@ -210,14 +334,6 @@ def approve_submission(submission_id):
     submission = Submission.query.get_or_404(submission_id)
     
     # Create a new post from the submission
-    # Generate slug for new post
-    base_slug = slugify(submission.title)
-    slug = base_slug
-    counter = 1
-    while Post.query.filter_by(slug=slug).first():
-        slug = f"{base_slug}-{counter}"
-        counter += 1
-
     post = Post(
         title=submission.title,
         content=submission.content,
@@ -225,13 +341,17 @@ def approve_submission(submission_id):
         author_id=current_user.id,
         contributor_name=submission.author_name,
         image_url=submission.image_url,
-        slug=slug
+        image_hash=submission.image_hash,
+        image_size=submission.image_size,
+        image_mime=submission.image_mime
     )
-    db.session.add(post)
+    render_post(post)
+    flush_with_slug(post, submission.title)
+    index_post(post)
     
     # Mark submission as approved
     submission.status = 'approved'
-    db.session.commit()
+    post_changed(post.id, post.slug, [post.category])
     
     flash(f'Article "{submission.title}" by {submission.author_name} has been published!')
     return redirect(url_for('main.dashboard') + '#submissions')
@@ -272,7 +392,7 @@ def save_settings():
     settings.whatsapp_url = request.form.get('whatsapp_url', '')
     settings.youtube_url = request.form.get('youtube_url', '')
     
-    db.session.commit()
+    global_data_changed()
     flash('Social links saved successfully!')
     return redirect(url_for('main.dashboard') + '#settings')
 
@@ -287,7 +407,7 @@ def add_category():
         else:
             category = Category(name=name)
             db.session.add(category)
-            db.session.commit()
+            global_data_changed(categories=[name])
             flash(f'Category "{name}" added successfully!')
     return redirect(url_for('main.dashboard') + '#categories')
 
@@ -297,7 +417,8 @@ def delete_category(category_id):
     category = Category.query.get_or_404(category_id)
     name = category.name
     db.session.delete(category)
-    db.session.commit()
+    global_data_changed(categories=[name])
+    remove_feed(name)
     flash(f'Category "{name}" deleted.')
     return redirect(url_for('main.dashboard') + '#categories')
 
@@ -305,56 +426,33 @@ def delete_category(category_id):
 @login_required
 def create_post():
     if request.method == 'POST':
+        enforce_request_limit()
         title = request.form.get('title')
         content = request.form.get('content')
         category = request.form.get('category')
-        image_url = None
         
-        # Handle file upload
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Add timestamp to avoid conflicts
-                import time
-                filename = f"{int(time.time())}_{filename}"
-                upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)
-                file.save(os.path.join(upload_folder, filename))
-                image_url = f"uploads/{filename}"
+        # Handle file uploads
+        try:
+            image, *attachments = save_uploads([request.files.get('image'), *request.files.getlist('attachments')])
+        except UploadTooLarge as e:
+            flash(f'{e}.')
+            return redirect(request.url)
         
         if not title or not content:
+            discard([image, *attachments])
             flash('Title and Content are required!')
         else:
             featured = request.form.get('featured') == 'on'
-            
-            # Generate slug
-            base_slug = slugify(title)
-            slug = base_slug
-            counter = 1
-            while Post.query.filter_by(slug=slug).first():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-
-            new_post = Post(title=title, content=content, category=category, image_url=image_url, featured=featured, author=current_user, slug=slug)
-            db.session.add(new_post)
-            db.session.commit() # Commit to get ID
-            
-            # Handle attachments
-            if 'attachments' in request.files:
-                files = request.files.getlist('attachments')
-                for file in files:
-                    if file and file.filename and allowed_file(file.filename):
-                        filename = secure_filename(file.filename)
-                        import time
-                        filename = f"{int(time.time())}_{filename}"
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads', 'attachments')
-                        os.makedirs(upload_folder, exist_ok=True)
-                        file.save(os.path.join(upload_folder, filename))
-                        attachment = Attachment(filename=file.filename, file_path=f"uploads/attachments/{filename}", post_id=new_post.id)
-                        db.session.add(attachment)
-                db.session.commit()
 
+            new_post = Post(title=title, content=content, category=category, featured=featured, author_id=current_user.id)
+            if image:
+                set_image(new_post, image)
+            new_post.attachments = [attachment_for(stored) for stored in attachments if stored]
+            render_post(new_post)
+            flush_with_slug(new_post, title) # Also assigns the ID for the search index
+            index_post(new_post)
+            schedule_derivatives(image)
+            post_changed(new_post.id, new_post.slug, [new_post.category])
             return redirect(url_for('main.dashboard'))
     
     categories = Category.query.order_by(Category.name).all()
@@ -366,49 +464,29 @@ def edit_post(post_id):
     post = Post.query.get_or_404(post_id)
     
     if request.method == 'POST':
+        enforce_request_limit()
+        try:
+            image, *attachments = save_uploads([request.files.get('image'), *request.files.getlist('attachments')])
+        except UploadTooLarge as e:
+            flash(f'{e}.')
+            return redirect(request.url)
+
+        old_slug, old_category = post.slug, post.category
         post.title = request.form.get('title')
         post.content = request.form.get('content')
+        post.updated_at = datetime.utcnow()
+        render_post(post)
         post.category = request.form.get('category')
-
-        # Update slug if title changed (optional, but good practice). 
-        # For now, let's update it to ensure it matches title.
-        base_slug = slugify(post.title)
-        slug = base_slug
-        counter = 1
-        # Check uniqueness, excluding current post
-        while Post.query.filter(Post.slug==slug, Post.id!=post.id).first():
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-        post.slug = slug
-        
-        # Handle file upload
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                import time
-                filename = f"{int(time.time())}_{filename}"
-                upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)
-                file.save(os.path.join(upload_folder, filename))
-                post.image_url = f"uploads/{filename}"
+        if image:
+            set_image(post, image)
         post.featured = request.form.get('featured') == 'on'
-        
-        # Handle attachments
-        if 'attachments' in request.files:
-            files = request.files.getlist('attachments')
-            for file in files:
-                if file and file.filename and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    import time
-                    filename = f"{int(time.time())}_{filename}"
-                    upload_folder = os.path.join(current_app.root_path, 'static', 'uploads', 'attachments')
-                    os.makedirs(upload_folder, exist_ok=True)
-                    file.save(os.path.join(upload_folder, filename))
-                    attachment = Attachment(filename=file.filename, file_path=f"uploads/attachments/{filename}", post_id=post.id)
-                    db.session.add(attachment)
+        post.attachments.extend(attachment_for(stored) for stored in attachments if stored)
 
-        db.session.commit()
+        # Keep the slug in step with the title
+        flush_with_slug(post, post.title)
+        index_post(post)
+        schedule_derivatives(image)
+        post_changed(post.id, post.slug, [old_category, post.category], old_slug)
         return redirect(url_for('main.dashboard'))
     
     categories = Category.query.order_by(Category.name).all()
@@ -418,6 +496,10 @@ def edit_post(post_id):
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
+    slug, category = post.slug, post.category
+    remove_post(post.id)
+    remove_related(post.id)
+    remove_rankings(post.id)
     db.session.delete(post)
-    db.session.commit()
+    post_changed(post_id, categories=[category], old_slug=slug)
     return redirect(url_for('main.dashboard'))
@@ -1,14 +1,10 @@
-import sqlite3
+# Superseded by versioned migrations: this now runs `flask db upgrade 0001`,
+# which adds submission.image_url and records the revision in schema_migrations.
+from app import app
+from migrations import upgrade
 
-conn = sqlite3.connect('instance/blog.db')
-cursor = conn.cursor()
-
-try:
-    print("Adding image_url to submission table...")
-    cursor.execute('ALTER TABLE submission ADD COLUMN image_url TEXT')
-    conn.commit()
-    print("Success: image_url column added.")
-except Exception as e:
-    print(f"Migration note: {e}")
-finally:
-    conn.close()
+with app.app_context():
+    applied = upgrade('0001')
+    for name in applied:
+        print(f"Applied {name}")
+    print("Migration completed successfully." if applied else "Already up to date.")
@@ -0,0 +1,10 @@
+# Superseded by versioned migrations: this now runs `flask db upgrade 0003`,
+# which adds the upload metadata columns and records the revision in schema_migrations.
+from app import app
+from migrations import upgrade
+
+with app.app_context():
+    applied = upgrade('0003')
+    for name in applied:
+        print(f"Applied {name}")
+    print("Migration completed successfully." if applied else "Already up to date.")
@@ -0,0 +1,10 @@
+"""Add submission.image_url (was migrate_db.py)."""
+from migrations import add_column, drop_column
+
+
+def upgrade(conn):
+    add_column(conn, 'submission', 'image_url', 'VARCHAR(500)')
+
+
+def downgrade(conn):
+    drop_column(conn, 'submission', 'image_url')
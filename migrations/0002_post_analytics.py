@@ -0,0 +1,23 @@
+"""Post view counters and active_page_viewer (was migrate_analytics.py)."""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+
+from migrations import add_column, create_table, drop_column, drop_table
+
+
+def upgrade(conn):
+    add_column(conn, 'post', 'views', 'INTEGER DEFAULT 0')
+    add_column(conn, 'post', 'total_seconds_read', 'INTEGER DEFAULT 0')
+    # Its indexes come in 0005
+    create_table(
+        conn, 'active_page_viewer',
+        Column('id', Integer, primary_key=True),
+        Column('post_id', Integer, ForeignKey('post.id'), nullable=False),
+        Column('viewer_id', String(100), nullable=False),
+        Column('last_heartbeat', DateTime),
+    )
+
+
+def downgrade(conn):
+    drop_table(conn, 'active_page_viewer')
+    drop_column(conn, 'post', 'total_seconds_read')
+    drop_column(conn, 'post', 'views')
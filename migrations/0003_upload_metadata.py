@@ -0,0 +1,20 @@
+"""Content hash, size and type of stored uploads (was migrate_uploads.py)."""
+from migrations import add_column, drop_column
+
+NEW_COLUMNS = {
+    'post': [('image_hash', 'VARCHAR(64)'), ('image_size', 'INTEGER'), ('image_mime', 'VARCHAR(100)')],
+    'submission': [('image_hash', 'VARCHAR(64)'), ('image_size', 'INTEGER'), ('image_mime', 'VARCHAR(100)')],
+    'attachment': [('content_hash', 'VARCHAR(64)'), ('size', 'INTEGER'), ('mime_type', 'VARCHAR(100)')],
+}
+
+
+def upgrade(conn):
+    for table, columns in NEW_COLUMNS.items():
+        for name, sql_type in columns:
+            add_column(conn, table, name, sql_type)
+
+
+def downgrade(conn):
+    for table, columns in NEW_COLUMNS.items():
+        for name, _ in columns:
+            drop_column(conn, table, name)
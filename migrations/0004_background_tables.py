@@ -0,0 +1,60 @@
+"""Tables for the cache version stamps, job queue and newsletters."""
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, Text
+
+from migrations import create_table, drop_table
+
+TABLES = ['cache_version', 'job', 'newsletter', 'newsletter_delivery']
+
+
+def upgrade(conn):
+    create_table(
+        conn, 'cache_version',
+        Column('name', String(50), primary_key=True),
+        Column('version', Integer, nullable=False),
+    )
+    create_table(
+        conn, 'job',
+        Column('id', Integer, primary_key=True),
+        Column('name', String(100), nullable=False),
+        Column('payload', Text, nullable=False),
+        Column('key', String(200), unique=True),
+        Column('status', String(20)),
+        Column('attempts', Integer),
+        Column('max_attempts', Integer),
+        Column('run_at', DateTime),
+        Column('locked_until', DateTime),
+        Column('last_error', Text),
+        Column('created_at', DateTime),
+        Column('finished_at', DateTime),
+        Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+    create_table(
+        conn, 'newsletter',
+        Column('id', Integer, primary_key=True),
+        Column('subject', String(300), nullable=False),
+        Column('body_text', Text, nullable=False),
+        Column('body_html', Text),
+        Column('status', String(20)),
+        Column('last_subscriber_id', Integer),
+        Column('sent_count', Integer),
+        Column('failed_count', Integer),
+        Column('created_at', DateTime),
+        Column('started_at', DateTime),
+        Column('finished_at', DateTime),
+    )
+    create_table(
+        conn, 'newsletter_delivery',
+        Column('id', Integer, primary_key=True),
+        Column('newsletter_id', Integer, ForeignKey('newsletter.id'), nullable=False),
+        Column('subscriber_id', Integer, ForeignKey('subscriber.id'), nullable=False),
+        Column('email', String(200), nullable=False),
+        Column('status', String(20), nullable=False),
+        Column('error', Text),
+        Column('attempted_at', DateTime),
+        Index('ix_newsletter_delivery_newsletter_status', 'newsletter_id', 'status'),
+    )
+
+
+def downgrade(conn):
+    for table in reversed(TABLES):
+        drop_table(conn, table)
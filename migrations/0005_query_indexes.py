@@ -0,0 +1,34 @@
+"""Indexes for the feed, comment threads, dashboard lists and presence sweeps.
+
+Keep in step with the ``__table_args__`` in models.py.
+"""
+from migrations import create_index, drop_index
+
+INDEXES = [
+    # Feed: ORDER BY created_at DESC, id DESC, optionally filtered by category or featured
+    ('ix_post_created_at_id', 'post', ('created_at', 'id')),
+    ('ix_post_category_created_at', 'post', ('category', 'created_at')),
+    ('ix_post_featured_created_at', 'post', ('featured', 'created_at')),
+    ('ix_attachment_post_id', 'attachment', ('post_id',)),
+    # Top-level comments of a post, newest first; replies by parent
+    ('ix_comment_post_parent_created_at', 'comment', ('post_id', 'parent_id', 'created_at')),
+    ('ix_comment_parent_id', 'comment', ('parent_id',)),
+    # Dashboard tabs, with and without a status filter
+    ('ix_submission_status_submitted_at', 'submission', ('status', 'submitted_at')),
+    ('ix_submission_submitted_at', 'submission', ('submitted_at',)),
+    ('ix_service_order_status_created_at', 'service_order', ('status', 'created_at')),
+    ('ix_service_order_created_at', 'service_order', ('created_at',)),
+    ('ix_subscriber_subscribed_at', 'subscriber', ('subscribed_at',)),
+    ('ix_active_page_viewer_post_viewer', 'active_page_viewer', ('post_id', 'viewer_id')),
+    ('ix_active_page_viewer_last_heartbeat', 'active_page_viewer', ('last_heartbeat',)),
+]
+
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        create_index(conn, name, table, *columns)
+
+
+def downgrade(conn):
+    for name, table, _ in reversed(INDEXES):
+        drop_index(conn, name, table)
@@ -0,0 +1,19 @@
+"""Precomputed related-post neighbours."""
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer
+
+from migrations import create_table, drop_table
+
+
+def upgrade(conn):
+    create_table(
+        conn, 'related_post',
+        Column('post_id', Integer, ForeignKey('post.id'), primary_key=True),
+        Column('rank', Integer, primary_key=True),
+        Column('related_id', Integer, ForeignKey('post.id'), nullable=False),
+        Column('score', Float, nullable=False),
+        Index('ix_related_post_related_id', 'related_id'),
+    )
+
+
+def downgrade(conn):
+    drop_table(conn, 'related_post')
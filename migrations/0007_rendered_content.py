@@ -0,0 +1,24 @@
+"""Post columns filled in by the write-time renderer.
+
+``flask bootstrap`` (or ``flask content-render``) fills them for existing posts.
+"""
+from migrations import add_column, drop_column
+
+COLUMNS = [
+    ('content_html', 'TEXT'),
+    ('excerpt', 'VARCHAR(300)'),
+    ('word_count', 'INTEGER'),
+    ('reading_minutes', 'INTEGER'),
+    ('toc', 'TEXT'),
+    ('render_version', 'INTEGER'),
+]
+
+
+def upgrade(conn):
+    for name, sql_type in COLUMNS:
+        add_column(conn, 'post', name, sql_type)
+
+
+def downgrade(conn):
+    for name, _ in reversed(COLUMNS):
+        drop_column(conn, 'post', name)
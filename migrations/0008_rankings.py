@@ -0,0 +1,40 @@
+"""Hourly activity buckets, decayed post scores and materialized ranking lists."""
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String
+
+from migrations import create_table, drop_table
+
+TABLES = ['post_activity', 'post_ranking', 'ranking_entry']
+
+
+def upgrade(conn):
+    create_table(
+        conn, 'post_activity',
+        Column('post_id', Integer, ForeignKey('post.id'), primary_key=True),
+        Column('hour', Integer, primary_key=True),
+        Column('views', Integer, nullable=False),
+        Column('seconds', Integer, nullable=False),
+        Column('scored_views', Integer, nullable=False),
+        Column('scored_seconds', Integer, nullable=False),
+        Index('ix_post_activity_hour', 'hour'),
+    )
+    create_table(
+        conn, 'post_ranking',
+        Column('post_id', Integer, ForeignKey('post.id'), primary_key=True),
+        Column('trending', Float, nullable=False),
+        Column('week_views', Integer, nullable=False),
+        Column('week_seconds', Integer, nullable=False),
+        Column('scored_hour', Integer, nullable=False),
+    )
+    create_table(
+        conn, 'ranking_entry',
+        Column('kind', String(20), primary_key=True),
+        Column('category', String(50), primary_key=True),
+        Column('rank', Integer, primary_key=True),
+        Column('post_id', Integer, ForeignKey('post.id'), nullable=False),
+        Column('score', Float, nullable=False),
+    )
+
+
+def downgrade(conn):
+    for table in reversed(TABLES):
+        drop_table(conn, table)
@@ -0,0 +1,10 @@
+"""Post.updated_at, set when a post is edited; feeds and sitemaps report it."""
+from migrations import add_column, drop_column
+
+
+def upgrade(conn):
+    add_column(conn, 'post', 'updated_at', 'DATETIME')
+
+
+def downgrade(conn):
+    drop_column(conn, 'post', 'updated_at')
@@ -0,0 +1,10 @@
+"""Newsletter.locked_until, the lease a sending run holds so only one run sends at a time."""
+from migrations import add_column, drop_column
+
+
+def upgrade(conn):
+    add_column(conn, 'newsletter', 'locked_until', 'DATETIME')
+
+
+def downgrade(conn):
+    drop_column(conn, 'newsletter', 'locked_until')
@@ -0,0 +1,12 @@
+"""Add id to the category feed index, matching its ORDER BY created_at DESC, id DESC."""
+from migrations import create_index, drop_index
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_post_category_created_at_id', 'post', 'category', 'created_at', 'id')
+    drop_index(conn, 'ix_post_category_created_at', 'post')
+
+
+def downgrade(conn):
+    create_index(conn, 'ix_post_category_created_at', 'post', 'category', 'created_at')
+    drop_index(conn, 'ix_post_category_created_at_id', 'post')
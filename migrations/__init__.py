@@ -0,0 +1,209 @@
+"""Versioned schema migrations.
+
+Each ``NNNN_name.py`` module in this package is one revision with an
+``upgrade(conn)`` and a ``downgrade(conn)``; revisions apply in filename
+order and are recorded in the ``schema_migrations`` table in the same
+transaction as their DDL. Operations check the live schema first, so
+databases already patched by the old one-off scripts, or created by
+``db.create_all()``, upgrade cleanly.
+
+    flask db upgrade [REVISION]
+    flask db downgrade [REVISION|base]
+    flask db status
+    flask db check-plans
+"""
+import importlib
+import os
+import pkgutil
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+
+from app import db
+
+BASE = 'base'
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('revision', String(100), primary_key=True),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+class Revision:
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+        self.description = (module.__doc__ or '').strip().split('\n')[0]
+
+    def upgrade(self, conn):
+        self.module.upgrade(conn)
+
+    def downgrade(self, conn):
+        self.module.downgrade(conn)
+
+
+def revisions():
+    names = sorted(
+        name for _, name, is_pkg in pkgutil.iter_modules([os.path.dirname(__file__)])
+        if not is_pkg and name[:4].isdigit()
+    )
+    return [Revision(name, importlib.import_module(f'{__name__}.{name}')) for name in names]
+
+
+def find(name, all_revisions):
+    # Accept the full module name or just its number
+    for revision in all_revisions:
+        if name in (revision.name, revision.name.split('_', 1)[0]):
+            return revision
+    raise click.ClickException(f'Unknown revision {name!r}')
+
+
+def applied(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.revision for row in conn.execute(select(schema_migrations.c.revision))}
+
+
+def upgrade(target=None):
+    """Apply pending revisions up to ``target`` (default: all); returns the names applied."""
+    all_revisions = revisions()
+    stop = find(target, all_revisions) if target else all_revisions[-1]
+    done = []
+    for revision in all_revisions[:all_revisions.index(stop) + 1]:
+        with db.engine.begin() as conn:
+            if revision.name in applied(conn):
+                continue
+            revision.upgrade(conn)
+            conn.execute(schema_migrations.insert().values(revision=revision.name, applied_at=datetime.utcnow()))
+        done.append(revision.name)
+    return done
+
+
+def downgrade(target=None):
+    """Revert applied revisions newer than ``target``; the default reverts only the latest one."""
+    all_revisions = revisions()
+    with db.engine.connect() as conn:
+        current = applied(conn)
+        conn.commit()
+    applied_revisions = [r for r in all_revisions if r.name in current]
+    if target == BASE:
+        keep = 0
+    elif target:
+        keep = all_revisions.index(find(target, all_revisions)) + 1
+    else:
+        keep = all_revisions.index(applied_revisions[-1]) if applied_revisions else 0
+
+    done = []
+    for revision in reversed(all_revisions[keep:]):
+        if revision.name not in current:
+            continue
+        with db.engine.begin() as conn:
+            revision.downgrade(conn)
+            conn.execute(schema_migrations.delete().where(schema_migrations.c.revision == revision.name))
+        done.append(revision.name)
+    return done
+
+
+# Operations for revision modules. Each one is a no-op when the schema already matches.
+
+def has_table(conn, table):
+    return inspect(conn).has_table(table)
+
+
+def has_column(conn, table, column):
+    return any(c['name'] == column for c in inspect(conn).get_columns(table))
+
+
+def has_index(conn, table, name):
+    return any(i['name'] == name for i in inspect(conn).get_indexes(table))
+
+
+def add_column(conn, table, column, sql_type):
+    if has_table(conn, table) and not has_column(conn, table, column):
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {sql_type}'))
+
+
+def drop_column(conn, table, column):
+    if has_table(conn, table) and has_column(conn, table, column):
+        conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+
+
+def create_table(conn, table, *columns):
+    """Create a table from the columns and indexes the revision declares, never from models.py."""
+    if has_table(conn, table):
+        return
+    metadata = MetaData()
+    # Foreign keys need their target tables in the same MetaData; those already exist
+    targets = {fk.target_fullname.split('.')[0] for c in columns if isinstance(c, Column) for fk in c.foreign_keys}
+    metadata.reflect(conn, only=sorted(targets - {table}))
+    Table(table, metadata, *columns).create(conn)
+
+
+def drop_table(conn, table):
+    if has_table(conn, table):
+        conn.execute(text(f'DROP TABLE {table}'))
+
+
+def create_index(conn, name, table, *columns):
+    if has_table(conn, table) and not has_index(conn, table, name):
+        conn.execute(text(f'CREATE INDEX {name} ON {table} ({", ".join(columns)})'))
+
+
+def drop_index(conn, name, table):
+    if has_table(conn, table) and has_index(conn, table, name):
+        conn.execute(text(f'DROP INDEX {name}'))
+
+
+db_cli = AppGroup('db', help='Schema migrations.')
+
+
+@db_cli.command('upgrade')
+@click.argument('revision', required=False)
+def upgrade_command(revision):
+    """Apply pending migrations (up to REVISION)."""
+    done = upgrade(revision)
+    for name in done:
+        click.echo(f'Applied {name}')
+    if not done:
+        click.echo('Already up to date.')
+
+
+@db_cli.command('downgrade')
+@click.argument('revision', required=False)
+def downgrade_command(revision):
+    """Revert the latest migration, or every migration after REVISION ('base' for all)."""
+    done = downgrade(revision)
+    for name in done:
+        click.echo(f'Reverted {name}')
+    if not done:
+        click.echo('Nothing to revert.')
+
+
+@db_cli.command('status')
+def status_command():
+    """List migrations and whether each is applied."""
+    with db.engine.connect() as conn:
+        current = applied(conn)
+        conn.commit()
+    for revision in revisions():
+        mark = 'x' if revision.name in current else ' '
+        click.echo(f'[{mark}] {revision.name}  {revision.description}')
+
+
+@db_cli.command('check-plans')
+def check_plans_command():
+    """Fail if a page's queries need a full table scan or a sort."""
+    from migrations.plans import check_plans
+
+    problems = check_plans()
+    for path, problem, statement, detail in problems:
+        click.echo(f'{path}: {problem} ({detail})\n    {statement}', err=True)
+    if problems:
+        raise click.ClickException(f'{len(problems)} query plan(s) scan or sort a whole table')
+    click.echo('No full table scans or sorts.')
+
+
+def init_app(app):
+    app.cli.add_command(db_cli)
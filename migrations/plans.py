@@ -0,0 +1,111 @@
+"""Query plan check for the pages that matter.
+
+Requests each page through the test client as a signed-in admin (so the
+response cache is bypassed), records every SELECT it runs, and asks SQLite
+for the plan of each. A plan step that scans a whole table without an index
+is reported, and so is a sort the indexes cannot deliver (a temp B-tree for
+ORDER BY), which reads every matching row before returning the first. Small
+lookup tables are allowed both.
+"""
+import re
+
+from flask import current_app
+from sqlalchemy import event
+
+from app import db
+from models import Comment, Post, User
+
+ALLOWED_SCANS = {'category', 'site_settings', 'cache_version', 'user'}
+
+PAGES = [
+    '/',
+    '/?category={category}',
+    '/?page=2',
+    '/post/{slug}',
+    '/post/{post_id}/comments',
+    '/search?q=economy',
+    '/dashboard',
+    '/dashboard/posts',
+    '/dashboard/posts?category={category}',
+    '/dashboard/subscribers',
+    '/dashboard/submissions',
+    '/dashboard/submissions?status=pending',
+    '/dashboard/orders',
+    '/dashboard/orders?status=pending',
+]
+
+# "SCAN post" or "SCAN TABLE post" (older SQLite), but not "... USING INDEX ..."
+_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+# A step that reads a table; lookups by primary key read a bounded id list
+_TABLE_RE = re.compile(r'^(?:SCAN|SEARCH) (?:TABLE )?(\w+)(?!.*PRIMARY KEY)')
+# Also "USE TEMP B-TREE FOR RIGHT PART OF ORDER BY" when an index gives only the leading terms
+_SORT_RE = re.compile(r'^USE TEMP B-TREE FOR .*ORDER BY$')
+
+
+def plan_problems(conn, statement, parameters):
+    """Yield (problem, plan step) for each full scan or sort of a table outside ``ALLOWED_SCANS``."""
+    tables = set(db.metadata.tables) - ALLOWED_SCANS
+    steps = [(row[1], row[-1]) for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+    for parent, detail in steps:
+        match = _SCAN_RE.match(detail)
+        if match and match.group(1) in tables:
+            yield f'full scan of {match.group(1)}', detail
+        elif _SORT_RE.match(detail):
+            # A sort orders the rows its own SELECT reads, the steps beside it
+            sorted_tables = {m.group(1) for p, d in steps if p == parent for m in [_TABLE_RE.match(d)] if m} & tables
+            if sorted_tables:
+                yield f'sort of {", ".join(sorted(sorted_tables))}', detail
+
+
+def sample_values():
+    post = db.session.query(Post.id, Post.slug, Post.category).order_by(Post.id.desc()).first()
+    if post is None:
+        return {}
+    commented = db.session.query(Comment.post_id).order_by(Comment.id.desc()).first()
+    return {
+        'post_id': commented.post_id if commented else post.id,
+        'slug': post.slug,
+        'category': post.category,
+    }
+
+
+def check_plans(pages=PAGES):
+    """Return (path, problem, statement, plan step) for every full scan or sort the pages trigger."""
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('Query plan checks need SQLite')
+
+    values = sample_values()
+    admin = db.session.query(User.id).order_by(User.id).first()
+    client = current_app.test_client()
+    if admin is not None:
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append((statement, parameters))
+
+    problems = []
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        for page in pages:
+            try:
+                path = page.format(**values)
+            except KeyError:
+                continue  # Needs a post and there are none
+            statements.clear()
+            client.get(path).close()
+            seen = set()
+            with db.engine.connect() as conn:
+                for statement, parameters in list(statements):
+                    if statement in seen:
+                        continue
+                    seen.add(statement)
+                    for problem, detail in plan_problems(conn, statement, parameters):
+                        problems.append((path, problem, ' '.join(statement.split()), detail))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return problems
@@ -11,28 +11,65 @@ class User(UserMixin, db.Model):
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
-    slug = db.Column(db.String(250), unique=True, nullable=True) # Initially nullable for migration
+    slug = db.Column(db.String(250), unique=True, nullable=False)  # Legacy rows: flask slugs-backfill
     content = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(50), default='World')
     image_url = db.Column(db.String(500), nullable=True)
+    image_hash = db.Column(db.String(64), nullable=True)
+    image_size = db.Column(db.Integer, nullable=True)
+    image_mime = db.Column(db.String(100), nullable=True)
     featured = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=True)  # Set by edit_post; feeds and sitemaps fall back to created_at
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     contributor_name = db.Column(db.String(200), nullable=True)  # For credited user submissions
+    views = db.Column(db.Integer, default=0)
+    total_seconds_read = db.Column(db.Integer, default=0)
+    # Derived from content at save time by rendering.py; read paths use these, never content
+    content_html = db.Column(db.Text, nullable=True)
+    excerpt = db.Column(db.String(300), nullable=True)
+    word_count = db.Column(db.Integer, nullable=True)
+    reading_minutes = db.Column(db.Integer, nullable=True)
+    toc = db.Column(db.Text, nullable=True)  # JSON list of {level, id, title}
+    render_version = db.Column(db.Integer, nullable=True)
     attachments = db.relationship('Attachment', backref='post', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+        db.Index('ix_post_category_created_at_id', 'category', 'created_at', 'id'),
+        db.Index('ix_post_featured_created_at', 'featured', 'created_at'),
+    )
+
 class Attachment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(300), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True)
+    size = db.Column(db.Integer, nullable=True)
+    mime_type = db.Column(db.String(100), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
 
+    __table_args__ = (db.Index('ix_attachment_post_id', 'post_id'),)
+
+class ActivePageViewer(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    viewer_id = db.Column(db.String(100), nullable=False)
+    last_heartbeat = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_active_page_viewer_post_viewer', 'post_id', 'viewer_id'),
+        db.Index('ix_active_page_viewer_last_heartbeat', 'last_heartbeat'),
+    )
+
 class Subscriber(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(200), unique=True, nullable=False)
     subscribed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_subscriber_subscribed_at', 'subscribed_at'),)
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -46,6 +83,11 @@ class Comment(db.Model):
     post = db.relationship('Post', backref=db.backref('comments', lazy=True, order_by='Comment.created_at'))
     replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]), lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_comment_post_parent_created_at', 'post_id', 'parent_id', 'created_at'),
+        db.Index('ix_comment_parent_id', 'parent_id'),  # Reply lookups in the thread CTE
+    )
+
 class SiteSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     facebook_url = db.Column(db.String(500), default='')
@@ -62,15 +104,68 @@ class Submission(db.Model):
     content = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(50), default='World')
     image_url = db.Column(db.String(500), nullable=True)
+    image_hash = db.Column(db.String(64), nullable=True)
+    image_size = db.Column(db.Integer, nullable=True)
+    image_mime = db.Column(db.String(100), nullable=True)
     status = db.Column(db.String(20), default='pending')  # pending, approved, rejected
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
     admin_notes = db.Column(db.Text, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_submission_status_submitted_at', 'status', 'submitted_at'),
+        db.Index('ix_submission_submitted_at', 'submitted_at'),
+    )
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class Newsletter(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(300), nullable=False)
+    body_text = db.Column(db.Text, nullable=False)
+    body_html = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), default='draft')  # draft, sending, sent
+    last_subscriber_id = db.Column(db.Integer, default=0)  # Checkpoint for resuming a run
+    sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)  # Lease of the run that is sending it
+
+class NewsletterDelivery(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    newsletter_id = db.Column(db.Integer, db.ForeignKey('newsletter.id'), nullable=False)
+    subscriber_id = db.Column(db.Integer, db.ForeignKey('subscriber.id'), nullable=False)
+    email = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # sent, failed
+    error = db.Column(db.Text, nullable=True)
+    attempted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_newsletter_delivery_newsletter_status', 'newsletter_id', 'status'),)
+
+class CacheVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments
+    key = db.Column(db.String(200), unique=True, nullable=True)  # Dedupe key for periodic jobs
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=5)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
 class ServiceOrder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     service_name = db.Column(db.String(200), nullable=False)
@@ -82,3 +177,44 @@ class ServiceOrder(db.Model):
     message = db.Column(db.Text, nullable=True)
     status = db.Column(db.String(20), default='pending')  # pending, contacted, completed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_service_order_status_created_at', 'status', 'created_at'),
+        db.Index('ix_service_order_created_at', 'created_at'),
+    )
+
+class RelatedPost(db.Model):
+    # Precomputed by related.py; rank 0 is the closest match
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index('ix_related_post_related_id', 'related_id'),)
+
+class PostActivity(db.Model):
+    # Hourly reader counters written by the analytics flush; rankings.py folds them into PostRanking
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)  # Hours since the Unix epoch
+    views = db.Column(db.Integer, nullable=False, default=0)
+    seconds = db.Column(db.Integer, nullable=False, default=0)
+    scored_views = db.Column(db.Integer, nullable=False, default=0)  # Already counted in PostRanking
+    scored_seconds = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.Index('ix_post_activity_hour', 'hour'),)
+
+class PostRanking(db.Model):
+    # Only posts read recently have a row; all rows are decayed to scored_hour together
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    trending = db.Column(db.Float, nullable=False, default=0)
+    week_views = db.Column(db.Integer, nullable=False, default=0)
+    week_seconds = db.Column(db.Integer, nullable=False, default=0)
+    scored_hour = db.Column(db.Integer, nullable=False)
+
+class RankingEntry(db.Model):
+    # Materialized top-N lists; category '' is the whole site
+    kind = db.Column(db.String(20), primary_key=True)  # trending, most_read
+    category = db.Column(db.String(50), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
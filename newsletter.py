@@ -0,0 +1,308 @@
+"""Newsletter delivery to the Subscriber list.
+
+Subscribers are streamed in id order, one chunk at a time, and fanned out to
+a thread pool that shares a small pool of persistent SMTP connections,
+optionally throttled to a fixed rate. After each chunk the per-recipient
+results and the newsletter's checkpoint (the last subscriber id handled)
+commit together, so a crashed run resumes after the last finished chunk.
+Delivery is at-least-once: recipients of a chunk that was in flight during
+a crash may receive the message twice.
+
+A run claims the newsletter with a conditional UPDATE, as ``jobs`` claims
+jobs, and renews that lease with every checkpoint; a second run started
+meanwhile (a CLI resume beside a queued job, say) gets ``NewsletterBusy``.
+A crashed run's lease lapses after ``NEWSLETTER_LEASE_SECONDS``.
+"""
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, or_, update
+
+from app import db
+from jobs import job
+from models import Newsletter, NewsletterDelivery, Subscriber
+
+log = logging.getLogger(__name__)
+
+
+class SMTPPool:
+    """Persistent SMTP connections shared by sender threads, opened on demand."""
+
+    def __init__(self, host, port, username=None, password=None, use_tls=False, size=4, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            conn.starttls()
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    def send(self, message):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                self._send(conn, message)
+            except smtplib.SMTPServerDisconnected:
+                # Idle connections get dropped by the server; reconnect once
+                self._send(self._connect(), message)
+        finally:
+            self._slots.release()
+
+    def _send(self, conn, message):
+        """Send on ``conn`` and return it to the pool, or close it if it failed."""
+        try:
+            conn.send_message(message)
+        except smtplib.SMTPRecipientsRefused:
+            # Only the recipient was refused; the connection is still good
+            self._idle.put(conn)
+            raise
+        except BaseException:
+            conn.close()
+            raise
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                conn.quit()
+            except smtplib.SMTPException:
+                conn.close()
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` sends per second on average."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def build_message(subject, body_text, body_html, email, sender):
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = email
+    message['Subject'] = subject
+    message.set_content(body_text)
+    if body_html:
+        message.add_alternative(body_html, subtype='html')
+    return message
+
+
+def pool_from_config(config, size):
+    return SMTPPool(
+        config['SMTP_HOST'],
+        config['SMTP_PORT'],
+        username=config['SMTP_USERNAME'],
+        password=config['SMTP_PASSWORD'],
+        use_tls=config['SMTP_USE_TLS'],
+        size=size,
+    )
+
+
+class NewsletterBusy(Exception):
+    """Another run is sending this newsletter."""
+
+
+def claim(newsletter_id, held=None):
+    """Take the sending lease, or renew the ``held`` one; returns its expiry, or None if another run has it."""
+    now = datetime.utcnow()
+    until = now + timedelta(seconds=current_app.config['NEWSLETTER_LEASE_SECONDS'])
+    free = Newsletter.locked_until == held if held else or_(Newsletter.locked_until.is_(None), Newsletter.locked_until < now)
+    result = db.session.execute(
+        update(Newsletter)
+        .where(Newsletter.id == newsletter_id, Newsletter.status != 'sent', free)
+        .values(status='sending', locked_until=until)
+    )
+    return until if result.rowcount == 1 else None
+
+
+def send_newsletter(newsletter_id, chunk_size=None, concurrency=None, rate=None, pool=None):
+    """Deliver a newsletter to every subscriber past its checkpoint; returns (sent, failed) for this run."""
+    config = current_app.config
+    chunk_size = chunk_size or config['NEWSLETTER_CHUNK_SIZE']
+    concurrency = concurrency or config['NEWSLETTER_CONCURRENCY']
+    rate = config['NEWSLETTER_RATE'] if rate is None else rate
+    sender = config['NEWSLETTER_SENDER']
+
+    newsletter = db.session.get(Newsletter, newsletter_id)
+    if newsletter is None:
+        raise LookupError(f'Newsletter {newsletter_id} does not exist')
+    if newsletter.status == 'sent':
+        return 0, 0
+    lease = claim(newsletter.id)
+    if lease is None:
+        db.session.rollback()
+        if newsletter.status == 'sent':
+            return 0, 0
+        raise NewsletterBusy(f'Newsletter {newsletter_id} is being sent by another run')
+    newsletter.started_at = newsletter.started_at or datetime.utcnow()
+    db.session.commit()
+
+    pool = pool or pool_from_config(config, concurrency)
+    limiter = RateLimiter(rate)
+    # Sender threads get plain values; the ORM object stays on this thread's session
+    content = (newsletter.subject, newsletter.body_text, newsletter.body_html)
+
+    def deliver(subscriber):
+        subscriber_id, email = subscriber
+        limiter.acquire()
+        try:
+            pool.send(build_message(*content, email, sender))
+            return subscriber_id, email, 'sent', None
+        except (smtplib.SMTPException, OSError) as e:
+            return subscriber_id, email, 'failed', str(e)[:500]
+
+    sent = failed = 0
+    try:
+        with ThreadPoolExecutor(concurrency, thread_name_prefix='newsletter') as executor:
+            while True:
+                chunk = (
+                    db.session.query(Subscriber.id, Subscriber.email)
+                    .filter(Subscriber.id > (newsletter.last_subscriber_id or 0))
+                    .order_by(Subscriber.id)
+                    .limit(chunk_size)
+                    .all()
+                )
+                if not chunk:
+                    break
+                results = list(executor.map(deliver, chunk))
+                now = datetime.utcnow()
+                db.session.execute(insert(NewsletterDelivery), [
+                    {
+                        'newsletter_id': newsletter.id,
+                        'subscriber_id': subscriber_id,
+                        'email': email,
+                        'status': status,
+                        'error': error,
+                        'attempted_at': now,
+                    }
+                    for subscriber_id, email, status, error in results
+                ])
+                chunk_sent = sum(1 for r in results if r[2] == 'sent')
+                sent += chunk_sent
+                failed += len(results) - chunk_sent
+                newsletter.sent_count = (newsletter.sent_count or 0) + chunk_sent
+                newsletter.failed_count = (newsletter.failed_count or 0) + len(results) - chunk_sent
+                newsletter.last_subscriber_id = chunk[-1].id
+                # A run whose lease lapsed and was taken over must not checkpoint over the new one
+                lease = claim(newsletter.id, lease)
+                if lease is None:
+                    db.session.rollback()
+                    raise NewsletterBusy(f'Newsletter {newsletter_id} was taken over by another run')
+                db.session.commit()
+                log.info('Newsletter %s: delivered through subscriber %s', newsletter.id, newsletter.last_subscriber_id)
+    except BaseException:
+        # Let a retry resume at once instead of waiting out the lease
+        db.session.rollback()
+        if lease is not None:
+            db.session.execute(
+                update(Newsletter).where(Newsletter.id == newsletter.id, Newsletter.locked_until == lease).values(locked_until=None)
+            )
+            db.session.commit()
+        raise
+    finally:
+        pool.close()
+
+    newsletter.status = 'sent'
+    newsletter.finished_at = datetime.utcnow()
+    newsletter.locked_until = None
+    db.session.commit()
+    return sent, failed
+
+
+@job('newsletter.send', max_attempts=3, backoff=60, timeout=6 * 3600)
+def send_newsletter_job(newsletter_id):
+    # Retries resume from the checkpoint rather than starting over
+    try:
+        send_newsletter(newsletter_id)
+    except NewsletterBusy as e:
+        # The other run delivers it
+        log.info('%s', e)
+
+
+@click.command('newsletter-create')
+@click.option('--subject', required=True)
+@click.option('--text', 'text_file', type=click.File('r'), required=True, help='Plain-text body.')
+@click.option('--html', 'html_file', type=click.File('r'), help='Optional HTML body.')
+@with_appcontext
+def create_command(subject, text_file, html_file):
+    """Create a draft newsletter and print its id."""
+    newsletter = Newsletter(subject=subject, body_text=text_file.read(), body_html=html_file.read() if html_file else None)
+    db.session.add(newsletter)
+    db.session.commit()
+    click.echo(newsletter.id)
+
+
+@click.command('newsletter-send')
+@click.argument('newsletter_id', type=int)
+@click.option('--concurrency', type=int, help='Parallel SMTP connections.')
+@click.option('--rate', type=float, help='Messages per second; 0 for no limit.')
+@click.option('--chunk-size', type=int, help='Subscribers per checkpoint.')
+@with_appcontext
+def send_command(newsletter_id, concurrency, rate, chunk_size):
+    """Send (or resume sending) a newsletter."""
+    try:
+        sent, failed = send_newsletter(newsletter_id, chunk_size=chunk_size, concurrency=concurrency, rate=rate)
+    except NewsletterBusy as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Sent {sent}, failed {failed}.')
+
+
+def init_app(app):
+    app.config.setdefault('SMTP_HOST', os.getenv('SMTP_HOST', 'localhost'))
+    app.config.setdefault('SMTP_PORT', int(os.getenv('SMTP_PORT', '25')))
+    app.config.setdefault('SMTP_USERNAME', os.getenv('SMTP_USERNAME'))
+    app.config.setdefault('SMTP_PASSWORD', os.getenv('SMTP_PASSWORD'))
+    app.config.setdefault('SMTP_USE_TLS', os.getenv('SMTP_USE_TLS', '0') == '1')
+    app.config.setdefault('NEWSLETTER_SENDER', os.getenv('NEWSLETTER_SENDER', 'Mind Economists <newsletter@localhost>'))
+    app.config.setdefault('NEWSLETTER_CONCURRENCY', 4)
+    app.config.setdefault('NEWSLETTER_RATE', 0)
+    app.config.setdefault('NEWSLETTER_CHUNK_SIZE', 500)
+    # Must outlast sending one chunk; a crashed run blocks resumes this long
+    app.config.setdefault('NEWSLETTER_LEASE_SECONDS', 900)
+    app.cli.add_command(create_command)
+    app.cli.add_command(send_command)
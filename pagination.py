@@ -0,0 +1,119 @@
+"""Keyset (cursor) pagination.
+
+Pages are addressed by the sort key of the last row already shown instead of
+an OFFSET, so fetching page 500 costs the same index seek as page 1 and rows
+inserted between fetches neither repeat nor get skipped. Rows with no
+``created_at`` sort after all dated ones, newest id first.
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort
+from flask_sqlalchemy.pagination import Pagination
+
+from app import db
+
+Cursor = namedtuple('Cursor', 'created_at id page')
+
+
+class KeysetPage:
+    """A page of keyset results with the attributes templates use from Flask-SQLAlchemy's ``Pagination``.
+
+    Rows are never counted: ``total`` is None and ``pages`` runs only to the
+    next page while ``has_next``. Numbered links (``prev_num``, ``next_num``,
+    ``iter_pages``) go through the view's OFFSET fallback; ``next_cursor`` is
+    the cheap way forward.
+    """
+    total = None
+
+    def __init__(self, items, per_page, next_cursor, page=1):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.page = page
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def pages(self):
+        return self.next_num or self.page
+
+    iter_pages = Pagination.iter_pages
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def encode_cursor(created_at, row_id, page=2):
+    """Token for the page after a row; ``page`` is the number of the page it opens."""
+    payload = json.dumps([created_at.isoformat() if created_at else None, row_id, page], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return the Cursor for a token, None for no token, or abort with 400 if it is malformed."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, row_id, *page = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        # Tokens issued before page numbers were added carry only the position
+        page = int(page[0]) if page else 2
+        if page < 2:
+            raise ValueError(page)
+        return Cursor(datetime.fromisoformat(created_at) if created_at is not None else None, int(row_id), page)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        abort(400, description='Malformed cursor.')
+
+
+def after(position, created_col, id_col):
+    """Filter for the rows that follow ``position`` in newest-first order."""
+    if position.created_at is None:
+        return db.and_(created_col.is_(None), id_col < position.id)
+    return db.or_(db.tuple_(created_col, id_col) < (position.created_at, position.id), created_col.is_(None))
+
+
+def newest_first(created_col, id_col):
+    return created_col.desc().nulls_last(), id_col.desc()
+
+
+def keyset_paginate(query, created_col, id_col, cursor=None, per_page=6):
+    """Return the page after ``cursor`` ordered newest first by ``(created_col, id_col)``."""
+    position = decode_cursor(cursor)
+    rows = []
+    # Dated and undated rows are read separately so each half is a plain index range
+    if position is None or position.created_at is not None:
+        dated = query.filter(created_col.isnot(None))
+        if position:
+            dated = dated.filter(db.tuple_(created_col, id_col) < (position.created_at, position.id))
+        rows = dated.order_by(created_col.desc(), id_col.desc()).limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        undated = query.filter(created_col.is_(None))
+        if position and position.created_at is None:
+            undated = undated.filter(id_col < position.id)
+        rows += undated.order_by(id_col.desc()).limit(per_page + 1 - len(rows)).all()
+
+    page = position.page if position else 1
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_col.key), getattr(last, id_col.key), page + 1)
+    return KeysetPage(rows, per_page, next_cursor, page)
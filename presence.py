@@ -0,0 +1,225 @@
+"""Live "N people reading" counters.
+
+Viewers are held in memory, per post, with an expiry time. Expiries are also
+filed into one-second buckets (a timing wheel), so the sweeper drops every
+viewer that went quiet in a bucket at once instead of scanning all posts.
+Reader counts are a dict length, and listeners block on a condition until a
+post's count changes, which is what the Server-Sent Events stream waits on.
+
+The tracker is per process. With ``PRESENCE_SNAPSHOT_SECONDS`` set, each
+process snapshots its viewers into the ``active_page_viewer`` table, and
+counts join this process's live viewers with the other processes' rows, so
+every worker reports the same number give or take one snapshot interval.
+
+Each open reader-count stream holds a worker thread for up to
+``PRESENCE_STREAM_SECONDS``. Under sync workers, one request per worker,
+set it to 0: the stream then answers 204, which tells the browser to stop
+reconnecting and poll ``/post/<id>/readers`` instead.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, insert, select
+
+from app import db
+from models import ActivePageViewer
+
+log = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    def __init__(self, ttl=30, max_viewers=100000, granularity=1.0):
+        self.ttl = ttl
+        self.max_viewers = max_viewers
+        self.granularity = granularity
+        self._cond = threading.Condition()
+        self._viewers = {}
+        self._wheel = {}
+        self._versions = {}  # Only posts with viewers; a version is never reused, so dropping one is safe
+        self._clock = 0
+        self._total = 0
+        self._swept_bucket = None
+
+    def _bucket(self, when):
+        return int(when / self.granularity)
+
+    def _changed(self, post_id):
+        if post_id in self._viewers:
+            self._clock += 1
+            self._versions[post_id] = self._clock
+        else:
+            self._versions.pop(post_id, None)
+
+    def heartbeat(self, post_id, viewer_id, now=None):
+        now = time.time() if now is None else now
+        expires_at = now + self.ttl
+        with self._cond:
+            viewers = self._viewers.get(post_id)
+            if viewers is None or viewer_id not in viewers:
+                if self._total >= self.max_viewers:
+                    return len(viewers) if viewers else 0
+                if viewers is None:
+                    viewers = self._viewers[post_id] = {}
+                viewers[viewer_id] = expires_at
+                self._total += 1
+                self._changed(post_id)
+                self._cond.notify_all()
+            viewers[viewer_id] = expires_at
+            self._wheel.setdefault(self._bucket(expires_at), set()).add((post_id, viewer_id))
+            return len(viewers)
+
+    def leave(self, post_id, viewer_id):
+        with self._cond:
+            viewers = self._viewers.get(post_id)
+            if viewers and viewers.pop(viewer_id, None) is not None:
+                self._total -= 1
+                if not viewers:
+                    del self._viewers[post_id]
+                self._changed(post_id)
+                self._cond.notify_all()
+
+    def count(self, post_id):
+        viewers = self._viewers.get(post_id)
+        return len(viewers) if viewers else 0
+
+    def viewer_ids(self, post_id):
+        with self._cond:
+            return set(self._viewers.get(post_id, ()))
+
+    def version(self, post_id):
+        return self._versions.get(post_id, 0)
+
+    def sweep(self, now=None):
+        """Expire every viewer whose bucket has fully passed; returns how many were removed."""
+        now = time.time() if now is None else now
+        current = self._bucket(now)
+        removed = 0
+        with self._cond:
+            if not self._wheel:
+                self._swept_bucket = current
+                return 0
+            start = self._swept_bucket if self._swept_bucket is not None else min(self._wheel)
+            changed = set()
+            # The current bucket still holds viewers that expire later in this second
+            for bucket in range(start, current):
+                for post_id, viewer_id in self._wheel.pop(bucket, ()):
+                    viewers = self._viewers.get(post_id)
+                    # A later heartbeat has moved this viewer to a newer bucket
+                    if viewers is None or viewers.get(viewer_id, now + 1) > now:
+                        continue
+                    del viewers[viewer_id]
+                    if not viewers:
+                        del self._viewers[post_id]
+                    self._total -= 1
+                    removed += 1
+                    changed.add(post_id)
+            self._swept_bucket = current
+            for post_id in changed:
+                self._changed(post_id)
+            if changed:
+                self._cond.notify_all()
+        return removed
+
+    def wait_for_change(self, post_id, seen_version, timeout):
+        """Block until ``post_id`` moves past ``seen_version``; returns ``(version, count)``."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version(post_id) != seen_version, timeout)
+            return self.version(post_id), self.count(post_id)
+
+    def viewers(self):
+        with self._cond:
+            return [
+                (post_id, viewer_id, expires_at - self.ttl)
+                for post_id, viewers in self._viewers.items()
+                for viewer_id, expires_at in viewers.items()
+            ]
+
+
+class PresenceService:
+    def __init__(self, app, tracker, sweep_interval=1.0, snapshot_interval=0):
+        self.app = app
+        self.tracker = tracker
+        self.sweep_interval = sweep_interval
+        self.snapshot_interval = snapshot_interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._last_snapshot = time.monotonic()
+        atexit.register(self.stop)
+
+    def ensure_running(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='presence-sweeper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.sweep_interval):
+            self.tracker.sweep()
+            if self.snapshot_interval and time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+                self._last_snapshot = time.monotonic()
+                try:
+                    self.snapshot()
+                except Exception:
+                    log.exception('Presence snapshot failed')
+
+    def count(self, post_id):
+        """Readers of ``post_id``: across all processes when snapshotting, else in this one."""
+        if not self.snapshot_interval:
+            return self.tracker.count(post_id)
+        table = ActivePageViewer.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=self.tracker.ttl)
+        query = select(table.c.viewer_id).where(table.c.post_id == post_id, table.c.last_heartbeat >= cutoff)
+        # Its own connection, so no read transaction outlives the query
+        with db.engine.connect() as connection:
+            others = set(connection.scalars(query))
+        return len(self.tracker.viewer_ids(post_id) | others)
+
+    def snapshot(self):
+        """Mirror this process's viewers into active_page_viewer in one transaction."""
+        table = ActivePageViewer.__table__
+        rows = [
+            {'p_id': post_id, 'v_id': viewer_id, 'seen': datetime.utcfromtimestamp(seen)}
+            for post_id, viewer_id, seen in self.tracker.viewers()
+        ]
+        cutoff = datetime.utcnow() - timedelta(seconds=self.tracker.ttl)
+        with self.app.app_context():
+            db.session.execute(delete(table).where(table.c.last_heartbeat < cutoff))
+            if rows:
+                db.session.execute(
+                    delete(table).where(table.c.post_id == bindparam('p_id'), table.c.viewer_id == bindparam('v_id')),
+                    rows
+                )
+                db.session.execute(
+                    insert(table).values(post_id=bindparam('p_id'), viewer_id=bindparam('v_id'), last_heartbeat=bindparam('seen')),
+                    rows
+                )
+            db.session.commit()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def get_presence():
+    service = current_app.extensions['presence']
+    service.ensure_running()
+    return service
+
+
+def init_app(app):
+    app.config.setdefault('PRESENCE_TTL_SECONDS', 30)
+    app.config.setdefault('PRESENCE_MAX_VIEWERS', 100000)
+    app.config.setdefault('PRESENCE_SNAPSHOT_SECONDS', 0)
+    app.config.setdefault('PRESENCE_STREAM_SECONDS', 300)
+    tracker = PresenceTracker(ttl=app.config['PRESENCE_TTL_SECONDS'], max_viewers=app.config['PRESENCE_MAX_VIEWERS'])
+    app.extensions['presence'] = PresenceService(app, tracker, snapshot_interval=app.config['PRESENCE_SNAPSHOT_SECONDS'])
@@ -0,0 +1,275 @@
+"""Trending and most-read rankings from reader analytics.
+
+The analytics flush also adds each batch of beacons to hourly per-post
+buckets (``post_activity``), in the same transaction as the ``post.views``
+update. ``refresh`` folds the buckets into ``post_ranking``
+incrementally. One UPDATE ages every score by the hours since the last
+refresh. Then only bucket counts that changed since that refresh are added,
+and only buckets that have just left the week are subtracted. The post
+table is never scanned.
+
+    trending   views plus minutes read, halving every ``RANKINGS_HALF_LIFE_HOURS``
+    most_read  views in the last seven days
+
+Each refresh writes the top ``RANKINGS_TOP_N`` of both lists, site-wide and
+per category, to ``ranking_entry``, so a rail on ``index`` is one
+primary-key range read. Refreshes run every ``REFRESH_SECONDS`` as a
+periodic job when the queue is enabled, and otherwise from the analytics
+flush thread, with a lock file keeping it to one worker per host.
+"""
+import logging
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from jobs import job, after_commit
+from locks import LockHeld, file_lock
+from models import Post, PostActivity, PostRanking, RankingEntry
+from rendering import card_options
+from response_cache import invalidate
+from static_export import feed_paths, schedule_pages
+
+log = logging.getLogger(__name__)
+
+REFRESH_SECONDS = 300
+WEEK_HOURS = 7 * 24
+RETAIN_HOURS = WEEK_HOURS + 24  # Buckets stay a day past the week in case refreshes fall behind
+SECONDS_PER_VIEW = 60  # For trending, a minute of reading counts as much as a view
+MIN_TRENDING = 0.01
+
+_UPSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+
+def current_hour(now=None):
+    return int((now if now is not None else time.time()) // 3600)
+
+
+def record_activity(counts, hour=None):
+    """Add ``{post_id: (views, seconds)}`` to an hour's buckets; runs inside the caller's transaction."""
+    if not counts:
+        return
+    hour = current_hour() if hour is None else hour
+    table = PostActivity.__table__
+    upsert = _UPSERTS.get(db.engine.dialect.name)
+    if upsert is not None:
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.post_id, table.c.hour],
+            set_={'views': table.c.views + stmt.excluded.views, 'seconds': table.c.seconds + stmt.excluded.seconds},
+        )
+        db.session.execute(stmt, [
+            {'post_id': post_id, 'hour': hour, 'views': views, 'seconds': seconds,
+             'scored_views': 0, 'scored_seconds': 0}
+            for post_id, (views, seconds) in counts.items()
+        ])
+        return
+    # No upsert on this backend: update the buckets that exist, insert the rest
+    for post_id, (views, seconds) in counts.items():
+        result = db.session.execute(
+            update(table)
+            .where(table.c.post_id == post_id, table.c.hour == hour)
+            .values(views=table.c.views + views, seconds=table.c.seconds + seconds)
+        )
+        if not result.rowcount:
+            db.session.execute(insert(table).values(
+                post_id=post_id, hour=hour, views=views, seconds=seconds, scored_views=0, scored_seconds=0))
+
+
+def remove_post(post_id):
+    """Drop a deleted post's activity, score and list entries; runs inside the caller's transaction.
+
+    SQLite can hand a deleted post's id to the next post, which would otherwise inherit its score.
+    """
+    for model in (RankingEntry, PostRanking, PostActivity):
+        db.session.execute(delete(model).where(model.post_id == post_id))
+
+
+def _fold(hour, half_life):
+    """Bring ``post_ranking`` up to ``hour``."""
+    ranking = PostRanking.__table__
+    activity = PostActivity.__table__
+    last = db.session.query(func.max(ranking.c.scored_hour)).scalar()
+    if last is None:
+        last = hour - WEEK_HOURS - 1
+
+    if hour > last:
+        # Every row was scored at the same hour, so one factor ages them all
+        factor = 0.5 ** ((hour - last) / half_life)
+        db.session.execute(update(ranking).values(trending=ranking.c.trending * factor, scored_hour=hour))
+
+    leaving = db.session.execute(
+        select(activity.c.post_id, func.sum(activity.c.scored_views), func.sum(activity.c.scored_seconds))
+        .where(activity.c.hour > last - WEEK_HOURS, activity.c.hour <= hour - WEEK_HOURS)
+        .group_by(activity.c.post_id)
+    ).all()
+    if leaving:
+        db.session.execute(
+            update(ranking).where(ranking.c.post_id == bindparam('id')).values(
+                week_views=ranking.c.week_views - bindparam('old_views'),
+                week_seconds=ranking.c.week_seconds - bindparam('old_seconds'),
+            ),
+            [{'id': post_id, 'old_views': views, 'old_seconds': seconds} for post_id, views, seconds in leaving],
+        )
+
+    # Only the buckets written since the last refresh can have changed; the flush writes the current hour
+    changed = db.session.execute(
+        select(activity.c.post_id, activity.c.hour, activity.c.views, activity.c.seconds,
+               activity.c.scored_views, activity.c.scored_seconds)
+        .where(activity.c.hour >= last - 1,
+               or_(activity.c.views != activity.c.scored_views, activity.c.seconds != activity.c.scored_seconds))
+    ).all()
+    deltas = {}
+    for row in changed:
+        views, seconds = row.views - row.scored_views, row.seconds - row.scored_seconds
+        delta = deltas.setdefault(row.post_id, [0.0, 0, 0])
+        delta[0] += (views + seconds / SECONDS_PER_VIEW) * 0.5 ** ((hour - row.hour) / half_life)
+        if row.hour > hour - WEEK_HOURS:
+            delta[1] += views
+            delta[2] += seconds
+    if changed:
+        # Mark what was read, not the live columns, so a flush landing meanwhile is counted next time
+        db.session.execute(
+            update(activity).where(activity.c.post_id == bindparam('id'), activity.c.hour == bindparam('at'))
+            .values(scored_views=bindparam('read_views'), scored_seconds=bindparam('read_seconds')),
+            [{'id': r.post_id, 'at': r.hour, 'read_views': r.views, 'read_seconds': r.seconds} for r in changed],
+        )
+        existing = set(db.session.scalars(select(ranking.c.post_id).where(ranking.c.post_id.in_(list(deltas)))))
+        missing = [post_id for post_id in deltas if post_id not in existing]
+        if missing:
+            db.session.execute(insert(ranking), [
+                {'post_id': post_id, 'trending': 0.0, 'week_views': 0, 'week_seconds': 0, 'scored_hour': hour}
+                for post_id in missing
+            ])
+        db.session.execute(
+            update(ranking).where(ranking.c.post_id == bindparam('id')).values(
+                trending=ranking.c.trending + bindparam('add_trending'),
+                week_views=ranking.c.week_views + bindparam('add_views'),
+                week_seconds=ranking.c.week_seconds + bindparam('add_seconds'),
+            ),
+            [{'id': post_id, 'add_trending': t, 'add_views': v, 'add_seconds': s} for post_id, (t, v, s) in deltas.items()],
+        )
+
+    db.session.execute(delete(ranking).where(
+        ranking.c.trending < MIN_TRENDING, ranking.c.week_views <= 0, ranking.c.week_seconds <= 0))
+    db.session.execute(delete(activity).where(activity.c.hour <= hour - RETAIN_HOURS))
+
+
+def _top_lists(top_n):
+    """Current top-N entries as (kind, category, rank, post_id, score) tuples."""
+    entries = []
+    for kind, score in (('trending', PostRanking.trending), ('most_read', PostRanking.week_views)):
+        base = (
+            select(PostRanking.post_id, Post.category, score.label('score'))
+            .join(Post, Post.id == PostRanking.post_id)
+            .where(score > 0)
+        )
+        order = (score.desc(), PostRanking.post_id.desc())
+        for rank, row in enumerate(db.session.execute(base.order_by(*order).limit(top_n))):
+            entries.append((kind, '', rank, row.post_id, float(row.score)))
+        ranked = (
+            base.where(Post.category.isnot(None), Post.category != '')
+            .add_columns(func.row_number().over(partition_by=Post.category, order_by=order).label('rank'))
+            .subquery()
+        )
+        for row in db.session.execute(select(ranked).where(ranked.c.rank <= top_n)):
+            entries.append((kind, row.category, row.rank - 1, row.post_id, float(row.score)))
+    return entries
+
+
+def _materialize(top_n):
+    """Rewrite ``ranking_entry`` if any list's order changed; returns the categories whose lists did."""
+    entries = _top_lists(top_n)
+    current = {(e.kind, e.category, e.rank, e.post_id) for e in RankingEntry.query}
+    fresh = {entry[:4] for entry in entries}
+    if current == fresh:
+        return set()
+    db.session.execute(delete(RankingEntry))
+    if entries:
+        db.session.execute(insert(RankingEntry.__table__), [
+            {'kind': kind, 'category': category, 'rank': rank, 'post_id': post_id, 'score': score}
+            for kind, category, rank, post_id, score in entries
+        ])
+    return {entry[1] for entry in current ^ fresh}
+
+
+def refresh(now=None):
+    """Fold new activity into the scores and rewrite changed lists; returns the categories changed ('' is site-wide)."""
+    config = current_app.config
+    _fold(current_hour(now), config['RANKINGS_HALF_LIFE_HOURS'])
+    changed = _materialize(config['RANKINGS_TOP_N'])
+    if changed:
+        after_commit(lambda: invalidate('rankings'))
+        if config['STATIC_EXPORT_ENABLED']:
+            schedule_pages([path for category in sorted(changed) for path in feed_paths(category or None)])
+    db.session.commit()
+    return changed
+
+
+def _refresh_locked(app, blocking):
+    # One refresh at a time per host; the lock file's mtime records the last one
+    path = app.config['RANKINGS_LOCK_PATH']
+    try:
+        with file_lock(path, blocking):
+            if not blocking and time.time() - os.path.getmtime(path) < REFRESH_SECONDS:
+                return
+            with app.app_context():
+                refresh()
+            os.utime(path)
+    except LockHeld:
+        return
+
+
+def maybe_refresh(app):
+    """Refresh if the last one on this host is older than ``REFRESH_SECONDS``; for the analytics flush thread."""
+    try:
+        if time.time() - os.path.getmtime(app.config['RANKINGS_LOCK_PATH']) < REFRESH_SECONDS:
+            return
+    except OSError:
+        pass
+    try:
+        _refresh_locked(app, blocking=False)
+    except Exception:
+        log.exception('Rankings refresh failed')
+
+
+def refresh_now():
+    """Refresh at once, waiting for a refresh already running on this host."""
+    _refresh_locked(current_app._get_current_object(), blocking=True)
+
+
+@job('rankings.refresh', max_attempts=1, every=REFRESH_SECONDS)
+def refresh_job():
+    refresh_now()
+
+
+def top_posts(kind, category=None):
+    """A materialized list, best first."""
+    return (
+        Post.query.options(*card_options())
+        .join(RankingEntry, RankingEntry.post_id == Post.id)
+        .filter(RankingEntry.kind == kind, RankingEntry.category == (category or ''))
+        .order_by(RankingEntry.rank)
+        .all()
+    )
+
+
+@click.command('rankings-refresh')
+@with_appcontext
+def refresh_command():
+    """Fold new reader activity into the trending and most-read lists."""
+    refresh_now()
+    click.echo(f'{RankingEntry.query.count()} ranking entries.')
+
+
+def init_app(app):
+    app.config.setdefault('RANKINGS_TOP_N', 10)
+    app.config.setdefault('RANKINGS_HALF_LIFE_HOURS', 24)
+    app.config.setdefault('RANKINGS_LOCK_PATH', os.path.join(app.instance_path, 'rankings.lock'))
+    app.cli.add_command(refresh_command)
@@ -0,0 +1,159 @@
+"""Token-bucket rate limits for the public form endpoints.
+
+``@rate_limit`` gives a view a bucket per client IP and, if asked for, one
+shared by everyone posting to that route. Each bucket is
+``(capacity, seconds)``: up to ``capacity`` requests at once, refilled at
+``capacity`` per ``seconds``. A request that finds a bucket empty gets a
+429 with Retry-After before the view touches the database. Signed-in users
+are not limited. ``RATE_LIMITS`` overrides the buckets per endpoint, e.g.
+``{'main.add_comment': {'ip': (3, 60), 'route': (120, 60)}}``.
+
+The route bucket is off by default: one client rotating addresses can
+drain it and lock every reader out of the form. The client address is
+``request.remote_addr``, so behind a proxy set ``PROXY_FIX_X_FOR`` to the
+number of proxies, or every reader shares the proxy's bucket.
+
+Backends:
+    ``memory`` - per-process dict, for a single worker.
+    ``sqlite`` - shared file under the instance folder, for multi-worker gunicorn.
+"""
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request
+from flask_login import current_user
+
+
+def _take(buckets, now, state):
+    """Refill and spend one token from every bucket, or none of them.
+
+    ``buckets`` is ``[(key, capacity, seconds)]``; ``state`` maps key to
+    ``(tokens, updated_at)``. Returns (allowed, new state, seconds to wait).
+    """
+    updated = {}
+    wait = 0.0
+    for key, capacity, seconds in buckets:
+        rate = capacity / seconds
+        tokens, updated_at = state.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) / rate)
+        updated[key] = (tokens - 1, now)
+    if wait:
+        return False, {}, wait
+    return True, updated, 0.0
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, buckets):
+        now = time.time()
+        with self._lock:
+            allowed, updated, wait = _take(buckets, now, self._buckets)
+            self._buckets.update(updated)
+            if len(self._buckets) > 100000:
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < 3600}
+        return allowed, wait
+
+
+class SQLiteBackend:
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._ready = False
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # Losing a few buckets in a crash is harmless
+            if not self._ready:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS rate_limit_bucket ('
+                    'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID'
+                )
+                self._ready = True
+            self._local.conn = conn
+        return conn
+
+    def take(self, buckets):
+        conn = self._conn()
+        keys = [key for key, _, _ in buckets]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            rows = conn.execute(
+                f'SELECT key, tokens, updated_at FROM rate_limit_bucket WHERE key IN ({", ".join("?" for _ in keys)})',
+                keys
+            ).fetchall()
+            allowed, updated, wait = _take(buckets, now, {key: (tokens, at) for key, tokens, at in rows})
+            conn.executemany(
+                'INSERT OR REPLACE INTO rate_limit_bucket (key, tokens, updated_at) VALUES (?, ?, ?)',
+                [(key, tokens, at) for key, (tokens, at) in updated.items()]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            # A bucket untouched for an hour has refilled; dropping it changes nothing
+            conn.execute('DELETE FROM rate_limit_bucket WHERE updated_at < ?', (now - 3600,))
+        return allowed, wait
+
+
+def _backend():
+    return current_app.extensions.get('rate_limit')
+
+
+def rate_limit(ip=(10, 60), route=None):
+    """Limit a view per client IP and, with ``route``, across all clients."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            backend = _backend()
+            if backend is None or request.method in ('GET', 'HEAD') or current_user.is_authenticated:
+                return view(*args, **kwargs)
+            limits = dict({'ip': ip, 'route': route}, **current_app.config['RATE_LIMITS'].get(request.endpoint, {}))
+            buckets = []
+            if limits['ip']:
+                buckets.append((f'{request.endpoint}|{request.remote_addr}', *limits['ip']))
+            if limits['route']:
+                buckets.append((request.endpoint, *limits['route']))
+            if not buckets:
+                return view(*args, **kwargs)
+            allowed, wait = backend.take(buckets)
+            if not allowed:
+                retry_after = max(1, int(wait + 0.999))
+                return 'Too many requests. Please try again shortly.', 429, {'Retry-After': str(retry_after)}
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    app.config.setdefault('RATE_LIMIT_BACKEND', os.getenv('RATE_LIMIT_BACKEND', 'sqlite'))
+    app.config.setdefault('RATE_LIMIT_PATH', os.path.join(app.instance_path, 'rate_limit.db'))
+    app.config.setdefault('RATE_LIMITS', {})
+
+    kind = app.config['RATE_LIMIT_BACKEND']
+    if kind == 'memory':
+        backend = MemoryBackend()
+    elif kind == 'sqlite':
+        backend = SQLiteBackend(app.config['RATE_LIMIT_PATH'])
+    elif not kind:
+        backend = None
+    else:
+        raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {kind!r}')
+    app.extensions['rate_limit'] = backend
@@ -0,0 +1,491 @@
+"""Related reading for post pages.
+
+Each post gets a TF-IDF vector built from its title (counted
+``TITLE_WEIGHT`` times), category and body text. A rebuild scores each post
+against every other by cosine similarity and keeps the ``RELATED_TOP_K``
+best matches in ``related_post``, so ``post_detail`` needs only one indexed
+lookup. Similarities are computed a block of rows at a time. The block size
+follows ``RELATED_MEMORY_MB``, so the full n x n matrix never exists, even
+on a corpus of tens of thousands of posts.
+
+The vectors, the vocabulary and the neighbour lists are also saved to
+``RELATED_MODEL_PATH``. When a post is created, edited, approved or
+deleted, its vector is scored against that saved matrix with one sparse
+product, and only the neighbour lists it enters or leaves are rewritten.
+Words first seen after the last rebuild don't count until the next rebuild.
+Rebuilds come from ``flask related-rebuild``, from a daily job on the queue,
+and from any update that finds a tenth of the posts are newer than the last
+rebuild. Cached pages that a rebuild changes are left to expire.
+
+NumPy and SciPy are optional. Without them posts have no related reading.
+"""
+import html
+import importlib.util
+import itertools
+import logging
+import os
+import re
+import string
+import threading
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, or_, select
+
+from app import db
+from jobs import job, enqueue, after_commit, queue_enabled
+from locks import file_lock
+from models import Post, RelatedPost
+from rendering import card_options
+from response_cache import invalidate
+
+log = logging.getLogger(__name__)
+
+NUMPY_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ('numpy', 'scipy'))
+
+TITLE_WEIGHT = 3
+MIN_DF = 2  # A word in only one post can't link it to another
+MAX_DF = 0.5  # Words in most posts say nothing about any of them
+MAX_TERMS = 100000
+TERMS_PER_POST = 48
+REBUILD_GROWTH = 0.1  # Rebuild once this fraction of posts came after the last rebuild
+READ_BATCH = 2000
+WRITE_BATCH = 5000
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_PUNCTUATION = str.maketrans({c: ' ' for c in string.punctuation})
+STOP_WORDS = frozenset(
+    'about after all also an and any are as at be been but by can could did do does for from had has have he her '
+    'his how if in into is it its just more most my no not of on one only or other our out over she so some such '
+    'than that the their them then there these they this to up was we were what when which who will with would you'
+    .split()
+)
+
+
+def _libs():
+    import numpy
+    from scipy import sparse
+    return numpy, sparse
+
+
+def _words(text):
+    # str.split is several times faster than a regex over long bodies
+    return (text or '').lower().translate(_PUNCTUATION).split()
+
+
+def term_counts(post):
+    """Term frequencies of a post or post row (anything with title, content and category)."""
+    counts = Counter(_words(html.unescape(_TAG_RE.sub(' ', post.content or ''))))
+    for word in _words(post.title):
+        counts[word] += TITLE_WEIGHT
+    # Filtering distinct terms is cheaper than filtering every word
+    for term in STOP_WORDS.intersection(counts):
+        del counts[term]
+    if post.category:
+        counts[f'category:{post.category.lower()}'] = 1
+    return counts
+
+
+def _post_rows(post_id=None):
+    query = select(Post.id, Post.title, Post.content, Post.category)
+    if post_id is not None:
+        return db.session.execute(query.where(Post.id == post_id)).first()
+    return db.session.execute(query.order_by(Post.id).execution_options(yield_per=READ_BATCH))
+
+
+def _weigh(np, sparse, counts, idf):
+    """Sublinear term frequency times idf over each row's strongest terms, scaled to unit length."""
+    matrix = counts.tocsr().astype(np.float32)
+    matrix.sum_duplicates()
+    matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+    # Dropping each post's weakest terms barely moves its neighbours but keeps the products sparse
+    lengths = np.diff(matrix.indptr)
+    if lengths.max(initial=0) > TERMS_PER_POST:
+        rows = np.repeat(np.arange(matrix.shape[0]), lengths)
+        # Weights are below 1 + log(tf) times the largest idf, so one float key sorts by row, then weight
+        order = np.argsort(rows * (float(matrix.data.max()) + 1) - matrix.data)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order)) - np.repeat(matrix.indptr[:-1], lengths)
+        keep = rank < TERMS_PER_POST
+        matrix = sparse.csr_matrix((matrix.data[keep], (rows[keep], matrix.indices[keep])), shape=matrix.shape)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ matrix).tocsr().astype(np.float32)
+
+
+def _top_k(np, block, k, min_score):
+    """Best ``k`` columns of each row of a dense score block, padded with -1."""
+    rows, columns = block.shape
+    neighbours = np.full((rows, k), -1, dtype=np.int32)
+    scores = np.zeros((rows, k), dtype=np.float32)
+    n = min(k, columns)
+    if n == 0:
+        return neighbours, scores
+    index = np.argpartition(-block, n - 1, axis=1)[:, :n]
+    top = np.take_along_axis(block, index, axis=1)
+    order = np.argsort(-top, axis=1, kind='stable')
+    index = np.take_along_axis(index, order, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    keep = top >= min_score
+    neighbours[:, :n] = np.where(keep, index, -1)
+    scores[:, :n] = np.where(keep, top, 0)
+    return neighbours, scores
+
+
+def _top_k_sparse(np, block, start, k, min_score):
+    """Like ``_top_k`` for a CSR block of rows ``start:``, looking only at its stored entries."""
+    # Most stored entries are weak matches; drop them before anything else touches the block
+    kept = np.flatnonzero(block.data >= min_score)
+    rows = np.searchsorted(block.indptr, kept, side='right') - 1
+    columns, values = block.indices[kept], block.data[kept]
+    not_self = columns != rows + start
+    rows, columns, values = rows[not_self], columns[not_self], values[not_self]
+    order = np.lexsort((-values, rows))
+    rows, columns, values = rows[order], columns[order], values[order]
+    counts = np.bincount(rows, minlength=block.shape[0])
+    rank = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    top = rank < k
+    neighbours = np.full((block.shape[0], k), -1, dtype=np.int32)
+    scores = np.zeros((block.shape[0], k), dtype=np.float32)
+    neighbours[rows[top], rank[top]] = columns[top]
+    scores[rows[top], rank[top]] = values[top]
+    return neighbours, scores
+
+
+class Model:
+    """TF-IDF vectors and neighbour lists, one row per post in ``ids`` (-1 marks a deleted post)."""
+
+    def __init__(self, ids, matrix, terms, idf, neighbours, scores, built_size=None):
+        self.np, self.sparse = _libs()
+        self.ids = ids
+        self.built_size = len(ids) if built_size is None else built_size
+        self.matrix = matrix
+        self.terms = terms
+        self.idf = idf
+        self.neighbours = neighbours
+        self.scores = scores
+        self.vocabulary = {term: i for i, term in enumerate(terms.tolist())}
+        self.rows = {post_id: row for row, post_id in enumerate(ids.tolist()) if post_id >= 0}
+
+    @property
+    def k(self):
+        return self.neighbours.shape[1]
+
+    def stale(self, post_id):
+        """Whether adding this post leaves too many posts the vocabulary and idf never saw, as on a new site."""
+        added = len(self.ids) + (post_id not in self.rows) - self.built_size
+        return added > REBUILD_GROWTH * self.built_size
+
+    @classmethod
+    def build(cls, k, min_score, memory_mb):
+        np, sparse = _libs()
+        ids, indptr, indices, data = array('i'), array('q', [0]), array('i'), array('f')
+        # Numbers terms in order of first appearance without a Python-level loop per term
+        vocabulary = defaultdict(itertools.count().__next__)
+        for row in _post_rows():
+            ids.append(row.id)
+            counts = term_counts(row)
+            indices.extend(map(vocabulary.__getitem__, counts))
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        ids = np.frombuffer(ids, dtype=np.int32).copy()
+        indices = np.frombuffer(indices, dtype=np.int32)
+        n = len(ids)
+
+        # Keep the informative terms and renumber them
+        df = np.bincount(indices, minlength=len(vocabulary))
+        keep = np.nonzero((df >= MIN_DF) & (df <= max(MIN_DF, MAX_DF * n)))[0]
+        if len(keep) > MAX_TERMS:
+            keep = np.sort(keep[np.argsort(-df[keep], kind='stable')[:MAX_TERMS]])
+        renumber = np.full(len(vocabulary), -1, dtype=np.int32)
+        renumber[keep] = np.arange(len(keep), dtype=np.int32)
+        columns = renumber[indices]
+        del indices
+        kept = columns >= 0
+        kept_before = np.concatenate(([0], np.cumsum(kept)))
+        counts = sparse.csr_matrix(
+            (np.frombuffer(data, dtype=np.float32)[kept], columns[kept], kept_before[np.frombuffer(indptr, dtype=np.int64)]),
+            shape=(n, len(keep))
+        )
+        del columns, kept, kept_before, data
+        all_terms = list(vocabulary)
+        terms = np.array([all_terms[i] for i in keep], dtype=str)
+        idf = (np.log((1 + n) / (1 + df[keep])) + 1).astype(np.float32)
+        # Weighing sorts every posting; a few thousand rows at a time keeps that small
+        matrix = sparse.vstack([_weigh(np, sparse, counts[i:i + READ_BATCH], idf) for i in range(0, n, READ_BATCH)], format='csr')
+
+        neighbours = np.full((n, k), -1, dtype=np.int32)
+        scores = np.zeros((n, k), dtype=np.float32)
+        # Worst case every pair in a block shares a term: values, columns and sort keys, ~32 bytes each
+        block_rows = max(1, memory_mb * 1024 * 1024 // max(1, 32 * n))
+        transposed = matrix.T.tocsr()
+        for start in range(0, n, block_rows):
+            stop = min(n, start + block_rows)
+            neighbours[start:stop], scores[start:stop] = _top_k_sparse(np, matrix[start:stop] @ transposed, start, k, min_score)
+        return cls(ids, matrix, terms, idf, neighbours, scores)
+
+    @classmethod
+    def load(cls, path):
+        np, sparse = _libs()
+        with np.load(path) as f:
+            matrix = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls(f['ids'], matrix, f['terms'], f['idf'], f['neighbours'], f['scores'], int(f['built_size']))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp.npz'
+        self.np.savez(
+            tmp, ids=self.ids, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+            shape=self.np.array(self.matrix.shape), terms=self.terms, idf=self.idf,
+            neighbours=self.neighbours, scores=self.scores, built_size=self.built_size,
+        )
+        os.replace(tmp, path)
+
+    def vector(self, term_counts):
+        np = self.np
+        counts = {self.vocabulary[t]: c for t, c in term_counts.items() if t in self.vocabulary}
+        columns = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        row = self.sparse.csr_matrix((values, (np.zeros(len(counts), dtype=np.int32), columns)), shape=(1, len(self.terms)))
+        return _weigh(np, self.sparse, row, self.idf)
+
+    def set_row(self, post_id, vector):
+        """Store a post's vector; returns its row."""
+        np, sparse = self.np, self.sparse
+        row = self.rows.get(post_id)
+        if row is None:
+            row = len(self.ids)
+            self.matrix = sparse.vstack([self.matrix, vector], format='csr')
+            self.ids = np.append(self.ids, np.int32(post_id))
+            self.neighbours = np.vstack([self.neighbours, np.full((1, self.k), -1, dtype=np.int32)])
+            self.scores = np.vstack([self.scores, np.zeros((1, self.k), dtype=np.float32)])
+            self.rows[post_id] = row
+        else:
+            self.matrix = sparse.vstack([self.matrix[:row], vector, self.matrix[row + 1:]], format='csr')
+        return row
+
+    def _similar(self, row, min_score):
+        scores = (self.matrix @ self.matrix[row].T).toarray().ravel()
+        scores[row] = -1
+        neighbours, top = _top_k(self.np, scores[None, :], self.k, min_score)
+        self.neighbours[row], self.scores[row] = neighbours[0], top[0]
+        return scores
+
+    def rescore(self, row, min_score):
+        """Refresh a changed row's neighbours and every list it enters or leaves; returns the rows changed."""
+        np = self.np
+        scores = self._similar(row, min_score)
+        changed = {row}
+        holders = np.nonzero((self.neighbours == row).any(axis=1))[0]
+        candidates = set(holders.tolist()) | set(np.nonzero(scores >= min_score)[0].tolist())
+        candidates.discard(row)
+        for other in candidates:
+            listed = self.neighbours[other] == row
+            if listed.any() and scores[other] < self.scores[other][listed][0]:
+                # It fell in this list, so something outside the list may now outrank it
+                self._similar(other, min_score)
+                changed.add(other)
+                continue
+            entries = [(n, s) for n, s in zip(self.neighbours[other].tolist(), self.scores[other].tolist()) if n >= 0 and n != row]
+            if scores[other] >= min_score:
+                entries.append((row, float(scores[other])))
+            entries.sort(key=lambda entry: -entry[1])
+            entries = entries[:self.k]
+            before = self.neighbours[other].copy()
+            self.neighbours[other] = -1
+            self.scores[other] = 0
+            for i, (n, s) in enumerate(entries):
+                self.neighbours[other, i] = n
+                self.scores[other, i] = s
+            if not np.array_equal(before, self.neighbours[other]):
+                changed.add(other)
+        return changed
+
+    def related_rows(self, rows):
+        for row in rows:
+            post_id = int(self.ids[row])
+            if post_id < 0:
+                continue
+            for rank, (n, score) in enumerate(zip(self.neighbours[row].tolist(), self.scores[row].tolist())):
+                if n >= 0:
+                    yield {'post_id': post_id, 'rank': rank, 'related_id': int(self.ids[n]), 'score': score}
+
+
+def _store(model, rows=None, removed=()):
+    """Write neighbour lists to ``related_post``; ``rows=None`` replaces the whole table."""
+    if rows is None:
+        db.session.execute(delete(RelatedPost))
+        rows = range(len(model.ids))
+    else:
+        post_ids = [int(model.ids[row]) for row in rows if model.ids[row] >= 0] + list(removed)
+        db.session.execute(delete(RelatedPost).where(RelatedPost.post_id.in_(post_ids)))
+    batch = []
+    for entry in model.related_rows(rows):
+        batch.append(entry)
+        if len(batch) >= WRITE_BATCH:
+            db.session.execute(insert(RelatedPost.__table__), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(RelatedPost.__table__), batch)
+    db.session.commit()
+
+
+@contextmanager
+def _locked(path):
+    # One writer at a time across workers; the model file is read-modify-write
+    with file_lock(f'{path}.lock'):
+        yield
+
+
+def _settings():
+    config = current_app.config
+    return config['RELATED_MODEL_PATH'], config['RELATED_TOP_K'], config['RELATED_MIN_SCORE']
+
+
+def _rebuild(path, k, min_score):
+    model = Model.build(k, min_score, current_app.config['RELATED_MEMORY_MB'])
+    _store(model)
+    model.save(path)
+    return model
+
+
+def rebuild():
+    """Recompute every post's neighbours; returns the number of posts."""
+    path, k, min_score = _settings()
+    with _locked(path):
+        return len(_rebuild(path, k, min_score).ids)
+
+
+def update(post_id):
+    """Bring the neighbours in step with one created, edited or deleted post."""
+    path, k, min_score = _settings()
+    with _locked(path):
+        model = Model.load(path) if os.path.exists(path) else None
+        if model is None or model.stale(post_id):
+            _rebuild(path, k, min_score)
+            invalidate(f'post:{post_id}')
+            return
+        row = _post_rows(post_id)
+        if row is None and post_id not in model.rows:
+            return
+        vector = model.vector(term_counts(row) if row is not None else {})
+        changed = model.rescore(model.set_row(post_id, vector), min_score)
+        removed = ()
+        if row is None:
+            model.ids[model.rows.pop(post_id)] = -1
+            removed = (post_id,)
+        _store(model, changed, removed)
+        model.save(path)
+    invalidate(*(f'post:{int(model.ids[r])}' for r in changed if model.ids[r] >= 0))
+
+
+@job('related.update', max_attempts=3)
+def update_job(post_id):
+    update(post_id)
+
+
+@job('related.rebuild', timeout=3600, max_attempts=2, every=24 * 3600)
+def rebuild_job():
+    rebuild()
+
+
+class Updater:
+    """Applies post changes to the model on one background thread per process."""
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(1, thread_name_prefix='related-posts')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _update(self, post_id):
+        try:
+            with self.app.app_context():
+                update(post_id)
+        except Exception:
+            log.exception('Related posts update for post %s failed', post_id)
+
+    def _rebuild(self):
+        try:
+            with self.app.app_context():
+                rebuild()
+        except Exception:
+            log.exception('Related posts rebuild failed')
+
+    def submit(self, post_id):
+        self._get_executor().submit(self._update, post_id)
+
+    def submit_rebuild(self):
+        self._get_executor().submit(self._rebuild)
+
+
+def schedule_update(post_id):
+    """Refresh related posts for a changed post once the current transaction commits.
+
+    With the job queue on, the job commits with the caller's transaction.
+    """
+    if not NUMPY_AVAILABLE:
+        return
+    if queue_enabled():
+        enqueue(update_job.job_name, {'post_id': post_id})
+    else:
+        updater = current_app.extensions['related_posts']
+        after_commit(lambda: updater.submit(post_id))
+
+
+def schedule_rebuild():
+    """Rebuild related posts once the current transaction commits, e.g. after a bulk import.
+
+    With the job queue on, the job commits with the caller's transaction.
+    """
+    if not NUMPY_AVAILABLE:
+        return
+    if queue_enabled():
+        enqueue(rebuild_job.job_name)
+    else:
+        after_commit(current_app.extensions['related_posts'].submit_rebuild)
+
+
+def remove_post(post_id):
+    """Drop a post's neighbour rows; runs inside the caller's transaction."""
+    db.session.execute(delete(RelatedPost).where(or_(RelatedPost.post_id == post_id, RelatedPost.related_id == post_id)))
+
+
+def related_posts(post_id):
+    return (
+        Post.query.options(*card_options())
+        .join(RelatedPost, RelatedPost.related_id == Post.id)
+        .filter(RelatedPost.post_id == post_id)
+        .order_by(RelatedPost.rank)
+        .all()
+    )
+
+
+@click.command('related-rebuild')
+@with_appcontext
+def rebuild_command():
+    """Recompute related posts for every post."""
+    if not NUMPY_AVAILABLE:
+        raise click.ClickException('Related posts need numpy and scipy installed.')
+    click.echo(f'Computed related posts for {rebuild()} posts.')
+
+
+def init_app(app):
+    app.config.setdefault('RELATED_MODEL_PATH', os.path.join(app.instance_path, 'related.npz'))
+    app.config.setdefault('RELATED_TOP_K', 5)
+    app.config.setdefault('RELATED_MIN_SCORE', 0.05)
+    app.config.setdefault('RELATED_MEMORY_MB', 256)
+    app.extensions['related_posts'] = Updater(app)
+    app.cli.add_command(rebuild_command)
@@ -0,0 +1,254 @@
+"""Write-time rendering of post bodies.
+
+``render_post`` turns a post's stored ``content`` into everything the read
+paths need, once, when the post is saved: sanitized HTML with heading
+anchors and lazy-loading images (``content_html``), a plain-text
+``excerpt``, ``word_count``, ``reading_minutes`` and a table of contents
+(``toc``, JSON; ``post.toc|toc_entries`` in templates). Views and templates
+read those columns and leave ``content`` in the database.
+
+``render_version`` records which renderer produced a row. Bump
+``RENDER_VERSION`` whenever the output changes. ``flask content-render``
+then re-renders older rows in batches, and ``flask bootstrap`` runs it as
+well.
+"""
+import json
+import math
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import or_, update
+
+from app import db
+from models import Post
+from slugs import slugify
+
+RENDER_VERSION = 2  # 2: <embed> and <svg/> no longer truncate the body
+RENDER_BATCH_SIZE = 500
+EXCERPT_CHARS = 200
+WORDS_PER_MINUTE = 200
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'cite', 'code', 'del', 'div', 'em', 'figcaption', 'figure',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'li', 'mark', 'ol', 'p', 'pre', 's', 'small',
+    'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'ol': {'start'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan', 'scope'},
+}
+NUMERIC_ATTRIBUTES = {'width', 'height', 'start', 'colspan', 'rowspan'}
+URL_ATTRIBUTES = {'href', 'src'}
+SAFE_SCHEMES = {'', 'http', 'https', 'mailto'}
+VOID_TAGS = {'br', 'hr', 'img'}
+# Dropped together with everything inside them. Void elements such as <embed> have no
+# content and no end tag; they go the way of any other unknown tag
+DROPPED_TAGS = {'script', 'style', 'iframe', 'object', 'noscript', 'template', 'svg', 'math', 'head', 'title'}
+# Tags that separate words in the plain text
+BLOCK_TAGS = {
+    'blockquote', 'br', 'caption', 'div', 'figcaption', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li',
+    'p', 'pre', 'td', 'th', 'tr',
+}
+TOC_TAGS = {'h2': 2, 'h3': 3}
+# Opening one of these ends an unclosed <p>, as browsers do
+CLOSES_P = {
+    'blockquote', 'div', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'ol', 'p', 'pre', 'table', 'ul',
+}
+
+_CONTROL_RE = re.compile(r'[\x00-\x20\x7f]+')
+
+
+def _safe_url(value):
+    value = value.strip()
+    # Browsers ignore whitespace and control characters inside a scheme ("java\nscript:")
+    scheme = urlsplit(_CONTROL_RE.sub('', value)).scheme.lower()
+    return value if scheme in SAFE_SCHEMES else None
+
+
+class _Renderer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.toc = []
+        self._open = []
+        self._dropped = 0
+        self._heading = None
+        self._anchors = set()
+
+    def _attributes(self, tag, attrs):
+        allowed = ALLOWED_ATTRIBUTES.get(tag, ())
+        cleaned = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES:
+                value = _safe_url(value)
+            elif name in NUMERIC_ATTRIBUTES and not value.strip().isdigit():
+                value = None
+            if value is not None:
+                cleaned.append((name, value.strip()))
+        if tag == 'img':
+            cleaned += [('loading', 'lazy'), ('decoding', 'async')]
+        return ''.join(f' {name}="{escape(value)}"' for name, value in cleaned)
+
+    def handle_starttag(self, tag, attrs):
+        if self._dropped or tag in DROPPED_TAGS:
+            if tag in DROPPED_TAGS:
+                self._dropped += 1
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag not in ALLOWED_TAGS:
+            return  # Unknown wrappers go, their text stays
+        if tag == 'img' and not any(name == 'src' and value and _safe_url(value) for name, value in attrs):
+            return
+        if tag in CLOSES_P and 'p' in self._open:
+            # Only inline tags can be open inside a <p>, so this never closes a block early
+            self.handle_endtag('p')
+        if tag == 'li':
+            containers = [t for t in self._open if t in ('ul', 'ol', 'li')]
+            if containers and containers[-1] == 'li':
+                self.handle_endtag('li')
+        if tag in TOC_TAGS and self._heading is None:
+            # The anchor depends on the heading text, so the tag is filled in at the end tag
+            self._heading = (tag, len(self.html), [])
+            self.html.append(None)
+        else:
+            self.html.append(f'<{tag}{self._attributes(tag, attrs)}>')
+        if tag not in VOID_TAGS:
+            self._open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            return  # <svg/> has nothing inside it and no end tag to wait for
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and not self._dropped and tag in ALLOWED_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self._dropped:
+            if tag in DROPPED_TAGS:
+                self._dropped -= 1
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag not in self._open:
+            return
+        # Close anything left open inside this tag so the output stays well-formed
+        while self._open:
+            current = self._open.pop()
+            self._close(current)
+            if current == tag:
+                break
+
+    def _close(self, tag):
+        if self._heading is not None and self._heading[0] == tag:
+            _, index, parts = self._heading
+            title = ' '.join(''.join(parts).split())
+            self._heading = None
+            if not title:
+                self.html[index] = f'<{tag}>'
+            else:
+                anchor = base = slugify(title) or 'section'
+                n = 2
+                while anchor in self._anchors:
+                    anchor = f'{base}-{n}'
+                    n += 1
+                self._anchors.add(anchor)
+                self.html[index] = f'<{tag} id="{anchor}">'
+                self.toc.append({'level': TOC_TAGS[tag], 'id': anchor, 'title': title})
+        self.html.append(f'</{tag}>')
+
+    def handle_data(self, data):
+        if self._dropped:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+        if self._heading is not None:
+            self._heading[2].append(data)
+
+    def close(self):
+        super().close()
+        while self._open:
+            self._close(self._open.pop())
+
+
+def excerpt(text, limit=EXCERPT_CHARS):
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(' ', 0, limit)
+    return text[:cut if cut > 0 else limit].rstrip(' ,;:.-') + '…'
+
+
+def render(content):
+    """Everything the read paths show for a post body, as column values."""
+    renderer = _Renderer()
+    renderer.feed(content or '')
+    renderer.close()
+    text = ' '.join(''.join(renderer.text).split())
+    words = len(text.split())
+    return {
+        'content_html': ''.join(renderer.html),
+        'excerpt': excerpt(text),
+        'word_count': words,
+        'reading_minutes': max(1, math.ceil(words / WORDS_PER_MINUTE)),
+        'toc': json.dumps(renderer.toc) if renderer.toc else None,
+        'render_version': RENDER_VERSION,
+    }
+
+
+def render_post(post):
+    """Fill in a post's rendered columns from its content; runs inside the caller's transaction."""
+    for name, value in render(post.content).items():
+        setattr(post, name, value)
+
+
+def card_options():
+    """Loader options for post lists: cards show the excerpt, not the body."""
+    return [db.defer(Post.content), db.defer(Post.content_html), db.defer(Post.toc)]
+
+
+def toc_entries(toc):
+    return json.loads(toc) if toc else []
+
+
+def render_stale(everything=False, batch_size=RENDER_BATCH_SIZE):
+    """Re-render posts from an older renderer (or all of them); returns the number rendered."""
+    stale = or_(Post.render_version.is_(None), Post.render_version < RENDER_VERSION)
+    total = 0
+    last_id = 0
+    while True:
+        query = db.session.query(Post.id, Post.content).filter(Post.id > last_id)
+        if not everything:
+            query = query.filter(stale)
+        rows = query.order_by(Post.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(update(Post), [dict(render(content), id=post_id) for post_id, content in rows])
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1].id
+    return total
+
+
+@click.command('content-render')
+@click.option('--all', 'everything', is_flag=True, help='Re-render every post, not just those from an older renderer.')
+@click.option('--batch-size', default=RENDER_BATCH_SIZE, show_default=True)
+@with_appcontext
+def render_command(everything, batch_size):
+    """Render post bodies into their precomputed columns."""
+    click.echo(f'Rendered {render_stale(everything, batch_size)} posts.')
+
+
+def init_app(app):
+    app.add_template_filter(toc_entries)
+    app.cli.add_command(render_command)
@@ -0,0 +1,313 @@
+"""Response cache for public pages served to anonymous readers.
+
+Views decorated with ``cached_page`` are stored per path, query string
+and global data version, and replayed with a strong ETag and Last-Modified, so browsers and
+proxies can revalidate with a 304. Every entry carries tags (``global``
+plus whatever the view adds with ``cache_tag``); write routes call
+``invalidate`` with the tags they affect after committing.
+
+Backends:
+    ``memory`` - per-process LRU with TTL, for a single worker.
+    ``sqlite`` - shared file under the instance folder, for multi-worker gunicorn.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, g, request, session, make_response
+from flask_login import current_user
+
+from jobs import job
+
+GLOBAL_TAG = 'global'
+
+CachedResponse = namedtuple('CachedResponse', 'body status content_type etag last_modified expires_at')
+
+
+class MemoryBackend:
+    def __init__(self, ttl=300, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generation = 0
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, tags = item
+            if entry.expires_at < time.time():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, tags, generation):
+        with self._lock:
+            # Something was invalidated while this page rendered; it may be stale
+            if generation != self._generation:
+                return
+            self._drop(key)
+            self._entries[key] = (entry, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            self._generation += 1
+            if GLOBAL_TAG in tags:
+                self._entries.clear()
+                self._tags.clear()
+                return
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+
+    def _drop(self, key):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        for tag in item[1]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class SQLiteBackend:
+    PRUNE_EVERY = 200
+
+    def __init__(self, path, ttl=300, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._ready = False
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if not self._ready:
+                self._setup(conn)
+                self._ready = True
+            self._local.conn = conn
+        return conn
+
+    def _setup(self, conn):
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                status INTEGER NOT NULL,
+                content_type TEXT,
+                etag TEXT NOT NULL,
+                last_modified REAL NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS response_cache_tag (
+                tag TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (tag, key)
+            );
+            CREATE INDEX IF NOT EXISTS ix_response_cache_tag_key ON response_cache_tag (key);
+            CREATE TABLE IF NOT EXISTS response_cache_meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO response_cache_meta (id, generation) VALUES (1, 0);
+        """)
+
+    def generation(self):
+        return self._conn().execute('SELECT generation FROM response_cache_meta WHERE id = 1').fetchone()[0]
+
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT body, status, content_type, etag, last_modified, expires_at FROM response_cache WHERE key = ?',
+            (key,)
+        ).fetchone()
+        if row is None or row[5] < time.time():
+            return None
+        return CachedResponse(*row)
+
+    def set(self, key, entry, tags, generation):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = conn.execute('SELECT generation FROM response_cache_meta WHERE id = 1').fetchone()[0]
+            if current != generation:
+                conn.execute('ROLLBACK')
+                return
+            conn.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?, ?)', (key, *entry))
+            conn.execute('DELETE FROM response_cache_tag WHERE key = ?', (key,))
+            conn.executemany('INSERT INTO response_cache_tag (tag, key) VALUES (?, ?)', [(t, key) for t in tags])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def invalidate(self, tags):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('UPDATE response_cache_meta SET generation = generation + 1 WHERE id = 1')
+            if GLOBAL_TAG in tags:
+                conn.execute('DELETE FROM response_cache')
+                conn.execute('DELETE FROM response_cache_tag')
+            else:
+                placeholders = ', '.join('?' for _ in tags)
+                conn.execute('CREATE TEMP TABLE IF NOT EXISTS invalidated_keys (key TEXT PRIMARY KEY)')
+                conn.execute('DELETE FROM invalidated_keys')
+                conn.execute(
+                    f'INSERT OR IGNORE INTO invalidated_keys SELECT key FROM response_cache_tag WHERE tag IN ({placeholders})',
+                    tuple(tags)
+                )
+                conn.execute('DELETE FROM response_cache WHERE key IN (SELECT key FROM invalidated_keys)')
+                conn.execute('DELETE FROM response_cache_tag WHERE key IN (SELECT key FROM invalidated_keys)')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def prune(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM response_cache WHERE expires_at < ?', (time.time(),))
+            conn.execute(
+                'DELETE FROM response_cache WHERE key IN ('
+                'SELECT key FROM response_cache ORDER BY last_modified DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            conn.execute('DELETE FROM response_cache_tag WHERE key NOT IN (SELECT key FROM response_cache)')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+def _backend():
+    return current_app.extensions.get('response_cache')
+
+
+def _cacheable_request():
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # Admins see edit controls, and pending flash messages are per-visitor
+    if current_user.is_authenticated or '_flashes' in session:
+        return False
+    return True
+
+
+def _cache_key():
+    # Pages render nav and category data from this worker's global data cache,
+    # which can trail a change by GLOBAL_DATA_CHECK_SECONDS. Keying on its
+    # version keeps a lagging worker's pages away from the up-to-date ones.
+    # Cached pages only emit relative URLs, so the host is not part of the key.
+    args = urlencode(sorted(request.args.items(multi=True)))
+    global_data = current_app.extensions.get('global_data_cache')
+    version = global_data.current_version() if global_data is not None else 0
+    return f'{request.path}?{args}#{version}'
+
+
+def _finish(response, entry):
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    response.headers['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+
+def cache_tag(*tags):
+    """Attach extra invalidation tags to the page being rendered."""
+    if 'response_cache_tags' in g:
+        g.response_cache_tags.update(tags)
+
+
+def invalidate(*tags):
+    backend = _backend()
+    if backend is not None and tags:
+        backend.invalidate(set(tags))
+
+
+@job('response_cache.warm', max_attempts=2)
+def warm(paths):
+    """Render pages once as an anonymous reader so the next visitor gets a hit."""
+    client = current_app.test_client()
+    for path in paths:
+        client.get(path).close()
+
+
+def cached_page(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        backend = _backend()
+        if backend is None or not _cacheable_request():
+            return view(*args, **kwargs)
+
+        key = _cache_key()
+        entry = backend.get(key)
+        if entry is not None:
+            response = current_app.response_class(entry.body, status=entry.status, content_type=entry.content_type)
+            return _finish(response, entry)
+
+        generation = backend.generation()
+        g.response_cache_tags = {GLOBAL_TAG}
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.direct_passthrough or session.modified:
+            return response
+
+        body = response.get_data()
+        now = time.time()
+        entry = CachedResponse(
+            body=body,
+            status=response.status_code,
+            content_type=response.content_type,
+            etag=hashlib.sha256(body).hexdigest()[:32],
+            last_modified=int(now),
+            expires_at=now + backend.ttl,
+        )
+        backend.set(key, entry, g.response_cache_tags, generation)
+        return _finish(response, entry)
+    return wrapper
+
+
+def init_app(app):
+    app.config.setdefault('RESPONSE_CACHE_BACKEND', os.getenv('RESPONSE_CACHE_BACKEND', 'sqlite'))
+    app.config.setdefault('RESPONSE_CACHE_TTL', 300)
+    app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', 5000)
+    app.config.setdefault('RESPONSE_CACHE_PATH', os.path.join(app.instance_path, 'response_cache.db'))
+
+    kind = app.config['RESPONSE_CACHE_BACKEND']
+    ttl = app.config['RESPONSE_CACHE_TTL']
+    max_entries = app.config['RESPONSE_CACHE_MAX_ENTRIES']
+    if kind == 'memory':
+        backend = MemoryBackend(ttl=ttl, max_entries=max_entries)
+    elif kind == 'sqlite':
+        backend = SQLiteBackend(app.config['RESPONSE_CACHE_PATH'], ttl=ttl, max_entries=max_entries)
+    elif not kind:
+        backend = None
+    else:
+        raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND: {kind!r}')
+    app.extensions['response_cache'] = backend
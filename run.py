@@ -1,9 +1,11 @@
 import os
-from app import create_app
+from app import create_app, bootstrap
 
 app = create_app()
 
 if __name__ == '__main__':
+    # Production servers import `app` only; run `flask bootstrap` as a deploy step there
+    bootstrap(app)
     debug = os.getenv('FLASK_DEBUG', '0') == '1'
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', '5000'))
@@ -0,0 +1,258 @@
+"""Full-text search for posts.
+
+On SQLite the index is an FTS5 virtual table (``post_search``) whose rowid is
+the post id, ranked with BM25. Other database backends fall back to a bounded
+LIKE scan so ``/search`` keeps working, just without ranking.
+"""
+import html
+import re
+
+import click
+from flask.cli import with_appcontext
+from markupsafe import escape, Markup
+from sqlalchemy import text
+
+from app import db
+from models import Post
+from rendering import card_options
+
+SEARCH_TABLE = 'post_search'
+
+# Relative BM25 weights for title, content, category, contributor_name
+COLUMN_WEIGHTS = (10.0, 1.0, 2.0, 2.0)
+SNIPPET_TOKENS = 24
+
+# Private-use markers survive escaping and are swapped for <mark> tags afterwards
+_MARK_OPEN = '\ue000'
+_MARK_CLOSE = '\ue001'
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_TAG_RE = re.compile(r'<[^>]+>')
+REBUILD_BATCH_SIZE = 1000
+
+_fts_available = {}
+
+
+class SearchHit:
+    def __init__(self, post, title_html, snippet_html):
+        self.post = post
+        self.title_html = title_html
+        self.snippet_html = snippet_html
+
+
+class SearchResults:
+    def __init__(self, query, hits, page, per_page, has_next):
+        self.query = query
+        self.hits = hits
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+
+    @property
+    def posts(self):
+        return [hit.post for hit in self.hits]
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+
+def fts_enabled():
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    key = str(engine.url)
+    if key not in _fts_available:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(x)'))
+                conn.execute(text('DROP TABLE temp.fts5_probe'))
+            _fts_available[key] = True
+        except Exception:
+            _fts_available[key] = False
+    return _fts_available[key]
+
+
+def ensure_index():
+    """Create the FTS table if missing, filling it from existing posts."""
+    if not fts_enabled():
+        return
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': SEARCH_TABLE}
+    ).first()
+    if exists:
+        return
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        "title, content, category, contributor_name, "
+        "tokenize = 'porter unicode61', prefix = '2 3')"
+    ))
+    rebuild_index()
+
+
+_INSERT_SQL = (
+    f"INSERT INTO {SEARCH_TABLE} (rowid, title, content, category, contributor_name) "
+    "VALUES (:id, :title, :content, :category, :contributor_name)"
+)
+
+
+def _plain_text(content):
+    # Post bodies come from a rich text editor; index the words, not the markup
+    return html.unescape(_TAG_RE.sub(' ', content or ''))
+
+
+def _index_row(post):
+    return {
+        'id': post.id,
+        'title': post.title or '',
+        'content': _plain_text(post.content),
+        'category': post.category or '',
+        'contributor_name': post.contributor_name or '',
+    }
+
+
+def rebuild_index():
+    """Repopulate the whole index from the post table in batched inserts."""
+    if not fts_enabled():
+        return 0
+    db.session.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+    columns = db.select(Post.id, Post.title, Post.content, Post.category, Post.contributor_name)
+    total = 0
+    batch = []
+    for row in db.session.execute(columns.execution_options(yield_per=REBUILD_BATCH_SIZE)):
+        batch.append(_index_row(row))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            db.session.execute(text(_INSERT_SQL), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(text(_INSERT_SQL), batch)
+        total += len(batch)
+    db.session.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    return total
+
+
+def index_post(post):
+    """Add or refresh a post in the index; runs inside the caller's transaction."""
+    if not fts_enabled():
+        return
+    remove_post(post.id)
+    db.session.execute(text(_INSERT_SQL), _index_row(post))
+
+
+def remove_post(post_id):
+    if not fts_enabled():
+        return
+    db.session.execute(text(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = :id'), {'id': post_id})
+
+
+def _terms(query):
+    return _TOKEN_RE.findall(query.lower())
+
+
+def _match_expression(terms):
+    # Every term must match; each one is also a prefix so partial words hit while typing
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def _marked_html(value):
+    html = str(escape(value or ''))
+    return Markup(html.replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>'))
+
+
+def search_posts(query, page=1, per_page=10):
+    page = max(page, 1)
+    terms = _terms(query or '')
+    if not terms:
+        return SearchResults(query, [], page, per_page, False)
+
+    offset = (page - 1) * per_page
+    if fts_enabled():
+        rows = db.session.execute(
+            text(
+                f"SELECT rowid, "
+                f"highlight({SEARCH_TABLE}, 0, :open, :close) AS title_html, "
+                f"snippet({SEARCH_TABLE}, 1, :open, :close, '…', {SNIPPET_TOKENS}) AS snippet_html "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match "
+                f"ORDER BY bm25({SEARCH_TABLE}, {', '.join(str(w) for w in COLUMN_WEIGHTS)}) "
+                "LIMIT :limit OFFSET :offset"
+            ),
+            {
+                'open': _MARK_OPEN,
+                'close': _MARK_CLOSE,
+                'match': _match_expression(terms),
+                'limit': per_page + 1,
+                'offset': offset,
+            }
+        ).all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        posts = {p.id: p for p in Post.query.options(*card_options()).filter(Post.id.in_([r.rowid for r in rows])).all()}
+        hits = [
+            SearchHit(posts[r.rowid], _marked_html(r.title_html), _marked_html(r.snippet_html))
+            for r in rows if r.rowid in posts
+        ]
+        return SearchResults(query, hits, page, per_page, has_next)
+
+    # Fallback for backends without FTS5: bounded LIKE scan, newest first
+    filters = []
+    for term in terms:
+        pattern = f'%{term}%'
+        filters.append(db.or_(
+            Post.title.ilike(pattern),
+            Post.content.ilike(pattern),
+            Post.category.ilike(pattern),
+            Post.contributor_name.ilike(pattern),
+        ))
+    posts = (Post.query.filter(*filters)
+             .order_by(Post.created_at.desc())
+             .offset(offset).limit(per_page + 1).all())
+    has_next = len(posts) > per_page
+    hits = [
+        SearchHit(p, _marked_html(_highlight(p.title, terms)), _marked_html(_snippet(_plain_text(p.content), terms)))
+        for p in posts[:per_page]
+    ]
+    return SearchResults(query, hits, page, per_page, has_next)
+
+
+def _highlight(value, terms):
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(t) for t in terms) + r')\w*', re.IGNORECASE)
+    return pattern.sub(lambda m: f'{_MARK_OPEN}{m.group(0)}{_MARK_CLOSE}', value or '')
+
+
+def _snippet(content, terms, width=160):
+    content = content or ''
+    lowered = content.lower()
+    positions = [lowered.find(t) for t in terms if lowered.find(t) >= 0]
+    start = max(min(positions) - width // 4, 0) if positions else 0
+    excerpt = content[start:start + width]
+    if start > 0:
+        excerpt = '…' + excerpt
+    if start + width < len(content):
+        excerpt += '…'
+    return _highlight(excerpt, terms)
+
+
+@click.command('search-rebuild')
+@with_appcontext
+def rebuild_command():
+    """Rebuild the full-text search index from all posts."""
+    if not fts_enabled():
+        click.echo('FTS5 is not available on this database; search uses the LIKE fallback.')
+        return
+    ensure_index()
+    count = rebuild_index()
+    click.echo(f'Indexed {count} posts.')
+
+
+def init_app(app):
+    app.cli.add_command(rebuild_command)
@@ -1,8 +1,9 @@
-from app import create_app, db
+from app import create_app, bootstrap, db
 from models import User
 from werkzeug.security import generate_password_hash
 
 app = create_app()
+bootstrap(app)
 
 with app.app_context():
     # Check if admin exists
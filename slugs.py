@@ -0,0 +1,142 @@
+"""URL slugs for posts.
+
+A free slug is found with one range query over the unique slug index for
+``base`` and ``base-N``, then claimed by flushing inside a savepoint; if a
+concurrent publish took it first, the unique constraint fails and the slug is
+allocated again. ``backfill_slugs`` fills in every missing slug in one
+transaction with the taken set held in memory.
+"""
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Post
+
+MAX_ATTEMPTS = 5
+
+
+def slugify(s):
+    s = str(s).lower().strip()
+    s = re.sub(r'[^\w\s-]', '', s)
+    s = re.sub(r'[\s_-]+', '-', s)
+    s = re.sub(r'^-+|-+$', '', s)
+    return s
+
+
+def base_slug(title):
+    return slugify(title) or 'post'
+
+
+def suffix(slug, base):
+    """The N of ``base-N`` (0 for ``base`` itself), or None if slug is not in base's family."""
+    if slug == base:
+        return 0
+    tail = slug[len(base) + 1:] if slug.startswith(base + '-') else ''
+    return int(tail) if tail.isdigit() else None
+
+
+def family_filter(base):
+    # Index range scan: '.' is the character right after '-', so this covers exactly 'base-*'
+    return or_(Post.slug == base, and_(Post.slug > base + '-', Post.slug < base + '.'))
+
+
+def next_slug(base, taken):
+    suffixes = {suffix(slug, base) for slug in taken}
+    suffixes.discard(None)
+    if 0 not in suffixes:
+        return base
+    return f'{base}-{max(suffixes) + 1}'
+
+
+def allocate_slug(title, exclude_id=None):
+    base = base_slug(title)
+    query = db.session.query(Post.slug).filter(family_filter(base))
+    if exclude_id is not None:
+        query = query.filter(Post.id != exclude_id)
+    # The post being saved may still be half-built; don't flush it for this lookup
+    with db.session.no_autoflush:
+        return next_slug(base, [slug for (slug,) in query])
+
+
+def _begin_outer():
+    # pysqlite opens its transaction only before DML, so after plain SELECTs a
+    # SAVEPOINT would become the outermost transaction and its RELEASE would commit
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN')
+
+
+def flush_with_slug(post, title):
+    """Give ``post`` a free slug for ``title`` and flush it, retrying on unique-constraint races."""
+    base = base_slug(title)
+    if post.slug and suffix(post.slug, base) is not None:
+        # Title still maps to the current slug; keep the URL stable
+        db.session.add(post)
+        db.session.flush()
+        return post.slug
+
+    _begin_outer()
+    for attempt in range(MAX_ATTEMPTS):
+        slug = allocate_slug(title, exclude_id=post.id)
+        try:
+            with db.session.begin_nested():
+                post.slug = slug
+                db.session.add(post)
+            return slug
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+
+
+class SlugAllocator:
+    """Hands out unique slugs for many posts at once from an in-memory set of taken slugs."""
+
+    def __init__(self, taken=None):
+        if taken is None:
+            taken = {slug for (slug,) in db.session.query(Post.slug).filter(Post.slug.isnot(None), Post.slug != '')}
+        self.taken = set(taken)
+        self._next_suffix = {}
+
+    def allocate(self, title):
+        base = base_slug(title)
+        slug = base
+        if slug in self.taken:
+            n = self._next_suffix.get(base, 1)
+            while f'{base}-{n}' in self.taken:
+                n += 1
+            slug = f'{base}-{n}'
+            self._next_suffix[base] = n + 1
+        self.taken.add(slug)
+        return slug
+
+
+def backfill_slugs():
+    """Assign slugs to every post without one, in a single transaction; returns how many."""
+    allocator = SlugAllocator()
+    missing = (
+        db.session.query(Post.id, Post.title)
+        .filter(or_(Post.slug.is_(None), Post.slug == ''))
+        .order_by(Post.id)
+        .all()
+    )
+    updates = [{'id': post_id, 'slug': allocator.allocate(title)} for post_id, title in missing]
+
+    if updates:
+        db.session.execute(update(Post), updates)
+    db.session.commit()
+    return len(updates)
+
+
+@click.command('slugs-backfill')
+@with_appcontext
+def backfill_command():
+    """Give every post that has no slug a unique one."""
+    click.echo(f'Backfilled {backfill_slugs()} slugs.')
+
+
+def init_app(app):
+    app.cli.add_command(backfill_command)
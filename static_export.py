@@ -0,0 +1,208 @@
+"""Static export of the public pages.
+
+Renders the home feed, category feeds, post pages, About and Services as an
+anonymous visitor into ``STATIC_EXPORT_DIR``, laid out so a web server can
+answer most reads without touching Flask:
+
+    /                        index.html
+    /?category=C             category/C/index.html
+    /post/<slug>             post/<slug>/index.html
+    /about, /services        about/index.html, services/index.html
+
+Only the first page of each feed is exported. The feed templates link
+onwards with opaque ``?cursor=`` URLs, which always fall through to the
+app, as does anything else. For example, with nginx::
+
+    map $args $static_feed { "" /index.html; default ""; }
+    location = / { try_files $static_feed @app; }
+    location / { try_files $uri/index.html @app; }
+
+With ``STATIC_EXPORT_ENABLED`` on, changing a post re-renders its page, the
+home feed and its category feeds. A new comment re-renders its post page.
+Changing the social links or the categories re-renders every page, since
+they all show the navigation, and deleting a category removes its feed.
+The work goes on the job queue when it is enabled, and otherwise to a
+background thread. ``flask static-export`` rebuilds everything across a
+process pool.
+"""
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, urlsplit
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app import db
+from jobs import job, enqueue, after_commit, queue_enabled
+from models import Category, Post
+
+log = logging.getLogger(__name__)
+
+FEED_PER_PAGE = 6  # Posts per feed page, for main.index
+CHUNK_SIZE = 200
+
+
+def output_path(root, path):
+    """Where the page for a site path (with query string) lives in the export tree."""
+    parts = urlsplit(path)
+    query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+    segments = [s for s in parts.path.split('/') if s]
+    if 'category' in query:
+        segments += ['category', quote(query['category'], safe='')]
+    return os.path.join(root, *segments, 'index.html')
+
+
+def feed_paths(category=None):
+    """The exported page of a feed; later pages are reached by cursor and served by the app."""
+    return [f'/?category={quote(category)}' if category else '/']
+
+
+def remove_feed(category):
+    """Delete a category's exported feed so requests for it fall through to the app."""
+    if not current_app.config['STATIC_EXPORT_ENABLED']:
+        return
+    root = current_app.config['STATIC_EXPORT_DIR']
+    shutil.rmtree(os.path.dirname(output_path(root, feed_paths(category)[0])), ignore_errors=True)
+
+
+def post_paths(slug=None, categories=(), old_slug=None):
+    """Pages that show a post: its own page, the home feed and its category feeds."""
+    paths = feed_paths()
+    for category in {c for c in categories if c}:
+        paths += feed_paths(category)
+    for s in (slug, old_slug):
+        if s:
+            paths.append(f'/post/{s}')
+    return paths
+
+
+def all_paths():
+    paths = feed_paths() + ['/about', '/services']
+    for (name,) in db.session.query(Category.name).order_by(Category.name):
+        paths += feed_paths(name)
+    paths += [f'/post/{slug}' for (slug,) in db.session.query(Post.slug).order_by(Post.id)]
+    return paths
+
+
+def render_pages(client, root, paths):
+    """Render paths with a test client into the tree; returns (written, removed)."""
+    written = removed = 0
+    for path in paths:
+        target = output_path(root, path)
+        response = client.get(path)
+        try:
+            if response.status_code == 200:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(response.get_data())
+                os.replace(tmp, target)
+                written += 1
+            elif response.status_code == 404 and os.path.exists(target):
+                os.unlink(target)
+                removed += 1
+        finally:
+            response.close()
+    return written, removed
+
+
+@job('static_export.render', timeout=900)
+def render_job(paths):
+    app = current_app._get_current_object()
+    render_pages(app.test_client(), app.config['STATIC_EXPORT_DIR'], paths)
+
+
+class Exporter:
+    """Renders changed pages on one background thread per process."""
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(1, thread_name_prefix='static-export')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _render(self, paths):
+        try:
+            with self.app.app_context():
+                render_pages(self.app.test_client(), self.app.config['STATIC_EXPORT_DIR'], paths)
+        except Exception:
+            log.exception('Static export of %d pages failed', len(paths))
+
+    def submit(self, paths):
+        self._get_executor().submit(self._render, paths)
+
+
+def schedule_pages(paths):
+    """Re-render these pages once the current transaction commits; a no-op unless the export is enabled.
+
+    With the job queue on, the job commits with the caller's transaction.
+    """
+    if not current_app.config['STATIC_EXPORT_ENABLED'] or not paths:
+        return
+    paths = list(dict.fromkeys(paths))
+    if queue_enabled():
+        enqueue(render_job.job_name, {'paths': paths})
+    else:
+        exporter = current_app.extensions['static_export']
+        after_commit(lambda: exporter.submit(paths))
+
+
+_worker_client = None
+
+
+def _init_worker():
+    global _worker_client
+    # Each process gets its own app and connections; skip the shared response cache
+    os.environ['RESPONSE_CACHE_BACKEND'] = ''
+    from app import create_app
+    _worker_client = create_app().test_client()
+
+
+def _render_chunk(root, paths):
+    return render_pages(_worker_client, root, paths)
+
+
+def rebuild_all(root, workers=None):
+    """Render every exportable page across a process pool; returns (written, removed)."""
+    paths = all_paths()
+    chunks = [paths[i:i + CHUNK_SIZE] for i in range(0, len(paths), CHUNK_SIZE)]
+    # Children open their own connections; don't hand them copies of ours
+    for engine in db.engines.values():
+        engine.dispose()
+    written = removed = 0
+    with ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker) as executor:
+        for w, r in executor.map(_render_chunk, [root] * len(chunks), chunks):
+            written += w
+            removed += r
+    return written, removed
+
+
+@click.command('static-export')
+@click.option('--workers', type=int, help='Render processes (default: one per CPU).')
+@click.option('--clean', is_flag=True, help='Delete the export directory first.')
+@with_appcontext
+def export_command(workers, clean):
+    """Render every public page into STATIC_EXPORT_DIR."""
+    root = current_app.config['STATIC_EXPORT_DIR']
+    if clean and os.path.isdir(root):
+        shutil.rmtree(root)
+    written, removed = rebuild_all(root, workers)
+    click.echo(f'Wrote {written} pages to {root}' + (f', removed {removed}' if removed else '') + '.')
+
+
+def init_app(app):
+    app.config.setdefault('STATIC_EXPORT_ENABLED', os.getenv('STATIC_EXPORT_ENABLED', '0') == '1')
+    app.config.setdefault('STATIC_EXPORT_DIR', os.getenv('STATIC_EXPORT_DIR', os.path.join(app.instance_path, 'static_site')))
+    app.extensions['static_export'] = Exporter(app)
+    app.cli.add_command(export_command)
@@ -0,0 +1,225 @@
+"""Content-addressed upload storage.
+
+Uploads are streamed to a temporary file in fixed-size chunks while being
+hashed, then linked to ``static/uploads/<hh>/<sha256>.<ext>``. A file that is
+already stored under that hash is not written again, so re-uploads and
+duplicate attachments cost one hash pass and no disk space. Files a request
+wrote are deleted again if it is rejected part-way (``save_uploads``,
+``discard``), unless a saved row has come to use them meanwhile.
+
+The stored MIME type comes from the file's leading bytes: the extension's
+type is used only when the content carries that format's signature.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+from collections import namedtuple
+
+from flask import abort, current_app, request
+from sqlalchemy import select, union_all
+
+from app import db
+from models import Attachment, Post, Submission
+
+CHUNK_SIZE = 64 * 1024
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+DOCUMENT_EXTENSIONS = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt'}
+ARCHIVE_EXTENSIONS = {'zip', 'rar', 'exe', 'msi'}
+ALLOWED_EXTENSIONS = IMAGE_EXTENSIONS | DOCUMENT_EXTENSIONS | ARCHIVE_EXTENSIONS
+
+# Leading bytes of each format and the extensions that may carry it
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', {'png'}),
+    (b'\xff\xd8\xff', {'jpg', 'jpeg'}),
+    (b'GIF87a', {'gif'}),
+    (b'GIF89a', {'gif'}),
+    (b'%PDF-', {'pdf'}),
+    (b'PK\x03\x04', {'zip', 'docx', 'xlsx', 'pptx'}),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', {'doc', 'xls', 'ppt', 'msi'}),
+    (b'Rar!\x1a\x07', {'rar'}),
+    (b'MZ', {'exe'}),
+)
+
+DEFAULT_SIZE_LIMITS = {
+    'image': 10 * 1024 * 1024,
+    'document': 25 * 1024 * 1024,
+    'archive': 100 * 1024 * 1024,
+}
+
+# ``created``: this upload wrote the file, rather than finding it already stored
+StoredFile = namedtuple('StoredFile', 'url content_hash size mime_type filename created')
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, filename, limit):
+        super().__init__(f'{filename} is larger than {limit // (1024 * 1024)} MB')
+        self.filename = filename
+        self.limit = limit
+
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def allowed_file(filename):
+    return file_extension(filename) in ALLOWED_EXTENSIONS
+
+
+def file_type(filename):
+    ext = file_extension(filename)
+    if ext in IMAGE_EXTENSIONS:
+        return 'image'
+    if ext in DOCUMENT_EXTENSIONS:
+        return 'document'
+    return 'archive'
+
+
+def sniff_mime_type(head, filename):
+    """The extension's MIME type if ``head`` starts like that format, else ``application/octet-stream``."""
+    ext = file_extension(filename)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        matches = {'webp'}
+    elif ext == 'txt' and b'\x00' not in head:
+        matches = {'txt'}
+    else:
+        matches = next((exts for magic, exts in SIGNATURES if head.startswith(magic)), set())
+    if ext in matches:
+        return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return 'application/octet-stream'
+
+
+def size_limit(filename):
+    limits = current_app.config['UPLOAD_SIZE_LIMITS']
+    return limits[file_type(filename)]
+
+
+def enforce_request_limit(max_bytes=None):
+    """Cap this request's body at ``max_bytes``; call before touching ``request.form`` or ``request.files``.
+
+    A declared Content-Length over the cap is refused at once. Werkzeug
+    enforces the cap while reading the body, so a chunked request without
+    a length cannot get past it either.
+    """
+    max_bytes = max_bytes or current_app.config['MAX_CONTENT_LENGTH']
+    if request.content_length is not None and request.content_length > max_bytes:
+        abort(413)
+    request.max_content_length = max_bytes
+
+
+def upload_root(app=None):
+    app = app or current_app
+    return app.config['UPLOAD_FOLDER']
+
+
+def save_upload(file):
+    """Store an uploaded file by content hash; returns a StoredFile, or None if nothing usable was sent."""
+    if not file or not file.filename or not allowed_file(file.filename):
+        return None
+
+    limit = size_limit(file.filename)
+    root = upload_root()
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if not size:
+                    head = chunk
+                size += len(chunk)
+                if size > limit:
+                    raise UploadTooLarge(file.filename, limit)
+                digest.update(chunk)
+                out.write(chunk)
+
+        content_hash = digest.hexdigest()
+        ext = file_extension(file.filename)
+        relative = f'{content_hash[:2]}/{content_hash}.{ext}'
+        target = os.path.join(root, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # The link either creates the complete file or finds it already there;
+        # checking first would let two uploads of new content both claim it
+        try:
+            os.link(tmp_path, target)
+            created = True
+        except FileExistsError:
+            created = False
+    finally:
+        os.unlink(tmp_path)
+
+    mime_type = sniff_mime_type(head, file.filename)
+    return StoredFile(
+        url=f'uploads/{relative}',
+        content_hash=content_hash,
+        size=size,
+        mime_type=mime_type,
+        filename=file.filename,
+        created=created,
+    )
+
+
+def save_uploads(files):
+    """``save_upload`` each file; if one is rejected, delete what this call wrote and re-raise."""
+    stored = []
+    try:
+        for file in files:
+            stored.append(save_upload(file))
+    except BaseException:
+        discard(stored)
+        raise
+    return stored
+
+
+def referenced_hashes(hashes):
+    """The hashes among ``hashes`` that a committed post, submission or attachment uses."""
+    if not hashes:
+        return set()
+    query = union_all(
+        select(Post.image_hash).where(Post.image_hash.in_(hashes)),
+        select(Submission.image_hash).where(Submission.image_hash.in_(hashes)),
+        select(Attachment.content_hash).where(Attachment.content_hash.in_(hashes)),
+    )
+    # A connection of its own sees rows other requests committed after this one began
+    with db.engine.connect() as connection:
+        return set(connection.scalars(query))
+
+
+def discard(stored_files):
+    """Delete files these uploads wrote, for a request that will not use them.
+
+    Another request may have stored the same content after this one wrote it;
+    files a committed row now points at are kept.
+    """
+    root = upload_root()
+    created = [stored for stored in stored_files if stored and stored.created]
+    keep = referenced_hashes({stored.content_hash for stored in created})
+    for stored in created:
+        if stored.content_hash not in keep:
+            try:
+                os.unlink(os.path.join(root, stored.url.split('/', 1)[1]))
+            except FileNotFoundError:
+                pass
+
+
+def set_image(target, stored):
+    """Point a Post or Submission at a stored image."""
+    target.image_url = stored.url
+    target.image_hash = stored.content_hash
+    target.image_size = stored.size
+    target.image_mime = stored.mime_type
+
+
+def init_app(app):
+    # Must be the static folder's ``uploads`` directory; files are served from /static/uploads
+    app.config.setdefault('UPLOAD_FOLDER', os.path.join(app.static_folder, 'uploads'))
+    app.config.setdefault('UPLOAD_SIZE_LIMITS', dict(DEFAULT_SIZE_LIMITS))
+    # Werkzeug refuses anything larger while reading the body
+    if app.config.get('MAX_CONTENT_LENGTH') is None:
+        app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
@@ -0,0 +1,331 @@
+"""Atom/RSS feeds and sitemaps.
+
+    /feed.atom, /feed.rss                       newest posts site-wide
+    /category/<name>/feed.atom, .../feed.rss    newest posts in a category
+    /sitemap.xml                                sitemap index
+    /sitemap-pages.xml                          home, About, Services, category pages
+    /sitemap-posts-<n>.xml                      posts with ids n*SITEMAP_SHARD_SIZE and up
+
+Each document is generated on its first request into ``SYNDICATION_DIR``,
+written with a streaming XML writer so a shard of any size keeps memory
+flat. Later requests send the file with an ETag and Last-Modified taken
+from it, so pollers revalidate into 304s. Write routes call
+``invalidate_documents`` after committing. It deletes only the documents
+that show the changed posts: the site feeds, their category feeds, the
+sitemap index and pages, and each post's shard. Those regenerate on their
+next request.
+
+Links are absolute, so a cached file must not take its host from the
+request that happened to regenerate it. Documents are cached only when
+``SITE_URL`` or Flask's ``TRUSTED_HOSTS`` is set. Without either, every
+request builds its own copy into a temporary file, which is fine for
+development but slow for production.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import timezone
+from email.utils import format_datetime
+from urllib.parse import quote
+from xml.sax.saxutils import XMLGenerator
+
+from flask import Blueprint, abort, current_app, send_file, url_for
+from sqlalchemy import func, select
+
+from app import db
+from db_profile import read_only
+from locks import file_lock
+from models import Category, Post, User
+
+syndication = Blueprint('syndication', __name__)
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+CONTENT_NS = 'http://purl.org/rss/1.0/modules/content/'
+FEED_FORMATS = {'atom': 'application/atom+xml', 'rss': 'application/rss+xml'}
+STREAM_BATCH = 1000
+
+
+def _path(name):
+    return os.path.join(current_app.config['SYNDICATION_DIR'], quote(name, safe='') + '.xml')
+
+
+@contextmanager
+def _locked():
+    # Generation and invalidation exclude each other, so a document rendered
+    # from data that a write has since replaced never outlives that write's invalidation
+    with file_lock(os.path.join(current_app.config['SYNDICATION_DIR'], '.lock')):
+        yield
+
+
+def _open(name, build):
+    path = _path(name)
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    with _locked():
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.tmp'
+            try:
+                with open(tmp, 'wb') as out:
+                    _write(out, build)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+        return open(path, 'rb')
+
+
+def _write(out, build):
+    xml = XMLGenerator(out, encoding='utf-8', short_empty_elements=True)
+    xml.startDocument()
+    build(xml)
+    xml.endDocument()
+
+
+def _cacheable():
+    return bool(current_app.config['SITE_URL'] or current_app.config.get('TRUSTED_HOSTS'))
+
+
+def _serve(name, mimetype, build):
+    if not _cacheable():
+        file = tempfile.TemporaryFile()
+        _write(file, build)
+        file.seek(0)
+        return send_file(file, mimetype=mimetype, max_age=0)
+    file = _open(name, build)
+    stat = os.fstat(file.fileno())
+    response = send_file(
+        file, mimetype=mimetype, conditional=True, max_age=0,
+        etag=f'{stat.st_mtime_ns:x}-{stat.st_size:x}', last_modified=stat.st_mtime,
+    )
+    response.cache_control.must_revalidate = True
+    return response
+
+
+def invalidate_documents(post_ids=(), categories=(), everything=False):
+    """Delete the cached documents that list these posts. Call after committing."""
+    root = current_app.config['SYNDICATION_DIR']
+    if not os.path.isdir(root):
+        return
+    shard_size = current_app.config['SITEMAP_SHARD_SIZE']
+    with _locked():
+        if everything:
+            paths = [os.path.join(root, name) for name in os.listdir(root) if name.endswith('.xml')]
+        else:
+            names = ['sitemap', 'sitemap-pages', *FEED_FORMATS]
+            names += [f'{kind}:{category}' for category in set(categories) if category for kind in FEED_FORMATS]
+            names += [f'sitemap-posts-{shard}' for shard in {post_id // shard_size for post_id in post_ids}]
+            paths = [_path(name) for name in names]
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def _site_url(endpoint, **values):
+    base = current_app.config['SITE_URL']
+    if not base:
+        return url_for(endpoint, _external=True, **values)
+    return base.rstrip('/') + url_for(endpoint, **values)
+
+
+def _post_url_prefix():
+    # url_for per row is the slowest part of a large shard; every post URL shares this prefix
+    return _site_url('main.post_detail', slug='x')[:-1]
+
+
+def _iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _leaf(xml, name, text=None, attrs=None):
+    xml.startElement(name, attrs or {})
+    if text:
+        xml.characters(text)
+    xml.endElement(name)
+
+
+def _updated():
+    return func.coalesce(Post.updated_at, Post.created_at)
+
+
+def _latest(category):
+    query = (
+        select(Post.slug, Post.title, Post.excerpt, Post.content_html, Post.category, Post.created_at,
+               _updated().label('updated_at'), func.coalesce(Post.contributor_name, User.username).label('author'))
+        .join(User, User.id == Post.author_id)
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(current_app.config['SYNDICATION_ITEMS'])
+    )
+    if category:
+        query = query.where(Post.category == category)
+    return db.session.execute(query).all()
+
+
+def _atom(category):
+    def build(xml):
+        posts = _latest(category)
+        page = _site_url('main.index', category=category) if category else _site_url('main.index')
+        self_url = _site_url('syndication.category_feed', name=category, kind='atom') if category else _site_url('syndication.site_feed', kind='atom')
+        xml.startElement('feed', {'xmlns': ATOM_NS})
+        _leaf(xml, 'title', current_app.config['SITE_NAME'] + (f' - {category}' if category else ''))
+        _leaf(xml, 'id', self_url)
+        _leaf(xml, 'link', attrs={'rel': 'self', 'href': self_url})
+        _leaf(xml, 'link', attrs={'rel': 'alternate', 'href': page})
+        if posts:
+            _leaf(xml, 'updated', _iso(max(post.updated_at for post in posts)))
+        prefix = _post_url_prefix()
+        for post in posts:
+            url = prefix + quote(post.slug)
+            xml.startElement('entry', {})
+            _leaf(xml, 'title', post.title)
+            _leaf(xml, 'id', url)
+            _leaf(xml, 'link', attrs={'rel': 'alternate', 'href': url})
+            _leaf(xml, 'published', _iso(post.created_at))
+            _leaf(xml, 'updated', _iso(post.updated_at))
+            xml.startElement('author', {})
+            _leaf(xml, 'name', post.author)
+            xml.endElement('author')
+            if post.category:
+                _leaf(xml, 'category', attrs={'term': post.category})
+            _leaf(xml, 'summary', post.excerpt)
+            _leaf(xml, 'content', post.content_html, {'type': 'html'})
+            xml.endElement('entry')
+        xml.endElement('feed')
+    return build
+
+
+def _rfc822(dt):
+    return format_datetime(dt.replace(tzinfo=timezone.utc))
+
+
+def _rss(category):
+    def build(xml):
+        posts = _latest(category)
+        page = _site_url('main.index', category=category) if category else _site_url('main.index')
+        xml.startElement('rss', {'version': '2.0', 'xmlns:content': CONTENT_NS})
+        xml.startElement('channel', {})
+        _leaf(xml, 'title', current_app.config['SITE_NAME'] + (f' - {category}' if category else ''))
+        _leaf(xml, 'link', page)
+        _leaf(xml, 'description', f'Latest {category} articles' if category else 'Latest articles')
+        if posts:
+            _leaf(xml, 'lastBuildDate', _rfc822(max(post.updated_at for post in posts)))
+        prefix = _post_url_prefix()
+        for post in posts:
+            url = prefix + quote(post.slug)
+            xml.startElement('item', {})
+            _leaf(xml, 'title', post.title)
+            _leaf(xml, 'link', url)
+            _leaf(xml, 'guid', url, {'isPermaLink': 'true'})
+            _leaf(xml, 'pubDate', _rfc822(post.created_at))
+            if post.category:
+                _leaf(xml, 'category', post.category)
+            _leaf(xml, 'description', post.excerpt)
+            _leaf(xml, 'content:encoded', post.content_html)
+            xml.endElement('item')
+        xml.endElement('channel')
+        xml.endElement('rss')
+    return build
+
+
+def _url(xml, loc, lastmod=None):
+    xml.startElement('url', {})
+    _leaf(xml, 'loc', loc)
+    if lastmod:
+        _leaf(xml, 'lastmod', _iso(lastmod))
+    xml.endElement('url')
+
+
+def _sitemap_index(xml):
+    shard_size = current_app.config['SITEMAP_SHARD_SIZE']
+    shard = (Post.id // shard_size).label('shard')
+    xml.startElement('sitemapindex', {'xmlns': SITEMAP_NS})
+    for loc, lastmod in [(_site_url('syndication.sitemap_pages'), None)] + [
+        (_site_url('syndication.sitemap_posts', shard=number), lastmod)
+        for number, lastmod in db.session.execute(select(shard, func.max(_updated())).group_by(shard).order_by(shard))
+    ]:
+        xml.startElement('sitemap', {})
+        _leaf(xml, 'loc', loc)
+        if lastmod:
+            _leaf(xml, 'lastmod', _iso(lastmod))
+        xml.endElement('sitemap')
+    xml.endElement('sitemapindex')
+
+
+def _sitemap_pages(xml):
+    newest = dict(db.session.execute(select(Post.category, func.max(_updated())).group_by(Post.category)).all())
+    xml.startElement('urlset', {'xmlns': SITEMAP_NS})
+    _url(xml, _site_url('main.index'), max(filter(None, newest.values()), default=None))
+    _url(xml, _site_url('main.about_us'))
+    _url(xml, _site_url('main.services'))
+    for (name,) in db.session.execute(select(Category.name).order_by(Category.name)):
+        _url(xml, _site_url('main.index', category=name), newest.get(name))
+    xml.endElement('urlset')
+
+
+def _sitemap_posts(number):
+    def build(xml):
+        shard_size = current_app.config['SITEMAP_SHARD_SIZE']
+        prefix = _post_url_prefix()
+        rows = db.session.execute(
+            select(Post.slug, _updated())
+            .where(Post.id >= number * shard_size, Post.id < (number + 1) * shard_size)
+            .order_by(Post.id)
+            .execution_options(yield_per=STREAM_BATCH)
+        )
+        xml.startElement('urlset', {'xmlns': SITEMAP_NS})
+        for slug, lastmod in rows:
+            _url(xml, prefix + quote(slug), lastmod)
+        xml.endElement('urlset')
+    return build
+
+
+@syndication.route('/feed.<any(atom, rss):kind>')
+@read_only
+def site_feed(kind):
+    return _serve(kind, FEED_FORMATS[kind], (_atom if kind == 'atom' else _rss)(None))
+
+
+@syndication.route('/category/<name>/feed.<any(atom, rss):kind>')
+@read_only
+def category_feed(name, kind):
+    # Only real categories get a cached file, so arbitrary names cannot fill the disk
+    known = (
+        db.session.query(Category.id).filter_by(name=name).first()
+        or db.session.query(Post.id).filter_by(category=name).first()
+    )
+    if not known:
+        abort(404)
+    return _serve(f'{kind}:{name}', FEED_FORMATS[kind], (_atom if kind == 'atom' else _rss)(name))
+
+
+@syndication.route('/sitemap.xml')
+@read_only
+def sitemap_index():
+    return _serve('sitemap', 'application/xml', _sitemap_index)
+
+
+@syndication.route('/sitemap-pages.xml')
+@read_only
+def sitemap_pages():
+    return _serve('sitemap-pages', 'application/xml', _sitemap_pages)
+
+
+@syndication.route('/sitemap-posts-<int:shard>.xml')
+@read_only
+def sitemap_posts(shard):
+    last_id = db.session.query(func.max(Post.id)).scalar() or 0
+    if shard > last_id // current_app.config['SITEMAP_SHARD_SIZE']:
+        abort(404)
+    return _serve(f'sitemap-posts-{shard}', 'application/xml', _sitemap_posts(shard))
+
+
+def init_app(app):
+    app.config.setdefault('SITE_NAME', os.getenv('SITE_NAME', 'Mind Economists'))
+    app.config.setdefault('SITE_URL', os.getenv('SITE_URL', ''))
+    app.config.setdefault('SYNDICATION_DIR', os.path.join(app.instance_path, 'syndication'))
+    app.config.setdefault('SYNDICATION_ITEMS', 20)
+    app.config.setdefault('SITEMAP_SHARD_SIZE', 10000)  # The sitemap protocol allows up to 50,000 URLs per file
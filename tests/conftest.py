@@ -0,0 +1,65 @@
+import pytest
+from jinja2 import FunctionLoader
+
+from app import bootstrap, create_app, db
+from models import User
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build apps over one database and instance folder, as several workers would be."""
+    apps = []
+
+    def make(**config):
+        app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "blog.db"}',
+            'RESPONSE_CACHE_BACKEND': '',
+            'RATE_LIMIT_BACKEND': '',
+            'WRITE_COALESCE_MS': 0,
+            'JOB_QUEUE_ENABLED': False,
+            'SITE_URL': 'https://example.org',
+            'UPLOAD_FOLDER': str(tmp_path / 'static' / 'uploads'),
+            **config,
+        }, instance_path=str(tmp_path / 'instance'))
+        app.static_folder = str(tmp_path / 'static')
+        # The repository ships without templates; every page renders as its template name
+        app.jinja_env.loader = FunctionLoader(lambda name: f'[{name}]')
+        bootstrap(app)
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin(app):
+    user = User(username='admin', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def admin_client(app, admin):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+    return client
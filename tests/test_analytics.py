@@ -0,0 +1,55 @@
+import pytest
+
+import analytics
+from analytics import MAX_SECONDS_PER_BEACON, get_buffer
+from app import db
+from models import Post, PostActivity
+
+
+@pytest.fixture
+def post(app, admin):
+    post = Post(title='T', slug='t', content='x', author_id=admin.id)
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def test_views_and_reading_time_are_flushed_in_one_batch(app, client, post):
+    for _ in range(3):
+        assert client.post('/beacon', json={'post_id': post.id}).status_code == 204
+    assert client.post('/beacon', json={'post_id': post.id, 'event': 'read', 'seconds': '5000'}).status_code == 204
+    get_buffer().flush()
+
+    db.session.rollback()
+    post = db.session.get(Post, post.id)
+    assert post.views == 3
+    assert post.total_seconds_read == MAX_SECONDS_PER_BEACON
+    assert db.session.query(PostActivity.views).filter_by(post_id=post.id).scalar() == 3
+
+
+@pytest.mark.parametrize('data', [
+    {'post_id': 'x'},
+    {'post_id': None},
+    {'post_id': 1, 'event': 'read', 'seconds': '1e999'},
+    {'post_id': 1, 'event': 'read', 'seconds': 'nan'},
+    {'post_id': 1, 'event': 'click'},
+])
+def test_malformed_beacons_are_400(app, client, post, data):
+    assert client.post('/beacon', json=data).status_code == 400
+
+
+def test_unknown_posts_never_take_a_buffer_slot(app, client, post, monkeypatch):
+    buffer = get_buffer()
+    buffer.max_posts = 1
+    for post_id in (0, -5, post.id + 1, 10 ** 12):
+        assert client.post('/beacon', json={'post_id': post_id}).status_code == 404
+    assert buffer._counts == {}
+    assert client.post('/beacon', json={'post_id': post.id}).status_code == 204
+    assert buffer.dropped == 0
+
+    # A post created since the last check is picked up once the check is due
+    newer = Post(title='N', slug='n', content='x', author_id=post.author_id)
+    db.session.add(newer)
+    db.session.commit()
+    monkeypatch.setattr(analytics, 'KNOWN_POSTS_CHECK_SECONDS', 0)
+    assert client.post('/beacon', json={'post_id': newer.id}).status_code == 204
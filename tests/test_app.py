@@ -0,0 +1,14 @@
+from app import bootstrap, db
+from models import Category
+
+
+def test_bootstrap_is_idempotent(app):
+    bootstrap(app)
+    names = [name for (name,) in db.session.query(Category.name).order_by(Category.name)]
+    assert names == ['Business', 'Tech', 'World']
+
+
+def test_config_overrides_apply_before_extensions(app, tmp_path):
+    assert app.config['RESPONSE_CACHE_BACKEND'] == ''
+    assert app.extensions['response_cache'] is None
+    assert app.config['RANKINGS_LOCK_PATH'].startswith(str(tmp_path))
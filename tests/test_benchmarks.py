@@ -0,0 +1,48 @@
+from benchmarks.run import SCENARIOS, compare, percentile, run_test_client
+from benchmarks.seed import seed
+from models import Comment, Post
+
+SMALL = {'posts': 30, 'comments': 120, 'subscribers': 40, 'orders': 20, 'submissions': 10}
+
+
+def test_every_scenario_runs_against_seeded_data(app):
+    scale = seed(SMALL)
+    assert scale == SMALL
+    results = run_test_client(app, SCENARIOS, iterations=3, warmup=1, scale=scale)
+    assert set(results) == {s.name for s in SCENARIOS}
+    assert {name: r['errors'] for name, r in results.items() if r['errors']} == {}
+    assert all(r['requests'] == 3 and r['queries'] >= 0 for r in results.values())
+
+
+def test_seed_is_deterministic(make_app, tmp_path):
+    runs = []
+    for name in ('a.db', 'b.db'):
+        app = make_app(SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / name}')
+        with app.app_context():
+            seed(SMALL)
+            runs.append([(c.post_id, c.parent_id, c.content) for c in Comment.query.order_by(Comment.id)]
+                        + [(p.title, p.category, p.content) for p in Post.query.order_by(Post.id)])
+    assert runs[0] == runs[1]
+    assert len(runs[0]) == SMALL['comments'] + SMALL['posts']
+
+
+def test_percentile_picks_nearest_rank():
+    samples = [0.5, 0.1, 0.4, 0.2, 0.3]
+    assert percentile(samples, 50) == 0.3
+    assert percentile(samples, 99) == 0.5
+    assert percentile([0.7], 95) == 0.7
+
+
+def test_compare_flags_slower_p95_more_queries_and_errors():
+    before = {'routes': {
+        'index': {'p95_ms': 10.0, 'queries': 3, 'errors': 0},
+        'search': {'p95_ms': 1.0, 'queries': 2, 'errors': 0},
+    }}
+    after = {'routes': {
+        'index': {'p95_ms': 14.0, 'queries': 4, 'errors': 1},
+        'search': {'p95_ms': 2.0, 'queries': 2, 'errors': 0},  # Twice as slow but under min_delta_ms
+        'new_route': {'p95_ms': 50.0, 'queries': 9, 'errors': 0},
+    }}
+    problems = compare(after, before, tolerance=0.25, min_delta_ms=2.0)
+    assert len(problems) == 3 and all(p.startswith('index:') for p in problems)
+    assert compare(after, before, tolerance=0.5, min_delta_ms=2.0) == [p for p in problems if 'p95' not in p]
@@ -0,0 +1,81 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from bulk_io import parse_datetime
+from models import Category, Job, Post
+from rankings import top_posts
+from search_index import search_posts
+
+
+@pytest.fixture
+def run_import(app, admin, tmp_path):
+    def run(records, *args):
+        source = tmp_path / 'posts.jsonl'
+        source.write_text('\n'.join(json.dumps(r) for r in records))
+        result = app.test_cli_runner().invoke(args=['import-posts', str(source), *args])
+        db.session.rollback()
+        return result
+    return run
+
+
+def test_parse_datetime_converts_offsets_to_utc():
+    assert parse_datetime('2026-01-01T12:00:00+02:00') == datetime(2026, 1, 1, 10, 0)
+    assert parse_datetime('2026-01-01T12:00:00Z') == datetime(2026, 1, 1, 12, 0)
+    assert parse_datetime('2026-01-01 12:00') == datetime(2026, 1, 1, 12, 0)
+    assert parse_datetime('') is None
+
+
+def test_import_posts(run_import):
+    result = run_import([
+        {'title': 'Hello', 'content': 'x', 'category': 'Zines', 'created_at': '2026-01-01T12:00:00-05:00'},
+        {'title': 'Hello', 'content': 'y', 'views': '7'},
+    ])
+    assert result.exit_code == 0, result.output
+    posts = Post.query.order_by(Post.id).all()
+    assert [p.slug for p in posts] == ['hello', 'hello-1']
+    assert posts[0].created_at == datetime(2026, 1, 1, 17, 0)
+    assert posts[1].views == 7 and posts[1].category == 'World'
+    assert Category.query.filter_by(name='Zines').count() == 1
+
+
+def test_bad_row_is_reported_and_its_batch_not_saved(run_import):
+    result = run_import([{'title': 'A', 'content': 'x'}, {'title': 'B', 'content': 'x', 'views': 'lots'}])
+    assert result.exit_code == 1
+    assert 'Row 2' in result.output and 'lots' in result.output
+    assert Post.query.count() == 0
+
+
+def test_batches_committed_before_a_bad_row_are_indexed(run_import, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_QUEUE_ENABLED', True)
+    result = run_import([
+        {'title': 'Aardvark', 'content': 'x', 'category': 'Zines'},
+        {'title': 'B', 'content': 'x', 'views': 'lots'},
+    ], '--batch-size', '1')
+    assert result.exit_code == 1
+    assert [post.title for post in search_posts('aardvark').posts] == ['Aardvark']
+    assert Job.query.filter_by(name='related.rebuild').count() == 1
+    assert Category.query.filter_by(name='Zines').count() == 1
+
+
+def test_recent_imported_views_reach_the_rankings(run_import, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_QUEUE_ENABLED', True)
+    now = datetime.utcnow()
+    result = run_import([
+        {'title': 'Recent', 'content': 'x', 'views': 50, 'created_at': (now - timedelta(days=1)).isoformat()},
+        {'title': 'Old', 'content': 'x', 'views': 500, 'created_at': (now - timedelta(days=30)).isoformat()},
+    ])
+    assert result.exit_code == 0, result.output
+    assert [post.slug for post in top_posts('most_read')] == ['recent']
+    assert Job.query.filter_by(name='related.rebuild').count() == 1
+
+
+def test_export_round_trip(run_import, app, tmp_path):
+    run_import([{'title': 'Hello', 'content': 'x'}])
+    out = tmp_path / 'out.jsonl'
+    result = app.test_cli_runner().invoke(args=['export', 'posts', '-o', str(out)])
+    assert result.exit_code == 0, result.output
+    rows = [json.loads(line) for line in out.read_text().splitlines()]
+    assert [row['slug'] for row in rows] == ['hello']
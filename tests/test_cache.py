@@ -0,0 +1,44 @@
+import threading
+
+from app import db
+from cache import global_data_cache, invalidate_global_data
+from models import Category
+
+
+def names(data):
+    return [c.name for c in data['nav_categories']]
+
+
+def load_elsewhere(app):
+    # Another request thread of the same worker, with its own session
+    def run():
+        with app.app_context():
+            global_data_cache().get()
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+
+
+def test_writer_sees_its_change_right_after_commit(app):
+    cache = global_data_cache()
+    cache.check_interval = 60
+    assert 'Zines' not in names(cache.get())
+
+    db.session.add(Category(name='Zines'))
+    invalidate_global_data()
+    load_elsewhere(app)
+    db.session.commit()
+
+    assert 'Zines' in names(cache.get())
+
+
+def test_rolled_back_change_keeps_the_cache(app):
+    cache = global_data_cache()
+    cache.check_interval = 60
+    before = cache.get()
+    db.session.add(Category(name='Zines'))
+    invalidate_global_data()
+    db.session.rollback()
+    assert cache.get() is before
+    db.session.commit()
+    assert cache.get() is before
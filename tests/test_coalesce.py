@@ -0,0 +1,120 @@
+import threading
+
+import pytest
+
+import main
+from app import db
+from coalesce import Coalescer, WriteTimeout
+from models import Comment, Post, ServiceOrder, Subscriber, User
+
+
+def add(email):
+    return lambda session: session.add(Subscriber(email=email)) or email
+
+
+def emails():
+    db.session.rollback()
+    return sorted(email for (email,) in db.session.query(Subscriber.email))
+
+
+def test_batched_writes_commit_and_a_bad_one_fails_alone(app):
+    coalescer = Coalescer(app, window=0.2, max_batch=10)
+    results, errors = [], []
+
+    def submit(fn):
+        try:
+            results.append(coalescer.submit(fn))
+        except Exception as e:
+            errors.append(e)
+
+    writes = [add('a@example.org'), add('b@example.org'), add('a@example.org')]
+    threads = [threading.Thread(target=submit, args=(fn,)) for fn in writes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == ['a@example.org', 'b@example.org']
+    assert len(errors) == 1
+    assert emails() == ['a@example.org', 'b@example.org']
+
+
+def test_timed_out_write_is_withdrawn(app):
+    coalescer = Coalescer(app, window=0, max_batch=1, timeout=0.1)
+    release = threading.Event()
+
+    def blocking(session):
+        release.wait(5)
+        session.add(Subscriber(email='first@example.org'))
+
+    first = threading.Thread(target=coalescer.submit, args=(blocking,))
+    first.start()
+    with pytest.raises(WriteTimeout):
+        coalescer.submit(add('late@example.org'))
+    release.set()
+    first.join()
+    coalescer.submit(add('after@example.org'))
+
+    assert emails() == ['after@example.org', 'first@example.org']
+
+
+@pytest.fixture
+def timing_out(app, monkeypatch):
+    def write(fn):
+        raise WriteTimeout()
+    monkeypatch.setattr(main, 'write', write)
+
+
+def test_public_forms_answer_503_when_the_writer_is_backed_up(app, client, admin, timing_out):
+    post = Post(title='T', slug='t', content='x', author_id=admin.id)
+    db.session.add(post)
+    db.session.commit()
+    requests = [
+        ('/subscribe', {'email': 'a@example.org'}),
+        (f'/post/{post.id}/comment', {'name': 'n', 'email': 'e@example.org', 'content': 'c'}),
+        ('/service-order', {'service_name': 's', 'customer_name': 'c'}),
+    ]
+    for path, data in requests:
+        response = client.post(path, data=data)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+
+
+@pytest.mark.parametrize('profile', ['default', 'production'])
+def test_public_forms_commit_through_the_writer_thread(make_app, profile):
+    # A read left open by the request used to block the writer's commit under the rollback journal
+    app = make_app(DB_PROFILE=profile, WRITE_COALESCE_MS=5)
+    client = app.test_client()
+    with app.app_context():
+        admin = User(username='w', password_hash='x')
+        db.session.add(admin)
+        db.session.flush()
+        post = Post(title='T', slug='t', content='x', author_id=admin.id)
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+
+    assert client.post(f'/post/{post_id}/comment', data={'name': 'n', 'email': 'e@example.org', 'content': 'c'}).status_code == 302
+    assert client.post('/subscribe', data={'email': 'a@example.org'}).status_code == 302
+    assert client.post('/subscribe', data={'email': 'a@example.org'}).status_code == 302
+    assert client.post('/service-order', data={'service_name': 's', 'customer_name': 'c', 'contact_number': '1'}).status_code == 302
+    with app.app_context():
+        assert emails() == ['a@example.org']
+        assert db.session.query(Comment).count() == 1
+        assert db.session.query(ServiceOrder).count() == 1
+
+
+def test_public_forms_answer_503_while_the_database_is_locked(make_app):
+    app = make_app(DB_PROFILE='default', WRITE_COALESCE_MS=5,
+                   SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 0.1}})
+    client = app.test_client()
+    with app.app_context():
+        other = db.engine.raw_connection()
+    try:
+        other.execute('BEGIN IMMEDIATE')
+        response = client.post('/subscribe', data={'email': 'a@example.org'})
+        assert response.status_code == 503
+    finally:
+        other.rollback()
+        other.close()
+    assert client.post('/subscribe', data={'email': 'a@example.org'}).status_code == 302
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import db
+from comments import load_comment_threads
+from models import Comment, Post
+
+START = datetime(2026, 1, 1)
+
+
+def comment(post, minutes, parent=None):
+    row = Comment(name='n', email='e@x.org', content=str(minutes), post_id=post.id,
+                  parent_id=parent.id if parent else None, created_at=START + timedelta(minutes=minutes))
+    db.session.add(row)
+    db.session.flush()
+    return row
+
+
+def test_threads_load_in_one_query_without_lazy_loads(app, admin):
+    post = Post(title='T', slug='t', content='x', author_id=admin.id)
+    other = Post(title='U', slug='u', content='x', author_id=admin.id)
+    db.session.add_all([post, other])
+    db.session.flush()
+    old, new = comment(post, 1), comment(post, 2)
+    reply = comment(post, 3, parent=old)
+    comment(post, 4, parent=reply)
+    comment(other, 5)
+    post_id = post.id
+    db.session.commit()
+    db.session.expunge_all()
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        page = load_comment_threads(post_id)
+        tree = [(c.content, [(r.content, [n.content for n in r.replies]) for r in c.replies]) for c in page]
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert len(statements) == 1
+    assert tree == [('2', []), ('1', [('3', ['4'])])]
+    assert not page.has_next
+
+
+def test_only_top_level_comments_count_towards_a_page(app, admin):
+    post = Post(title='T', slug='t', content='x', author_id=admin.id)
+    db.session.add(post)
+    db.session.flush()
+    roots = [comment(post, i) for i in range(3)]
+    for i in range(5):
+        comment(post, 10 + i, parent=roots[2])
+    db.session.commit()
+
+    first = load_comment_threads(post.id, per_page=2)
+    assert [c.id for c in first] == [roots[2].id, roots[1].id]
+    assert len(first.items[0].replies) == 5
+    second = load_comment_threads(post.id, cursor=first.next_cursor, per_page=2)
+    assert [c.id for c in second] == [roots[0].id]
+    assert not second.has_next
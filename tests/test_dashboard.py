@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from flask import template_rendered
+
+from app import db
+from models import Post, Subscriber
+
+START = datetime(2026, 1, 1)
+
+
+@contextmanager
+def rendered(app):
+    contexts = []
+
+    def record(sender, template, context, **extra):
+        contexts.append(context)
+
+    template_rendered.connect(record, app)
+    try:
+        yield contexts
+    finally:
+        template_rendered.disconnect(record, app)
+
+
+@pytest.fixture
+def subscribers(app):
+    rows = [Subscriber(email=f'reader{i}@{"corp" if i % 2 else "mail"}.org', subscribed_at=START + timedelta(days=i))
+            for i in range(30)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def test_tabs_need_a_login(client):
+    for tab in ('posts', 'subscribers', 'submissions', 'orders'):
+        assert client.get(f'/dashboard/{tab}').status_code == 302
+
+
+def test_tab_pages_are_newest_first_and_bounded(app, admin_client, subscribers):
+    with rendered(app) as contexts:
+        admin_client.get('/dashboard/subscribers?page=2&per_page=10')
+        admin_client.get('/dashboard/subscribers?per_page=1000')
+        admin_client.get('/dashboard/subscribers?page=99')
+    second, capped, beyond = contexts
+    assert [s.email for s in second['subscribers']] == [s.email for s in subscribers[19:9:-1]]
+    assert second['pagination'].pages == 3
+    assert capped['pagination'].per_page == 100 and len(capped['subscribers']) == 30
+    assert beyond['subscribers'] == []
+
+
+def test_tab_filters(app, admin, admin_client, subscribers):
+    db.session.add_all([Post(title=t, slug=t.lower().replace(' ', '-'), content='x', category=c, author_id=admin.id)
+                        for t, c in (('Rates rise', 'Business'), ('Rates fall', 'World'), ('Harvest', 'Business'))])
+    db.session.commit()
+    with rendered(app) as contexts:
+        admin_client.get('/dashboard/subscribers?q=CORP')
+        admin_client.get('/dashboard/posts?q=rates&category=Business')
+    emails, posts = contexts
+    assert len(emails['subscribers']) == 15 and all('corp' in s.email for s in emails['subscribers'])
+    assert [p.title for p in posts['posts']] == ['Rates rise']
@@ -0,0 +1,81 @@
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import db_profile
+from app import db
+from db_profile import READ_BIND, read_only
+from models import Category
+
+
+def configured(uri, **config):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=uri, **config)
+    db_profile.configure(app)
+    return app.config
+
+
+def test_production_profile_splits_reads_on_a_sqlite_file(tmp_path):
+    config = configured(f'sqlite:///{tmp_path / "a.db"}', DB_PROFILE='production')
+    assert config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'] == 10
+    assert config['SQLALCHEMY_BINDS'][READ_BIND]['url'] == f'sqlite:///{tmp_path / "a.db"}'
+    assert config['DB_PRAGMAS']['journal_mode'] == 'WAL'
+
+
+def test_in_memory_sqlite_and_default_profile_are_left_alone(tmp_path):
+    config = configured('sqlite://', DB_PROFILE='production')
+    assert 'pool_size' not in config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert 'SQLALCHEMY_BINDS' not in config
+    config = configured(f'sqlite:///{tmp_path / "a.db"}', DB_PROFILE='default')
+    assert config['SQLALCHEMY_ENGINE_OPTIONS'] == {} and config['DB_PRAGMAS'] == {}
+    assert 'SQLALCHEMY_BINDS' not in config
+
+
+def test_read_url_is_used_under_any_profile(tmp_path):
+    config = configured(f'sqlite:///{tmp_path / "a.db"}', DB_PROFILE='default', DATABASE_READ_URL='sqlite:///replica.db')
+    assert config['SQLALCHEMY_BINDS'][READ_BIND]['url'] == 'sqlite:///replica.db'
+
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        configured('sqlite://', DB_PROFILE='fast')
+
+
+def test_pragmas_apply_and_the_read_pool_is_query_only(app):
+    assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+    assert db.session.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+    with db.engines[READ_BIND].connect() as conn:
+        assert conn.execute(text('PRAGMA query_only')).scalar() == 1
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO category (name) VALUES ('Zines')"))
+
+
+def test_read_only_views_route_anonymous_reads_to_the_read_engine(app, admin):
+    @read_only
+    def view():
+        return db.session.get_bind()
+
+    with app.test_request_context():
+        assert view() is db.engines[READ_BIND]
+        # Pending writes keep the session on the primary
+        db.session.add(Category(name='Zines'))
+        assert view() is db.engines[None]
+        db.session.rollback()
+        assert db.session.get_bind() is db.engines[None]
+
+    with app.test_request_context():
+        from flask_login import login_user
+        login_user(admin)
+        assert view() is db.engines[None]
+
+
+def test_reads_hold_no_lock_outside_a_write(make_app):
+    # Under the rollback journal an open read transaction blocks every other writer
+    app = make_app(DB_PROFILE='default')
+    with app.app_context():
+        Category.query.all()
+        with db.engine.connect() as other:
+            other.execute(text("INSERT INTO category (name) VALUES ('Zines')"))
+            other.commit()
+        db.session.rollback()
@@ -0,0 +1,68 @@
+import hashlib
+import io
+import os
+
+from PIL import Image
+
+from images import derivative_path
+from storage import upload_root
+
+
+def store(app, data, ext='png'):
+    content_hash = hashlib.sha256(data).hexdigest()
+    path = os.path.join(upload_root(), content_hash[:2], f'{content_hash}.{ext}')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return content_hash
+
+
+def png(width, height):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(out, 'PNG')
+    return out.getvalue()
+
+
+def leftovers(root):
+    return [name for _, _, files in os.walk(root) for name in files if name.endswith('.tmp')]
+
+
+def test_derivative_is_resized_and_served(app, client):
+    content_hash = store(app, png(800, 400))
+    response = client.get(f'/media/{content_hash}/320.webp')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    with Image.open(io.BytesIO(response.data)) as img:
+        assert img.size == (320, 160)
+    assert os.path.exists(derivative_path(upload_root(), content_hash, 320, 'webp'))
+
+
+def test_unknown_sizes_and_hashes_are_404(app, client):
+    content_hash = store(app, png(10, 10))
+    assert client.get(f'/media/{content_hash}/300.webp').status_code == 404
+    assert client.get(f'/media/{content_hash}/320.gif').status_code == 404
+    assert client.get('/media/' + '0' * 64 + '/320.webp').status_code == 404
+
+
+def test_unreadable_image_falls_back_to_the_original(app, client):
+    content_hash = store(app, b'not an image at all')
+    response = client.get(f'/media/{content_hash}/640.jpg')
+    assert response.status_code == 302
+    assert response.headers['Location'] == f'/static/uploads/{content_hash[:2]}/{content_hash}.png'
+    assert client.get(response.headers['Location']).status_code == 200
+    assert leftovers(upload_root()) == []
+
+
+def test_failed_save_leaves_no_temp_file(app, client, monkeypatch):
+    content_hash = store(app, png(100, 100))
+
+    def broken_save(self, fp, *args, **kwargs):
+        with open(fp, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(Image.Image, 'save', broken_save)
+    response = client.get(f'/media/{content_hash}/320.webp')
+    assert response.status_code == 302
+    assert leftovers(upload_root()) == []
+    assert not os.path.exists(derivative_path(upload_root(), content_hash, 320, 'webp'))
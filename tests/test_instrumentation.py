@@ -0,0 +1,63 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from sqlalchemy import text
+
+from app import db
+from instrumentation import Metrics, MetricsStore, normalize
+
+
+def test_normalize_collapses_literals_and_in_lists():
+    assert normalize("SELECT * FROM post WHERE slug = 'it''s'  AND id IN (?, ?, ?) LIMIT 10") == \
+        normalize("SELECT * FROM post\nWHERE slug = 'x' AND id IN (?, ?) LIMIT 6") == \
+        'SELECT * FROM post WHERE slug = ? AND id IN (...) LIMIT ?'
+
+
+def test_server_timing_counts_queries(client):
+    response = client.get('/search?q=economy')
+    assert response.status_code == 200
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('db;dur=') and 'queries"' in timing and 'app;dur=' in timing
+
+
+def test_metrics_add_up_requests_and_need_the_token(make_app):
+    app = make_app(METRICS_TOKEN='secret')
+    client = app.test_client()
+    client.get('/search?q=economy')
+    client.get('/search?q=economy')
+    assert client.get('/metrics').status_code == 403
+
+    body = client.get('/metrics', headers={'Authorization': 'Bearer secret'}).get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="main.search",method="GET",status="200"} 2' in body
+    assert 'db_pool_checked_out{bind="default"}' in body
+    assert 'instrumentation.metrics' not in body
+
+
+def test_exited_workers_are_archived_and_counters_never_drop(tmp_path):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    part = {'requests': {'main.index|GET|200': [1] * 13}, 'endpoints': {}, 'db': {'queries': 4}}
+    with open(tmp_path / f'{exited.pid}-dead.json', 'w') as f:
+        json.dump(part, f)
+
+    live = Metrics()
+    live.observe_request('main.index', 'GET', 200, 0.02, 3, 0.01, 0.0)
+    store = MetricsStore(str(tmp_path), live)
+    first = store.collect()
+    assert first['requests']['main.index|GET|200'][-1] == 2
+    assert first['db']['queries'] == 4
+    assert not (tmp_path / f'{exited.pid}-dead.json').exists()
+    assert store.collect() == first
+
+
+def test_slow_and_repeated_statements_are_logged(make_app, caplog):
+    app = make_app(SLOW_QUERY_MS=0, N_PLUS_ONE_THRESHOLD=3)
+    caplog.set_level(logging.WARNING, logger='instrumentation')
+    with app.test_request_context('/'):
+        for _ in range(3):
+            db.session.execute(text('SELECT 1'))
+    assert any(m.startswith('Slow query') and os.path.basename(__file__) in m for m in caplog.messages)
+    assert sum(m.startswith('Possible N+1') for m in caplog.messages) == 1
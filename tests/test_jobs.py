@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from jobs import after_commit, claim, enqueue, job, purge, run, schedule_periodic
+from models import Job
+
+calls = []
+
+
+@job('tests.record', max_attempts=2, backoff=60)
+def record(value, fail=False):
+    calls.append(value)
+    if fail:
+        raise RuntimeError('boom')
+
+
+@pytest.fixture(autouse=True)
+def reset_calls():
+    calls.clear()
+
+
+def jobs_named(name):
+    db.session.rollback()
+    return Job.query.filter_by(name=name).all()
+
+
+def test_enqueue_commits_and_rolls_back_with_the_caller(app):
+    enqueue('tests.record', {'value': 1})
+    db.session.rollback()
+    assert jobs_named('tests.record') == []
+    enqueue('tests.record', {'value': 2})
+    db.session.commit()
+    assert len(jobs_named('tests.record')) == 1
+
+
+def test_run_marks_done_or_retries_with_backoff(app):
+    enqueue('tests.record', {'value': 'ok'})
+    enqueue('tests.record', {'value': 'bad', 'fail': True})
+    db.session.commit()
+
+    run(claim())
+    entry = claim()
+    run(entry)
+    assert calls == ['ok', 'bad']
+    assert entry.status == 'queued' and entry.run_at > datetime.utcnow() + timedelta(seconds=50)
+    assert claim() is None
+
+    entry.run_at = datetime.utcnow()
+    db.session.commit()
+    run(claim())
+    assert entry.status == 'failed' and 'boom' in entry.last_error
+    assert sorted(j.status for j in jobs_named('tests.record')) == ['done', 'failed']
+
+
+def test_periodic_jobs_are_enqueued_once_per_slot(app):
+    schedule_periodic(now=7200)
+    schedule_periodic(now=7300)
+    assert len(jobs_named('jobs.purge')) == 1
+    schedule_periodic(now=10800)
+    assert len(jobs_named('jobs.purge')) == 2
+
+
+def test_purge_keeps_recent_and_pending_jobs(app):
+    now = datetime.utcnow()
+    rows = {
+        'old done': ('done', now - timedelta(days=8)),
+        'new done': ('done', now - timedelta(days=1)),
+        'old failed': ('failed', now - timedelta(days=31)),
+        'new failed': ('failed', now - timedelta(days=8)),
+        'queued': ('queued', None),
+    }
+    db.session.add_all(Job(name=name, status=status, finished_at=at) for name, (status, at) in rows.items())
+    db.session.commit()
+    assert purge() == 2
+    assert sorted(name for (name,) in db.session.query(Job.name)) == ['new done', 'new failed', 'queued']
+
+
+def test_after_commit_runs_once_and_only_on_commit(app):
+    after_commit(lambda: calls.append('rolled back'))
+    db.session.rollback()
+    with db.session.begin_nested():
+        after_commit(lambda: calls.append('committed'))
+    assert calls == []
+    db.session.commit()
+    db.session.commit()
+    assert calls == ['committed']
+
+
+def test_post_changes_commit_once_with_their_jobs(admin_client, monkeypatch):
+    app = admin_client.application
+    monkeypatch.setitem(app.config, 'JOB_QUEUE_ENABLED', True)
+    monkeypatch.setitem(app.config, 'STATIC_EXPORT_ENABLED', True)
+    commits = []
+
+    def count(conn):
+        commits.append(conn)
+
+    event.listen(db.engine, 'commit', count)
+    try:
+        response = admin_client.post('/create', data={'title': 'Hello', 'content': 'x', 'category': 'Tech'})
+    finally:
+        event.remove(db.engine, 'commit', count)
+    assert response.status_code == 302
+    assert len(commits) == 1
+    names = {name for (name,) in db.session.query(Job.name)}
+    assert {'response_cache.warm', 'static_export.render'} <= names
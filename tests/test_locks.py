@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from locks import LockHeld, file_lock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOLD = """
+import sys
+from locks import file_lock
+with file_lock(sys.argv[1]):
+    print('held', flush=True)
+    sys.stdin.readline()
+"""
+
+
+def test_lock_excludes_other_processes(tmp_path):
+    path = str(tmp_path / 'sub' / 'x.lock')
+    holder = subprocess.Popen([sys.executable, '-c', HOLD, path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              text=True, cwd=ROOT)
+    try:
+        assert holder.stdout.readline().strip() == 'held'
+        with pytest.raises(LockHeld):
+            with file_lock(path, blocking=False):
+                pass
+        acquired = threading.Event()
+
+        def wait():
+            with file_lock(path):
+                acquired.set()
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        assert not acquired.wait(0.3)
+        holder.stdin.write('\n')
+        holder.stdin.flush()
+        assert acquired.wait(5)
+        waiter.join()
+    finally:
+        holder.kill()
+        holder.wait()
+
+
+def test_lock_is_released_when_the_block_raises(tmp_path):
+    path = str(tmp_path / 'x.lock')
+    with pytest.raises(ValueError):
+        with file_lock(path):
+            raise ValueError
+    with file_lock(path, blocking=False):
+        pass
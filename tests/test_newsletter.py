@@ -0,0 +1,150 @@
+import smtplib
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from models import Newsletter, NewsletterDelivery, Subscriber
+from newsletter import NewsletterBusy, SMTPPool, build_message, send_newsletter
+
+Controller = pytest.importorskip('aiosmtpd.controller').Controller
+
+
+class Handler:
+    def __init__(self):
+        self.received = []
+        self.peers = set()
+        self.refuse = set()
+        self.reject_data = False
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject_data:
+            return '554 Rejected'
+        self.peers.add(session.peer)
+        self.received.extend(envelope.rcpt_tos)
+        return '250 OK'
+
+
+@pytest.fixture
+def smtp():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    handler = Handler()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    yield handler, port
+    controller.stop()
+
+
+def message(to):
+    return build_message('Hi', 'Body', None, to, 'news@example.org')
+
+
+def test_newsletter_reaches_every_subscriber_over_pooled_connections(app, smtp):
+    handler, port = smtp
+    emails = [f'reader{i}@example.org' for i in range(7)]
+    handler.refuse.add(emails[3])
+    db.session.add_all(Subscriber(email=email) for email in emails)
+    newsletter = Newsletter(subject='Hi', body_text='Body')
+    db.session.add(newsletter)
+    db.session.commit()
+
+    pool = SMTPPool('127.0.0.1', port, size=2)
+    assert send_newsletter(newsletter.id, chunk_size=3, concurrency=2, pool=pool) == (6, 1)
+
+    assert sorted(handler.received) == sorted(e for e in emails if e != emails[3])
+    assert len(handler.peers) <= 2
+    failed = NewsletterDelivery.query.filter_by(status='failed').one()
+    assert failed.email == emails[3] and '550' in failed.error
+    assert newsletter.status == 'sent' and newsletter.last_subscriber_id == 7
+    # A finished newsletter is not sent twice
+    assert send_newsletter(newsletter.id, pool=pool) == (0, 0)
+
+
+class BrokenPool:
+    def send(self, message):
+        raise RuntimeError('worker killed')
+
+    def close(self):
+        pass
+
+
+def test_only_one_run_sends_at_a_time(app, smtp):
+    handler, port = smtp
+    db.session.add(Subscriber(email='reader@example.org'))
+    newsletter = Newsletter(subject='Hi', body_text='Body', status='sending',
+                            locked_until=datetime.utcnow() + timedelta(minutes=5))
+    db.session.add(newsletter)
+    db.session.commit()
+
+    with pytest.raises(NewsletterBusy):
+        send_newsletter(newsletter.id, pool=SMTPPool('127.0.0.1', port))
+    assert handler.received == [] and NewsletterDelivery.query.count() == 0
+
+    # A crashed run's lease lapses
+    newsletter.locked_until = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert send_newsletter(newsletter.id, pool=SMTPPool('127.0.0.1', port)) == (1, 0)
+    assert newsletter.status == 'sent' and newsletter.locked_until is None
+
+
+def test_failed_run_releases_its_lease(app):
+    db.session.add(Subscriber(email='reader@example.org'))
+    newsletter = Newsletter(subject='Hi', body_text='Body')
+    db.session.add(newsletter)
+    db.session.commit()
+    with pytest.raises(RuntimeError):
+        send_newsletter(newsletter.id, pool=BrokenPool())
+    assert newsletter.status == 'sending' and newsletter.locked_until is None
+
+
+def test_dropped_connection_is_replaced_once(smtp):
+    handler, port = smtp
+    pool = SMTPPool('127.0.0.1', port, size=1)
+    pool.send(message('a@example.org'))
+    dropped = pool._idle.get_nowait()
+    dropped.close()  # What the client sees after the server drops an idle connection
+    pool._idle.put(dropped)
+
+    pool.send(message('b@example.org'))
+    assert handler.received == ['a@example.org', 'b@example.org']
+    fresh = pool._idle.get_nowait()
+    assert fresh is not dropped and fresh.sock is not None
+    pool._idle.put(fresh)
+    pool.close()
+
+
+def test_failed_reconnect_closes_the_new_connection(smtp, monkeypatch):
+    handler, port = smtp
+    pool = SMTPPool('127.0.0.1', port, size=1)
+    opened = []
+    connect = pool._connect
+
+    def tracking_connect():
+        conn = connect()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(pool, '_connect', tracking_connect)
+    pool.send(message('a@example.org'))
+    pool._idle.get_nowait().close()
+    pool._idle.put(opened[0])
+    handler.reject_data = True
+
+    with pytest.raises(smtplib.SMTPDataError):
+        pool.send(message('b@example.org'))
+    assert len(opened) == 2
+    assert opened[1].sock is None
+    assert pool._idle.empty()
+    # The slot was given back
+    handler.reject_data = False
+    pool.send(message('c@example.org'))
+    assert handler.received == ['a@example.org', 'c@example.org']
@@ -0,0 +1,91 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from comments import load_comment_threads
+from models import Comment, Post
+from pagination import decode_cursor, encode_cursor, keyset_paginate
+
+START = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def posts(app, admin):
+    # Two share a timestamp and two are undated, as legacy rows can be
+    rows = [Post(title=f'P{i}', slug=f'p{i}', content='x', author_id=admin.id,
+                 created_at=START + timedelta(hours=min(i, 5))) for i in range(9)]
+    db.session.add_all(rows)
+    db.session.commit()
+    Post.query.filter(Post.id.in_([rows[2].id, rows[7].id])).update({'created_at': None})
+    db.session.commit()
+    return rows
+
+
+def walk(per_page):
+    pages, cursor = [], None
+    while True:
+        page = keyset_paginate(Post.query, Post.created_at, Post.id, cursor=cursor, per_page=per_page)
+        pages.append(page)
+        if not page.has_next:
+            return pages
+        cursor = page.next_cursor
+
+
+def test_pages_cover_every_row_once_with_undated_rows_last(app, posts):
+    expected = [p.id for p in sorted((p for p in posts if p.created_at), key=lambda p: (p.created_at, p.id), reverse=True)]
+    expected += [posts[7].id, posts[2].id]
+    for per_page in (1, 2, 3, 4, 9, 10):
+        assert [p.id for page in walk(per_page) for p in page] == expected
+
+
+def test_pages_carry_pagination_attributes(app, posts):
+    first, second, last = walk(3)
+    assert (first.page, first.has_prev, first.prev_num, first.next_num, first.pages) == (1, False, None, 2, 2)
+    assert (second.page, second.has_prev, second.prev_num, second.next_num) == (2, True, 1, 3)
+    assert (last.page, last.has_next, last.next_num, last.pages, last.total) == (3, False, None, 3, None)
+    assert list(second.iter_pages()) == [1, 2, 3]
+    assert list(first.iter_pages()) == [1, 2]
+
+
+def test_cursor_without_a_page_number_is_accepted(app, posts):
+    first = keyset_paginate(Post.query, Post.created_at, Post.id, per_page=2)
+    last = first.items[-1]
+    legacy = base64.urlsafe_b64encode(json.dumps([last.created_at.isoformat(), last.id]).encode()).decode().rstrip('=')
+    page = keyset_paginate(Post.query, Post.created_at, Post.id, cursor=legacy, per_page=2)
+    assert page.page == 2
+    assert page.items == walk(2)[1].items
+
+
+@pytest.mark.parametrize('token', ['%%%', 'bm90IGpzb24', encode_cursor(START, 'x'), encode_cursor(START, 1, page=1)])
+def test_malformed_cursor_is_a_bad_request(app, client, posts, token):
+    assert client.get('/', query_string={'cursor': token}).status_code == 400
+    assert client.get(f'/post/{posts[0].id}/comments', query_string={'cursor': token}).status_code == 400
+
+
+def test_undated_cursor_round_trips(app):
+    assert decode_cursor(encode_cursor(None, 7, page=3)) == (None, 7, 3)
+
+
+def test_comment_pages_include_undated_threads(app, posts):
+    post = posts[0]
+    roots = [Comment(name='n', email='e@x.org', content=str(i), post_id=post.id, created_at=START + timedelta(minutes=i))
+             for i in range(5)]
+    db.session.add_all(roots)
+    db.session.commit()
+    db.session.add(Comment(name='n', email='e@x.org', content='reply', post_id=post.id, parent_id=roots[1].id))
+    Comment.query.filter_by(id=roots[1].id).update({'created_at': None})
+    db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        page = load_comment_threads(post.id, cursor=cursor, per_page=2)
+        seen += page.items
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    assert [c.id for c in seen] == [roots[i].id for i in (4, 3, 2, 0, 1)]
+    assert [r.content for r in seen[-1].replies] == ['reply']
+    assert page.page == 3
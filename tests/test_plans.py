@@ -0,0 +1,28 @@
+from app import db
+from migrations.plans import check_plans, plan_problems
+from models import Comment, Post
+
+
+def problems(statement):
+    with db.engine.connect() as conn:
+        return list(plan_problems(conn, statement, ()))
+
+
+def test_pages_need_no_full_scans_or_sorts(app, admin):
+    db.session.add_all(Post(title=f'Economy {i}', slug=f'economy-{i}', content='economy', category='World',
+                            author_id=admin.id) for i in range(30))
+    db.session.flush()
+    db.session.add(Comment(post_id=1, name='a', email='a@example.org', content='c'))
+    db.session.commit()
+    assert check_plans() == []
+
+
+def test_sorts_the_indexes_cannot_deliver_are_reported(app):
+    assert problems("SELECT id FROM post WHERE category = 'World' ORDER BY created_at DESC, id DESC LIMIT 10") == []
+    assert problems("SELECT id FROM post WHERE category = 'World' ORDER BY title LIMIT 10") == [
+        ('sort of post', 'USE TEMP B-TREE FOR ORDER BY')]
+    assert problems('SELECT id FROM post ORDER BY views') == [
+        ('full scan of post', 'SCAN post'), ('sort of post', 'USE TEMP B-TREE FOR ORDER BY')]
+    # Rows fetched by primary key are a bounded list
+    assert problems('SELECT id FROM comment WHERE id IN (1, 2) ORDER BY created_at') == []
+    assert problems('SELECT id FROM category ORDER BY name') == []
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+from app import db
+from models import ActivePageViewer
+from presence import PresenceTracker
+
+
+def test_viewer_who_never_leaves_expires():
+    tracker = PresenceTracker(ttl=30)
+    tracker.heartbeat(1, 'a', now=1000.7)
+    for now in (1029.5, 1030.3, 1030.9):
+        tracker.sweep(now=now)
+        assert tracker.count(1) == 1
+    assert tracker.sweep(now=1031.5) == 1
+    assert tracker.count(1) == 0
+    assert tracker.sweep(now=5000) == 0
+
+
+def test_heartbeat_moves_expiry_forward():
+    tracker = PresenceTracker(ttl=30)
+    tracker.heartbeat(1, 'a', now=1000)
+    tracker.heartbeat(1, 'a', now=1020)
+    tracker.sweep(now=1040)
+    assert tracker.count(1) == 1
+    tracker.sweep(now=1051)
+    assert tracker.count(1) == 0
+
+
+def test_leave_and_expiry_drop_per_post_state():
+    tracker = PresenceTracker(ttl=30)
+    for post_id in range(100):
+        tracker.heartbeat(post_id, 'a', now=1000)
+    tracker.leave(0, 'a')
+    tracker.sweep(now=2000)
+    assert tracker._viewers == {} and tracker._versions == {}
+
+
+def test_full_tracker_creates_nothing_for_new_posts():
+    tracker = PresenceTracker(ttl=30, max_viewers=2)
+    tracker.heartbeat(1, 'a', now=1000)
+    tracker.heartbeat(1, 'b', now=1000)
+    assert tracker.heartbeat(99, 'c', now=1000) == 0
+    assert set(tracker._viewers) == {1} and set(tracker._versions) == {1}
+
+
+def test_versions_change_on_every_count_change():
+    tracker = PresenceTracker(ttl=30)
+    seen = {tracker.version(1)}
+    tracker.heartbeat(1, 'a', now=1000)
+    seen.add(tracker.version(1))
+    tracker.leave(1, 'a')
+    seen.add(tracker.version(1))
+    tracker.heartbeat(1, 'a', now=1001)
+    seen.add(tracker.version(1))
+    assert len(seen) == 3 and tracker.version(1) != 0
+    assert tracker.wait_for_change(1, 0, timeout=0) == (tracker.version(1), 1)
+
+
+def test_counts_include_other_processes_snapshots(make_app):
+    app = make_app(PRESENCE_SNAPSHOT_SECONDS=5)
+    with app.app_context():
+        now = datetime.utcnow()
+        db.session.add_all([
+            ActivePageViewer(post_id=1, viewer_id='elsewhere', last_heartbeat=now),
+            ActivePageViewer(post_id=1, viewer_id='here', last_heartbeat=now),
+            ActivePageViewer(post_id=1, viewer_id='gone', last_heartbeat=now - timedelta(minutes=5)),
+        ])
+        db.session.commit()
+    client = app.test_client()
+    response = client.post('/beacon/heartbeat', json={'post_id': 1, 'viewer_id': 'here'})
+    assert response.json == {'readers': 2}
+    assert client.get('/post/1/readers').json == {'readers': 2}
+    stream = client.get('/post/1/readers/stream', buffered=False)
+    assert next(stream.response) == b'retry: 5000\ndata: {"readers": 2}\n\n'
+    stream.close()
+
+
+def test_streams_can_be_turned_off(make_app):
+    app = make_app(PRESENCE_STREAM_SECONDS=0)
+    assert app.test_client().get('/post/1/readers/stream').status_code == 204
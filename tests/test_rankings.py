@@ -0,0 +1,85 @@
+import os
+import random
+import time
+
+import pytest
+
+import rankings
+from app import db
+from models import Post, PostActivity, PostRanking, RankingEntry
+
+
+@pytest.fixture
+def posts(app, admin):
+    rows = [Post(title=f'P{i}', slug=f'p{i}', content='x', category='World' if i % 2 else 'Tech', author_id=admin.id) for i in range(6)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+NOW = 1_800_000_000
+
+
+def test_lists_follow_activity(app, posts):
+    hour = rankings.current_hour(NOW)
+    rankings.record_activity({posts[0].id: (1, 0), posts[1].id: (5, 0), posts[2].id: (2, 600)}, hour=hour)
+    db.session.commit()
+    assert rankings.refresh(NOW) == {'', 'Tech', 'World'}
+    assert [p.id for p in rankings.top_posts('trending')] == [posts[2].id, posts[1].id, posts[0].id]
+    assert [p.id for p in rankings.top_posts('most_read')] == [posts[1].id, posts[2].id, posts[0].id]
+    assert [p.id for p in rankings.top_posts('trending', 'World')] == [posts[1].id]
+    assert rankings.refresh(NOW) == set()
+
+
+def test_incremental_scores_match_a_full_recompute(app, posts):
+    rng = random.Random(1)
+    start = rankings.current_hour(NOW)
+    events = sorted(((rng.choice(posts).id, start + rng.randint(0, 200), rng.randint(1, 5), rng.randint(0, 300))
+                     for _ in range(300)), key=lambda e: e[1])
+    for n, (post_id, hour, views, seconds) in enumerate(events):
+        rankings.record_activity({post_id: (views, seconds)}, hour=hour)
+        db.session.commit()
+        if n % 23 == 0:
+            rankings.refresh(hour * 3600 + 10)
+    end = start + 210
+    rankings.refresh(end * 3600)
+
+    expected = {}
+    for post_id, hour, views, seconds in events:
+        score = expected.setdefault(post_id, [0.0, 0])
+        score[0] += (views + seconds / 60) * 0.5 ** ((end - hour) / 24)
+        if hour > end - rankings.WEEK_HOURS:
+            score[1] += views
+    actual = {r.post_id: (r.trending, r.week_views) for r in PostRanking.query}
+    for post_id, (trending, week_views) in expected.items():
+        assert actual[post_id][0] == pytest.approx(trending)
+        assert actual[post_id][1] == week_views
+
+
+def test_deleted_post_takes_its_rankings_along(app, admin_client, posts):
+    victim = posts[-1]
+    rankings.record_activity({victim.id: (50, 0)}, hour=rankings.current_hour())
+    db.session.commit()
+    rankings.refresh()
+    assert db.session.get(PostRanking, victim.id) is not None
+    admin_client.get(f'/delete/{victim.id}')
+    for model in (PostActivity, PostRanking, RankingEntry):
+        assert db.session.query(model).filter_by(post_id=victim.id).count() == 0
+
+
+def test_flush_ignores_beacons_for_missing_posts(app, posts):
+    buffer = app.extensions['analytics_buffer']
+    buffer.record(posts[0].id, views=1)
+    buffer.record(999999, views=1)
+    buffer.flush()
+    db.session.rollback()  # The flush committed from its own session; start a fresh snapshot
+    assert {a.post_id for a in PostActivity.query} == {posts[0].id}
+
+
+def test_refresh_is_throttled_per_host(app, posts):
+    rankings.maybe_refresh(app)
+    stamp = app.config['RANKINGS_LOCK_PATH']
+    first = os.path.getmtime(stamp)
+    time.sleep(0.01)
+    rankings.maybe_refresh(app)
+    assert os.path.getmtime(stamp) == first
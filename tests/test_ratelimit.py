@@ -0,0 +1,61 @@
+import pytest
+
+from app import db
+from models import User
+from ratelimit import _take
+
+
+@pytest.fixture
+def limited(make_app):
+    def make(**config):
+        app = make_app(RATE_LIMIT_BACKEND='memory', **config)
+        return app.test_client()
+    return make
+
+
+def subscribe(client, n, **headers):
+    return [client.post('/subscribe', data={'email': f'{n}-{i}@example.org'}, headers=headers).status_code
+            for i in range(4)]
+
+
+def test_take_spends_from_all_buckets_or_none():
+    allowed, state, _ = _take([('a', 1, 60), ('b', 2, 60)], 0.0, {})
+    assert allowed and state == {'a': (0, 0.0), 'b': (1, 0.0)}
+    allowed, state, wait = _take([('a', 1, 60), ('b', 2, 60)], 30.0, {'a': (0, 0.0), 'b': (1, 0.0)})
+    assert not allowed and state == {} and wait == pytest.approx(30.0)
+
+
+def test_ip_bucket_answers_429_with_retry_after(limited):
+    client = limited()
+    assert subscribe(client, 'a') == [302, 302, 302, 429]
+    response = client.post('/subscribe', data={'email': 'late@example.org'})
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_forwarded_address_is_trusted_only_with_proxy_fix(limited):
+    client = limited()
+    for n in range(2):
+        assert subscribe(client, n, **{'X-Forwarded-For': f'10.0.0.{n}'})[0] == (302 if n == 0 else 429)
+
+    # Separate buckets per reader, and no route-wide bucket to drain
+    client = limited(PROXY_FIX_X_FOR=1)
+    for n in range(3):
+        assert subscribe(client, n, **{'X-Forwarded-For': f'10.0.0.{n}'}) == [302, 302, 302, 429]
+
+
+def test_route_bucket_is_opt_in(limited):
+    client = limited(PROXY_FIX_X_FOR=1, RATE_LIMITS={'main.subscribe': {'route': (5, 60)}})
+    assert subscribe(client, 'x', **{'X-Forwarded-For': '10.0.1.1'}) == [302, 302, 302, 429]
+    assert subscribe(client, 'y', **{'X-Forwarded-For': '10.0.1.2'}) == [302, 302, 429, 429]
+
+
+def test_signed_in_users_are_not_limited(limited):
+    client = limited()
+    with client.application.app_context():
+        user = User(username='admin', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    assert subscribe(client, 'admin') == [302] * 4
@@ -0,0 +1,102 @@
+import pytest
+from sqlalchemy import inspect
+
+import related
+from app import db
+from models import Post, RelatedPost
+
+pytestmark = pytest.mark.skipif(not related.NUMPY_AVAILABLE, reason='numpy and scipy are not installed')
+
+TOPICS = {
+    'rates': 'central bank interest rates inflation bond yields',
+    'trade': 'tariffs exports imports shipping customs',
+    'farms': 'harvest wheat fertiliser drought livestock',
+}
+
+
+@pytest.fixture
+def posts(app, admin):
+    rows = []
+    for topic, words in TOPICS.items():
+        for i in range(4):
+            rows.append(Post(title=f'{topic} {i}', slug=f'{topic}-{i}', author_id=admin.id, category='World',
+                             content=f'<p>The {words} and {words.split()[i]} of the week.</p>'))
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def neighbours():
+    lists = {}
+    for entry in RelatedPost.query.order_by(RelatedPost.post_id, RelatedPost.rank):
+        lists.setdefault(entry.post_id, []).append(entry.related_id)
+    return lists
+
+
+def topic(post_id):
+    return db.session.get(Post, post_id).slug.split('-')[0]
+
+
+def test_rebuild_links_posts_on_the_same_topic(app, posts):
+    app.config['RELATED_TOP_K'] = 3
+    assert related.rebuild() == len(posts)
+    lists = neighbours()
+    assert set(lists) == {p.id for p in posts}
+    for post_id, ids in lists.items():
+        assert post_id not in ids
+        assert {topic(i) for i in ids} == {topic(post_id)}
+    db.session.expunge_all()
+    cards = related.related_posts(posts[0].id)
+    assert [p.id for p in cards] == lists[posts[0].id]
+    # Rendered as cards, so the bodies stay unloaded
+    assert all('content' not in inspect(p).dict for p in cards)
+
+
+def test_blocked_scoring_matches_one_block(app, posts):
+    related.rebuild()
+    whole = neighbours()
+    app.config['RELATED_MEMORY_MB'] = 0  # One row per block
+    related.rebuild()
+    assert neighbours() == whole
+
+
+def test_updates_move_an_edited_post_and_drop_a_deleted_one(app, posts):
+    app.config['RELATED_TOP_K'] = 3
+    related.rebuild()
+    moved = posts[0]
+    moved.content = f'<p>{TOPICS["farms"]}</p>'
+    moved.title = 'farms again'
+    db.session.commit()
+    related.update(moved.id)
+    lists = neighbours()
+    assert {topic(i) for i in lists[moved.id]} == {'farms'}
+    assert all(moved.id not in lists[p.id] for p in posts[1:4])
+
+    gone = posts[5].id
+    related.remove_post(gone)
+    db.session.delete(posts[5])
+    db.session.commit()
+    related.update(gone)
+    lists = neighbours()
+    assert gone not in lists and all(gone not in ids for ids in lists.values())
+    assert related.Model.load(app.config['RELATED_MODEL_PATH']).rows.get(gone) is None
+
+
+def test_update_rebuilds_once_too_many_posts_are_new(app, posts, admin):
+    related.rebuild()
+    added = [Post(title=f'rates extra {i}', slug=f'rates-extra-{i}', author_id=admin.id, content=f'<p>{TOPICS["rates"]}</p>')
+             for i in range(3)]
+    db.session.add_all(added)
+    db.session.commit()
+    for post in added:
+        related.update(post.id)
+    model = related.Model.load(app.config['RELATED_MODEL_PATH'])
+    assert model.built_size == len(posts) + len(added)
+    assert all(p.id in neighbours() for p in added)
+
+
+def test_markup_and_stop_words_are_not_terms():
+    post = Post(title='The Budget', content='<p class="lead">the budget &amp; the <b>deficit</b></p>', category='Business')
+    assert dict(related.term_counts(post)) == {
+        'budget': 1 + related.TITLE_WEIGHT, 'deficit': 1, 'category:business': 1,
+    }
@@ -0,0 +1,51 @@
+import json
+
+from rendering import render
+
+
+def test_embed_does_not_swallow_the_rest_of_the_article():
+    out = render('<p>a</p><embed src="x.swf"><p>rest of article</p>')
+    assert out['content_html'] == '<p>a</p><p>rest of article</p>'
+    assert out['word_count'] == 4
+
+
+def test_self_closed_svg_does_not_swallow_the_rest_of_the_article():
+    out = render('<p>before</p><svg/><p>after</p>')
+    assert out['content_html'] == '<p>before</p><p>after</p>'
+
+
+def test_svg_with_content_is_dropped_entirely():
+    out = render('<p>a</p><svg><script>x()</script><text>label</text></svg><p>b</p>')
+    assert out['content_html'] == '<p>a</p><p>b</p>'
+
+
+def test_unclosed_script_at_end_of_input_is_dropped():
+    out = render('<p>kept</p><script>alert(1)')
+    assert out['content_html'] == '<p>kept</p>'
+    assert 'alert' not in out['excerpt']
+
+
+def test_unsafe_urls_and_attributes_are_removed():
+    out = render('<a href=" java\nscript:alert(1)" onclick="x()">link</a><img src="javascript:x">')
+    assert out['content_html'] == '<a>link</a>'
+
+
+def test_unclosed_paragraphs_and_list_items_are_closed():
+    assert render('<p>one<p>two').get('content_html') == '<p>one</p><p>two</p>'
+    assert render('<ul><li>a<li>b</ul>')['content_html'] == '<ul><li>a</li><li>b</li></ul>'
+
+
+def test_headings_get_unique_anchors_and_a_toc():
+    out = render('<h2>Intro</h2><h3>Intro</h3><h2></h2>')
+    assert out['content_html'] == '<h2 id="intro">Intro</h2><h3 id="intro-2">Intro</h3><h2></h2>'
+    assert json.loads(out['toc']) == [
+        {'level': 2, 'id': 'intro', 'title': 'Intro'},
+        {'level': 3, 'id': 'intro-2', 'title': 'Intro'},
+    ]
+
+
+def test_excerpt_and_reading_time():
+    out = render('<p>' + 'word ' * 450 + '</p>')
+    assert out['word_count'] == 450
+    assert out['reading_minutes'] == 3
+    assert out['excerpt'].endswith('…') and len(out['excerpt']) <= 201
@@ -0,0 +1,46 @@
+import pytest
+from jinja2 import DictLoader
+
+from app import db
+from cache import invalidate_global_data
+from models import Category
+from response_cache import invalidate
+
+NAV = '{% for c in nav_categories %}{{ c.name }};{% endfor %}'
+
+
+@pytest.fixture
+def workers(make_app, tmp_path):
+    # Two workers sharing the database and the sqlite response cache
+    config = {
+        'RESPONSE_CACHE_BACKEND': 'sqlite',
+        'RESPONSE_CACHE_PATH': str(tmp_path / 'response_cache.db'),
+        'GLOBAL_DATA_CHECK_SECONDS': 60,
+    }
+    apps = [make_app(**config), make_app(**config)]
+    for app in apps:
+        app.jinja_env.loader = DictLoader({'about_us.html': NAV})
+    return apps
+
+
+def test_pages_are_cached_and_revalidate(workers):
+    client = workers[0].test_client()
+    first = client.get('/about')
+    assert 'World;' in first.get_data(as_text=True)
+    assert first.headers['Cache-Control'] == 'public, max-age=0, must-revalidate'
+    assert client.get('/about', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+
+def test_lagging_worker_never_serves_its_stale_page_to_others(workers):
+    fresh, lagging = workers
+    assert 'Zines;' not in lagging.test_client().get('/about').get_data(as_text=True)
+
+    with fresh.app_context():
+        db.session.add(Category(name='Zines'))
+        invalidate_global_data()
+        db.session.commit()
+        invalidate('global')
+
+    # The lagging worker re-renders from its old global data and stores the page again
+    assert 'Zines;' not in lagging.test_client().get('/about').get_data(as_text=True)
+    assert 'Zines;' in fresh.test_client().get('/about').get_data(as_text=True)
@@ -0,0 +1,79 @@
+import pytest
+
+import search_index
+from app import db
+from models import Post
+from search_index import index_post, rebuild_index, remove_post, search_posts
+
+
+@pytest.fixture(params=['fts', 'like'])
+def backend(request, app, monkeypatch):
+    if request.param == 'like':
+        monkeypatch.setattr(search_index, 'fts_enabled', lambda: False)
+    elif not search_index.fts_enabled():
+        pytest.skip('SQLite was built without FTS5')
+    return request.param
+
+
+def add(admin, title, content, **fields):
+    post = Post(title=title, slug=title.lower().replace(' ', '-'), content=content, author_id=admin.id, **fields)
+    db.session.add(post)
+    db.session.flush()
+    index_post(post)
+    db.session.commit()
+    return post
+
+
+def test_every_term_must_match_as_a_prefix(admin, backend):
+    both = add(admin, 'Inflation outlook', '<p>Central banks and inflation</p>')
+    add(admin, 'Bank holiday', '<p>Closed on Monday</p>')
+    assert [p.id for p in search_posts('infl bank').posts] == [both.id]
+    assert search_posts('  ').hits == []
+    assert search_posts('!!').hits == []
+
+
+def test_title_matches_rank_first(admin, backend):
+    if backend == 'like':
+        pytest.skip('The LIKE fallback orders by date')
+    body = add(admin, 'Quarterly notes', '<p>tariffs tariffs tariffs everywhere</p>')
+    title = add(admin, 'Tariffs explained', '<p>A primer on trade.</p>')
+    assert [p.id for p in search_posts('tariffs').posts] == [title.id, body.id]
+
+
+def test_markup_is_indexed_as_text_and_highlights_are_escaped(admin, backend):
+    add(admin, '<script>alert(1)</script> Budget', '<p>The <b>budget</b> &amp; the deficit</p>')
+    hit, = search_posts('budget').hits
+    assert '<script>' not in hit.title_html
+    assert '&lt;script&gt;' in hit.title_html
+    assert '<mark>Budget</mark>' in hit.title_html
+    assert '<b>' not in hit.snippet_html and '<mark>budget</mark>' in hit.snippet_html
+    if backend == 'fts':
+        # Entities are decoded before indexing
+        assert search_posts('amp').hits == []
+
+
+def test_pages(admin, backend):
+    for i in range(5):
+        add(admin, f'Energy {i}', '<p>grid</p>')
+    first, second, third = (search_posts('energy', page=n, per_page=2) for n in (1, 2, 3))
+    assert (first.has_prev, first.has_next, first.next_num) == (False, True, 2)
+    assert (third.has_next, third.prev_num, len(third.hits)) == (False, 2, 1)
+    assert len({p.id for r in (first, second, third) for p in r.posts}) == 5
+    assert search_posts('energy', page=0).page == 1
+
+
+def test_index_follows_edits_and_deletes(app, admin):
+    if not search_index.fts_enabled():
+        pytest.skip('SQLite was built without FTS5')
+    post = add(admin, 'Housing', '<p>rents</p>')
+    post.title = 'Shipping'
+    index_post(post)
+    db.session.commit()
+    assert search_posts('housing').hits == []
+    assert [p.id for p in search_posts('shipping').posts] == [post.id]
+
+    remove_post(post.id)
+    db.session.delete(post)
+    db.session.commit()
+    assert search_posts('shipping').hits == []
+    assert rebuild_index() == Post.query.count()
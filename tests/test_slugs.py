@@ -0,0 +1,41 @@
+import sqlite3
+
+from app import db
+from models import Post
+from slugs import flush_with_slug, next_slug
+
+
+def test_next_slug_fills_after_the_highest_suffix():
+    assert next_slug('a', []) == 'a'
+    assert next_slug('a', ['a', 'a-2', 'a-b']) == 'a-3'
+    assert next_slug('a', ['a-2']) == 'a'
+
+
+def test_flush_with_slug_dedupes(app, admin):
+    first = Post(title='Hello', content='x', author_id=admin.id)
+    second = Post(title='Hello!', content='x', author_id=admin.id)
+    assert flush_with_slug(first, first.title) == 'hello'
+    assert flush_with_slug(second, second.title) == 'hello-1'
+    db.session.commit()
+
+
+def test_flush_with_slug_does_not_commit(app, admin):
+    post = Post(title='Draft', content='x', author_id=admin.id)
+    flush_with_slug(post, post.title)
+    path = db.engine.url.database
+    with sqlite3.connect(path) as other:
+        assert other.execute("SELECT count(*) FROM post WHERE slug = 'draft'").fetchone()[0] == 0
+    db.session.rollback()
+    assert db.session.query(Post).filter_by(slug='draft').count() == 0
+
+
+def test_flush_with_slug_retries_after_a_conflict(app, admin, monkeypatch):
+    import slugs
+    db.session.add(Post(title='Taken', slug='taken', content='x', author_id=admin.id))
+    db.session.commit()
+    answers = iter(['taken', 'taken-1'])
+    monkeypatch.setattr(slugs, 'allocate_slug', lambda title, exclude_id=None: next(answers))
+    post = Post(title='Taken', content='x', author_id=admin.id)
+    assert flush_with_slug(post, post.title) == 'taken-1'
+    db.session.commit()
+    assert {p.slug for p in Post.query} == {'taken', 'taken-1'}
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+from jinja2 import ChoiceLoader, DictLoader
+
+from app import db
+from models import Category, Post
+from static_export import all_paths, feed_paths, output_path
+
+NAV = '{% for c in nav_categories %}{{ c.name }};{% endfor %}'
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(STATIC_EXPORT_ENABLED=True)
+    app.jinja_env.loader = ChoiceLoader([
+        DictLoader({'index.html': NAV, 'about_us.html': '{{ social_links.twitter_url }}'}),
+        app.jinja_env.loader,
+    ])
+    # Render in the request instead of on the background thread
+    exporter = app.extensions['static_export']
+    exporter.submit = exporter._render
+    with app.app_context():
+        yield app
+
+
+def exported(app, path):
+    target = output_path(app.config['STATIC_EXPORT_DIR'], path)
+    if not os.path.exists(target):
+        return None
+    with open(target) as f:
+        return f.read()
+
+
+def test_layout():
+    assert output_path('/out', '/') == '/out/index.html'
+    assert output_path('/out', '/?category=Big%20Ideas') == '/out/category/Big%20Ideas/index.html'
+    assert output_path('/out', '/post/hello') == '/out/post/hello/index.html'
+    assert output_path('/out', '/about') == '/out/about/index.html'
+
+
+def test_only_the_first_page_of_a_feed_is_exported(app, admin):
+    db.session.add_all([Post(title=f'P{i}', slug=f'p-{i}', content='x', category='Tech', author_id=admin.id)
+                        for i in range(20)])
+    db.session.commit()
+    assert feed_paths() == ['/']
+    assert feed_paths('Big Ideas') == ['/?category=Big%20Ideas']
+    paths = all_paths()
+    assert not any('page=' in path or 'cursor=' in path for path in paths)
+    assert {'/', '/about', '/services', '/?category=Tech', '/post/p-0', '/post/p-19'} <= set(paths)
+
+
+def test_category_changes_re_export_every_page(app, admin_client):
+    admin_client.post('/category/add', data={'name': 'Zines'})
+    assert 'Zines;' in exported(app, '/')
+    assert exported(app, '/?category=Zines') is not None
+
+    db.session.rollback()
+    category = Category.query.filter_by(name='Zines').one()
+    admin_client.post(f'/category/delete/{category.id}')
+    assert 'Zines;' not in exported(app, '/')
+    assert exported(app, '/?category=Zines') is None
+
+
+def test_settings_change_re_exports_pages(app, admin_client):
+    admin_client.post('/settings', data={'twitter_url': 'https://twitter.example/mind'})
+    assert exported(app, '/about') == 'https://twitter.example/mind'
@@ -0,0 +1,114 @@
+import io
+import os
+import threading
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from app import db
+from models import Submission
+from storage import UploadTooLarge, discard, save_upload, set_image, upload_root
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 16
+
+
+def upload(data, name='a.png'):
+    return FileStorage(stream=io.BytesIO(data), filename=name)
+
+
+def stored_files():
+    root = upload_root()
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, _, files in os.walk(root) for f in files)
+
+
+@pytest.fixture
+def small_limits(app):
+    app.config['UPLOAD_SIZE_LIMITS'] = {'image': 100, 'document': 200, 'archive': 200}
+
+
+def test_uploads_are_stored_once_by_content(app):
+    first = save_upload(upload(b'same bytes'))
+    again = save_upload(upload(b'same bytes', 'b.png'))
+    assert first.created and not again.created
+    assert first.url == again.url == f'uploads/{first.content_hash[:2]}/{first.content_hash}.png'
+    assert stored_files() == [f'{first.content_hash[:2]}/{first.content_hash}.png']
+    assert save_upload(upload(b'x', 'script.sh')) is None
+
+
+def test_concurrent_uploads_of_new_content_create_it_once(app):
+    barrier = threading.Barrier(8)
+    results = []
+
+    def store():
+        with app.app_context():
+            barrier.wait()
+            results.append(save_upload(upload(b'racing bytes')))
+
+    threads = [threading.Thread(target=store) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(stored.created for stored in results) == 1
+    assert stored_files() == [results[0].url.split('/', 1)[1]]
+
+
+def test_mime_type_comes_from_the_content(app):
+    assert save_upload(upload(PNG, 'a.png')).mime_type == 'image/png'
+    assert save_upload(upload(PNG, 'a.jpg')).mime_type == 'application/octet-stream'
+    assert save_upload(upload(b'<script>', 'b.png')).mime_type == 'application/octet-stream'
+    assert save_upload(upload(b'%PDF-1.7', 'c.pdf')).mime_type == 'application/pdf'
+    assert save_upload(upload(b'notes', 'd.txt')).mime_type == 'text/plain'
+
+
+def test_discard_keeps_files_a_saved_row_uses(app):
+    stored = save_upload(upload(b'shared'))
+    # Another request stored the same bytes meanwhile and committed
+    submission = Submission(author_name='a', author_email='a@example.com', title='t', content='c')
+    set_image(submission, stored)
+    db.session.add(submission)
+    db.session.commit()
+    discard([stored])
+    assert stored_files() == [stored.url.split('/', 1)[1]]
+    db.session.delete(submission)
+    db.session.commit()
+    discard([stored])
+    assert stored_files() == []
+
+
+def test_oversized_upload_leaves_nothing_behind(app, small_limits):
+    with pytest.raises(UploadTooLarge):
+        save_upload(upload(b'x' * 101))
+    assert stored_files() == []
+
+
+def test_rejected_attachment_removes_files_the_request_wrote(app, admin_client, small_limits):
+    kept = save_upload(upload(b'already here', 'old.png'))
+    response = admin_client.post('/create', data={
+        'title': 'T', 'content': 'x',
+        'image': (io.BytesIO(b'new image'), 'new.png'),
+        'attachments': [(io.BytesIO(b'already here'), 'dup.png'),
+                        (io.BytesIO(b'y' * 201), 'big.pdf')],
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+    assert stored_files() == [kept.url.split('/', 1)[1]]
+
+
+def test_incomplete_form_removes_its_upload(app, admin_client):
+    admin_client.post('/create', data={'title': '', 'image': (io.BytesIO(b'img'), 'i.png')},
+                      content_type='multipart/form-data')
+    assert stored_files() == []
+
+
+def test_route_limit_applies_without_content_length(app, client, small_limits):
+    # /submit allows one image plus 1 MB of form fields
+    body = (b'--XX\r\nContent-Disposition: form-data; name="image"; filename="a.png"\r\n\r\n'
+            + b'x' * (2 * 1024 * 1024) + b'\r\n--XX--\r\n')
+    # A chunked body, as a WSGI server hands it over: no length, stream ends at the last chunk
+    response = client.post('/submit', input_stream=io.BytesIO(body), headers={
+        'Content-Type': 'multipart/form-data; boundary=XX', 'Transfer-Encoding': 'chunked'},
+        environ_overrides={'wsgi.input_terminated': True})
+    assert response.status_code == 413
+    response = client.post('/submit', data=body, content_type='multipart/form-data; boundary=XX')
+    assert response.status_code == 413
+    assert stored_files() == []
@@ -0,0 +1,77 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import syndication
+from app import db
+from models import Post
+
+
+@pytest.fixture
+def posts(app, admin):
+    start = datetime(2026, 1, 1)
+    rows = [
+        Post(title=f'Post <{i}> & co', slug=f'post-{i}', content='x', content_html=f'<p>body {i}</p>', excerpt=f'body {i}',
+             category='World' if i % 2 else 'Tech', author_id=admin.id, created_at=start + timedelta(hours=i))
+        for i in range(5)
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def cached(app):
+    return sorted(name for name in os.listdir(app.config['SYNDICATION_DIR']) if name.endswith('.xml'))
+
+
+def test_feed_is_cached_and_revalidates(app, client, posts):
+    response = client.get('/feed.atom')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/atom+xml'
+    body = response.get_data(as_text=True)
+    assert '<title>Post &lt;4&gt; &amp; co</title>' in body
+    assert 'https://example.org/post/post-4' in body
+    assert cached(app) == ['atom.xml']
+    again = client.get('/feed.atom', headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_spoofed_host_never_reaches_a_cached_file(app, client, posts):
+    response = client.get('/feed.rss', headers={'Host': 'evil.test'})
+    assert 'evil.test' not in response.get_data(as_text=True)
+
+
+def test_documents_are_not_cached_without_a_trusted_host(app, client, posts):
+    app.config['SITE_URL'] = ''
+    response = client.get('/feed.rss', base_url='http://local.test')
+    assert 'http://local.test/post/post-4' in response.get_data(as_text=True)
+    assert not os.path.exists(app.config['SYNDICATION_DIR']) or cached(app) == []
+
+
+def test_failed_build_leaves_no_temp_file(app, client, posts, monkeypatch):
+    def broken(xml):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(syndication, '_sitemap_index', broken)
+    with pytest.raises(RuntimeError):
+        client.get('/sitemap.xml')
+    assert os.listdir(app.config['SYNDICATION_DIR']) == ['.lock']
+
+
+def test_invalidation_drops_only_affected_documents(app, client, posts):
+    for path in ('/feed.atom', '/category/World/feed.atom', '/category/Tech/feed.atom', '/sitemap-posts-0.xml'):
+        assert client.get(path).status_code == 200
+    syndication.invalidate_documents([posts[1].id], ['World'])
+    assert cached(app) == ['atom%3ATech.xml']
+
+
+def test_sitemaps(app, client, posts):
+    index = client.get('/sitemap.xml').get_data(as_text=True)
+    assert '<loc>https://example.org/sitemap-posts-0.xml</loc>' in index
+    shard = client.get('/sitemap-posts-0.xml').get_data(as_text=True)
+    assert shard.count('<url>') == 5
+    assert client.get('/sitemap-posts-1.xml').status_code == 404
+
+
+def test_unknown_category_feed_is_404(client, posts):
+    assert client.get('/category/nope/feed.atom').status_code == 404
@@ -0,0 +1,9 @@
+import os
+from app import create_app
+from jobs import Worker
+
+app = create_app()
+
+if __name__ == '__main__':
+    threads = int(os.getenv('JOB_WORKER_THREADS', '2'))
+    Worker(app, threads=threads).run()